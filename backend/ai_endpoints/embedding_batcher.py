@@ -0,0 +1,121 @@
+"""
+Micro-batching delle richieste di embedding concorrenti.
+
+Le richieste single-text (/api/embeddings/compute, /api/intents/classify-embedding)
+vengono raccolte per pochi millisecondi (OMNIA_EMBEDDINGS_BATCH_MAX_WAIT_MS) o
+fino a N testi (OMNIA_EMBEDDINGS_BATCH_MAX_SIZE) e codificate con una sola
+model.encode(list) nel pool di encoding. Ogni chiamante riceve il proprio vettore;
+testi identici nello stesso batch vengono codificati una volta sola.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from .embedding_executor import run_encode
+
+DEFAULT_MAX_BATCH = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = float(raw)
+        return value if value >= 0 else default
+    except ValueError:
+        return default
+
+
+class EmbeddingMicroBatcher:
+    """
+    encode_many(texts) -> sequenza di vettori (una riga per testo), eseguita nel pool.
+
+    Lo stato (coda + timer) appartiene all'event loop corrente: uvicorn ne ha uno
+    per worker, quindi un batcher per processo è sufficiente.
+    """
+
+    def __init__(
+        self,
+        encode_many: Callable[[List[str]], Sequence[Any]],
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ) -> None:
+        self._encode_many = encode_many
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Riferimenti forti ai batch in corso: il loop tiene solo weak reference ai task
+        self._running: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.texts = 0
+
+    async def encode(self, text: str) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Nuovo event loop (es. test client): lo stato del loop precedente non è più valido
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+            self._running = set()
+
+        fut: asyncio.Future = loop.create_future()
+        self._pending.append((text, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        unique: Dict[str, int] = {}
+        for text, _ in batch:
+            unique.setdefault(text, len(unique))
+        texts = list(unique.keys())
+        self.batches += 1
+        self.texts += len(batch)
+        try:
+            vectors = await run_encode(self._encode_many, texts)
+        except asyncio.CancelledError:
+            for _, fut in batch:
+                fut.cancel()
+            raise
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for text, fut in batch:
+            if not fut.done():
+                fut.set_result(vectors[unique[text]])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "maxBatch": self.max_batch,
+            "maxWaitMs": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "texts": self.texts,
+            "avgBatchSize": (self.texts / self.batches) if self.batches else 0.0,
+        }
+
+
+def create_micro_batcher(encode_many: Callable[[List[str]], Sequence[Any]]) -> EmbeddingMicroBatcher:
+    return EmbeddingMicroBatcher(
+        encode_many,
+        max_batch=int(_env_number("OMNIA_EMBEDDINGS_BATCH_MAX_SIZE", DEFAULT_MAX_BATCH)),
+        max_wait_ms=_env_number("OMNIA_EMBEDDINGS_BATCH_MAX_WAIT_MS", DEFAULT_MAX_WAIT_MS),
+    )
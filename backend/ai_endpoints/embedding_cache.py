@@ -0,0 +1,137 @@
+"""
+Cache LRU/TTL testo -> embedding, limitata in byte.
+
+Chiave: (nome modello, testo normalizzato). La normalizzazione è solo
+Unicode NFC + trim + spazi collassati: il modello è case-sensitive, quindi
+maiuscole/minuscole restano parte della chiave e un hit è sempre identico
+al vettore che il modello produrrebbe.
+
+Limite: OMNIA_EMBEDDINGS_CACHE_MAX_BYTES (0 disabilita la cache),
+scadenza: OMNIA_EMBEDDINGS_CACHE_TTL_SEC (0 = nessuna scadenza).
+Contatori hit/miss/eviction esposti via /api/embeddings/cache-stats.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL_SEC = 3600.0
+
+# Overhead stimato per entry (chiave, tuple, OrderedDict node, header ndarray)
+_ENTRY_OVERHEAD_BYTES = 200
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WS_RE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def _env_number(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = float(raw)
+        return value if value >= 0 else default
+    except ValueError:
+        return default
+
+
+class EmbeddingCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, ttl_sec: float = DEFAULT_TTL_SEC) -> None:
+        self.max_bytes = int(max_bytes)
+        self.ttl_sec = float(ttl_sec)
+        self._lock = threading.Lock()
+        # key -> (vector, expires_at, size)
+        self._items: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        if not self.enabled:
+            return None
+        key = (model, normalize_text(text))
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            vector, expires_at, size = item
+            if expires_at and expires_at < time.monotonic():
+                self._drop(key, size)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, model: str, text: str, vector: Any) -> np.ndarray:
+        """Salva una copia float32 read-only del vettore e la ritorna."""
+        arr = np.array(vector, dtype=np.float32).reshape(-1)
+        arr.setflags(write=False)
+        if not self.enabled:
+            return arr
+        key = (model, normalize_text(text))
+        size = arr.nbytes + len(key[1].encode("utf-8")) + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return arr
+        expires_at = time.monotonic() + self.ttl_sec if self.ttl_sec > 0 else 0.0
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._items[key] = (arr, expires_at, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._items:
+                old_key, (_, _, old_size) = next(iter(self._items.items()))
+                self._drop(old_key, old_size)
+                self.evictions += 1
+        return arr
+
+    def _drop(self, key: Tuple[str, str], size: int) -> None:
+        self._items.pop(key, None)
+        self._bytes -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "ttlSec": self.ttl_sec,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hitRate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+def create_embedding_cache() -> EmbeddingCache:
+    return EmbeddingCache(
+        max_bytes=int(_env_number("OMNIA_EMBEDDINGS_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+        ttl_sec=_env_number("OMNIA_EMBEDDINGS_CACHE_TTL_SEC", DEFAULT_TTL_SEC),
+    )
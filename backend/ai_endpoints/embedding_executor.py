@@ -0,0 +1,113 @@
+"""
+Pool dedicato per le chiamate CPU-bound a SentenceTransformer (model.encode, load).
+
+Gli endpoint async non devono chiamare model.encode sull'event loop: ogni job va
+su un ThreadPoolExecutor limitato (OMNIA_EMBEDDINGS_WORKERS thread) con una coda
+massima (OMNIA_EMBEDDINGS_MAX_QUEUE job tra in esecuzione e in attesa). Oltre la
+coda il job viene rifiutato subito con EncodeQueueFull (-> HTTP 503), invece di
+accumulare richieste che scadrebbero comunque.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_WORKERS = 1
+DEFAULT_MAX_QUEUE = 32
+
+# Intervallo di polling per i job che attendono uno slot invece di essere rifiutati
+_WAIT_POLL_SEC = 0.05
+
+
+class EncodeQueueFull(RuntimeError):
+    """La coda del pool di encoding è piena: il chiamante deve rispondere 503."""
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = int(raw)
+        return value if value > 0 else default
+    except ValueError:
+        return default
+
+
+class EncodeExecutor:
+    def __init__(self, workers: int, max_queue: int) -> None:
+        self.workers = workers
+        self.max_queue = max(max_queue, workers)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embeddings-encode")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+
+    def _try_acquire(self) -> bool:
+        with self._lock:
+            if self._pending >= self.max_queue:
+                return False
+            self._pending += 1
+            return True
+
+    def _release(self) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any, wait: bool = False, **kwargs: Any) -> Any:
+        """
+        Esegue fn(*args, **kwargs) nel pool e ne attende il risultato.
+
+        Con wait=False (default) una coda piena solleva EncodeQueueFull; con
+        wait=True si attende uno slot libero (usato dai batch di un training
+        già avviato, che non deve fallire a metà).
+        """
+        while not self._try_acquire():
+            if not wait:
+                with self._lock:
+                    self._rejected += 1
+                raise EncodeQueueFull(
+                    f"Embedding queue full ({self.max_queue} pending jobs)"
+                )
+            await asyncio.sleep(_WAIT_POLL_SEC)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "maxQueue": self.max_queue,
+                "pending": self._pending,
+                "rejected": self._rejected,
+                "completed": self._completed,
+            }
+
+
+_executor: Optional[EncodeExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_encode_executor() -> EncodeExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = EncodeExecutor(
+                    workers=_env_int("OMNIA_EMBEDDINGS_WORKERS", DEFAULT_WORKERS),
+                    max_queue=_env_int("OMNIA_EMBEDDINGS_MAX_QUEUE", DEFAULT_MAX_QUEUE),
+                )
+    return _executor
+
+
+async def run_encode(fn: Callable[..., Any], *args: Any, wait: bool = False, **kwargs: Any) -> Any:
+    """Scorciatoia: get_encode_executor().run(...)."""
+    return await get_encode_executor().run(fn, *args, wait=wait, **kwargs)
@@ -0,0 +1,282 @@
+"""
+Indici approssimati (ANN) per cataloghi di intent molto grandi.
+
+Selezionabili con OMNIA_EMBEDDINGS_ANN:
+- ``brute`` (default): nessun ANN, ogni classify calcola lo score esatto su tutti gli intent
+- ``ivf``: inverted file in puro NumPy sulle frasi matching
+
+L'ANN produce solo una shortlist di intent candidati; lo score finale (best match +
+penalità not-matching) resta quello esatto di score_intent, calcolato sui soli candidati.
+
+IVF: centroidi k-means (sferico) addestrati quando lo store supera
+OMNIA_EMBEDDINGS_ANN_MIN_ROWS frasi; ogni frase finisce nella posting list del
+centroide più vicino. Quando train_intent aggiorna un intent vengono ricalcolate
+solo le posting list che contenevano o contengono le sue frasi. I centroidi
+vengono riaddestrati solo quando il numero di frasi è cresciuto di
+_RETRAIN_GROWTH volte rispetto all'ultimo addestramento.
+
+L'addestramento parte da update() (mai da candidates()): di default in un thread in
+background sul k-means di uno snapshot, così nessuna classify ne paga il costo;
+finché non è pronto candidates() ritorna None e il chiamante usa il brute force.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .intent_embedding_index import IntentMatrices
+
+DEFAULT_N_PROBE = 8
+DEFAULT_MIN_ROWS = 5000
+DEFAULT_SHORTLIST = 50
+
+_KMEANS_ITERATIONS = 10
+_KMEANS_MAX_SAMPLE = 20000
+_RETRAIN_GROWTH = 4.0
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = int(raw)
+        return value if value >= 0 else default
+    except ValueError:
+        return default
+
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (mat / norms).astype(np.float32)
+
+
+def spherical_kmeans(data: np.ndarray, k: int, iterations: int = _KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    """Centroidi normalizzati (k, dim) per dati con righe normalizzate."""
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, data.shape[0]))
+    centroids = data[rng.choice(data.shape[0], size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        empty = ~sums.any(axis=1)
+        if empty.any():
+            # Cluster vuoti: ripartono da punti casuali
+            sums[empty] = data[rng.choice(data.shape[0], size=int(empty.sum()))]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+
+class IvfAnnIndex:
+    """Shortlist di intent via IVF sulle frasi matching."""
+
+    def __init__(
+        self,
+        n_lists: int = 0,
+        n_probe: int = DEFAULT_N_PROBE,
+        min_rows: int = DEFAULT_MIN_ROWS,
+        shortlist: int = DEFAULT_SHORTLIST,
+        background_training: bool = True,
+    ) -> None:
+        self.n_lists = n_lists  # 0 = automatico (~sqrt(frasi))
+        self.n_probe = max(1, n_probe)
+        self.min_rows = min_rows
+        self.shortlist = max(1, shortlist)
+        self.background_training = background_training
+        self._lock = threading.RLock()
+        self._trainer: Optional[threading.Thread] = None
+        self._rows = 0
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._codes: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._trained_rows = 0
+        # Stato delle posting list
+        self._assign: Dict[str, np.ndarray] = {}
+        self._members: List[Set[str]] = []
+        self._packed: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._dirty: Set[int] = set()
+
+    # ---------------------------------------------------------------- updates
+
+    def update(self, intent_id: str, entry: IntentMatrices) -> None:
+        vectors = _normalize_rows(entry.matching_float32()) if entry.matching_count else None
+        with self._lock:
+            self._unassign(intent_id)
+            self._drop_vectors(intent_id)
+            if vectors is None:
+                return
+            if intent_id not in self._codes:
+                self._codes[intent_id] = len(self._ids)
+                self._ids.append(intent_id)
+            self._vectors[intent_id] = vectors
+            self._rows += vectors.shape[0]
+            if self._centroids is not None and vectors.shape[1] == self._centroids.shape[1]:
+                self._assign_rows(intent_id, vectors)
+            start = self._needs_training()
+        if start:
+            self._start_training()
+
+    def remove(self, intent_id: str) -> None:
+        with self._lock:
+            self._unassign(intent_id)
+            self._drop_vectors(intent_id)
+
+    def _drop_vectors(self, intent_id: str) -> None:
+        old = self._vectors.pop(intent_id, None)
+        if old is not None:
+            self._rows -= old.shape[0]
+
+    def _unassign(self, intent_id: str) -> None:
+        old = self._assign.pop(intent_id, None)
+        if old is None:
+            return
+        for c in np.unique(old):
+            self._members[int(c)].discard(intent_id)
+            self._dirty.add(int(c))
+
+    def _assign_rows(self, intent_id: str, vectors: np.ndarray) -> None:
+        assign = np.argmax(vectors @ self._centroids.T, axis=1)
+        self._assign[intent_id] = assign
+        for c in np.unique(assign):
+            self._members[int(c)].add(intent_id)
+            self._dirty.add(int(c))
+
+    # --------------------------------------------------------------- training
+
+    @property
+    def total_rows(self) -> int:
+        with self._lock:
+            return self._rows
+
+    def _needs_training(self) -> bool:
+        if self._trainer is not None or self._rows < max(1, self.min_rows):
+            return False
+        return self._centroids is None or self._rows >= self._trained_rows * _RETRAIN_GROWTH
+
+    def _start_training(self) -> None:
+        if not self.background_training:
+            self.train()
+            return
+        with self._lock:
+            if self._trainer is not None:
+                return
+            self._trainer = threading.Thread(target=self.train, name="intent-ivf-train", daemon=True)
+            self._trainer.start()
+
+    def wait_trained(self, timeout: Optional[float] = None) -> bool:
+        """Attende l'eventuale addestramento in background; True se l'indice è pronto."""
+        trainer = self._trainer
+        if trainer is not None and trainer is not threading.current_thread():
+            trainer.join(timeout)
+        with self._lock:
+            return self._centroids is not None
+
+    def train(self) -> None:
+        """k-means su uno snapshot delle frasi, fuori dal lock; poi installa centroidi e posting list."""
+        try:
+            with self._lock:
+                snapshot = dict(self._vectors)
+            total = sum(v.shape[0] for v in snapshot.values())
+            dims = {v.shape[1] for v in snapshot.values()}
+            if total < max(1, self.min_rows) or len(dims) != 1:
+                return
+            data = np.vstack(list(snapshot.values()))
+            if data.shape[0] > _KMEANS_MAX_SAMPLE:
+                idx = np.random.default_rng(0).choice(data.shape[0], size=_KMEANS_MAX_SAMPLE, replace=False)
+                data = data[idx]
+            n_lists = self.n_lists or max(1, int(math.sqrt(total)))
+            centroids = spherical_kmeans(data, n_lists)
+
+            with self._lock:
+                self._centroids = centroids
+                self._trained_rows = total
+                self._members = [set() for _ in range(centroids.shape[0])]
+                self._assign = {}
+                self._packed = {}
+                self._dirty = set()
+                # Anche gli intent aggiornati durante il k-means: _vectors è lo stato corrente
+                for intent_id, vectors in self._vectors.items():
+                    if vectors.shape[1] == centroids.shape[1]:
+                        self._assign_rows(intent_id, vectors)
+        finally:
+            with self._lock:
+                if self._trainer is threading.current_thread():
+                    self._trainer = None
+
+    def _pack(self, cluster: int) -> None:
+        blocks, owners = [], []
+        for intent_id in self._members[cluster]:
+            rows = self._vectors[intent_id][self._assign[intent_id] == cluster]
+            blocks.append(rows)
+            owners.append(np.full(rows.shape[0], self._codes[intent_id], dtype=np.int64))
+        if blocks:
+            self._packed[cluster] = (np.ascontiguousarray(np.vstack(blocks)), np.concatenate(owners))
+        else:
+            self._packed.pop(cluster, None)
+
+    # ----------------------------------------------------------------- search
+
+    def candidates(self, query: np.ndarray, limit: Optional[int] = None) -> Optional[List[str]]:
+        """
+        Intent candidati ordinati per similarità approssimata (al più limit/shortlist).
+        None se l'indice non è pronto (poche frasi, addestramento in corso) o se la
+        shortlist è vuota o più corta di limit: il chiamante usa il brute force.
+        """
+        limit = limit or self.shortlist
+        with self._lock:
+            if self._centroids is None or query.shape[0] != self._centroids.shape[1]:
+                return None
+            for cluster in self._dirty:
+                self._pack(cluster)
+            self._dirty = set()
+
+            n_probe = min(self.n_probe, self._centroids.shape[0])
+            probe = np.argpartition(-(self._centroids @ query), n_probe - 1)[:n_probe]
+            sims, owners = [], []
+            for cluster in probe:
+                packed = self._packed.get(int(cluster))
+                if packed is None:
+                    continue
+                sims.append(packed[0] @ query)
+                owners.append(packed[1])
+            if not sims:
+                return None
+            all_sims = np.concatenate(sims)
+            all_owners = np.concatenate(owners)
+            order = np.argsort(-all_sims)
+            ranked_owners = all_owners[order]
+            _, first = np.unique(ranked_owners, return_index=True)
+            best_first = ranked_owners[np.sort(first)][:limit]
+            if len(best_first) < limit:
+                return None
+            return [self._ids[int(code)] for code in best_first]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "intents": len(self._vectors),
+                "rows": self._rows,
+                "lists": 0 if self._centroids is None else int(self._centroids.shape[0]),
+                "probe": self.n_probe,
+                "shortlist": self.shortlist,
+                "trainedRows": self._trained_rows,
+            }
+
+
+def create_ann_index(kind: Optional[str] = None):
+    """Backend ANN da OMNIA_EMBEDDINGS_ANN (None = brute force esatto)."""
+    kind = (kind or os.environ.get("OMNIA_EMBEDDINGS_ANN") or "brute").strip().lower()
+    if kind == "ivf":
+        return IvfAnnIndex(
+            n_lists=_env_int("OMNIA_EMBEDDINGS_IVF_LISTS", 0),
+            n_probe=_env_int("OMNIA_EMBEDDINGS_IVF_PROBE", DEFAULT_N_PROBE),
+            min_rows=_env_int("OMNIA_EMBEDDINGS_ANN_MIN_ROWS", DEFAULT_MIN_ROWS),
+            shortlist=_env_int("OMNIA_EMBEDDINGS_ANN_SHORTLIST", DEFAULT_SHORTLIST),
+        )
+    return None
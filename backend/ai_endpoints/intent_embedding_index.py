@@ -0,0 +1,375 @@
+"""
+Indice vettoriale degli embeddings di training per intent.
+
+Ogni intent tiene le frasi matching / not-matching come matrici float32
+contigue con righe L2-normalizzate, costruite una volta al training: la
+classificazione diventa un prodotto matrice-vettore per intent invece di
+un loop Python su ogni coppia (frase, input).
+
+Storage compatto opzionale (vedi quantize_matrix): float16, oppure int8 con
+scala per riga (v ~= q * scale). Lo scoring lavora direttamente sulla forma
+quantizzata, convertendo a blocchi di righe invece dell'intera matrice.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Penalità per similarità con frasi not-matching (stessa logica del loop originale)
+NEGATIVE_THRESHOLD = 0.7
+NEGATIVE_PENALTY_WEIGHT = 0.5
+
+STORAGE_MODES = ("float32", "float16", "int8")
+
+# Righe convertite a float32 per volta quando si calcolano similarità su matrici quantizzate
+_SCORE_BLOCK_ROWS = 4096
+
+
+def as_matrix(vectors: Any, dim: Optional[int] = None) -> np.ndarray:
+    """Converte vettori (liste o array) in matrice float32 contigua con righe normalizzate."""
+    mat = np.asarray(vectors, dtype=np.float32)
+    if mat.size == 0:
+        return np.zeros((0, dim or 0), dtype=np.float32)
+    if mat.ndim == 1:
+        mat = mat.reshape(1, -1)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(mat / norms, dtype=np.float32)
+
+
+def as_query(vector: Any) -> np.ndarray:
+    """Vettore query float32 normalizzato (cosine = dot product)."""
+    q = np.asarray(vector, dtype=np.float32).reshape(-1)
+    n = float(np.linalg.norm(q))
+    return q / n if n > 0 else q
+
+
+def quantize_matrix(mat: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Converte una matrice float32 nel formato di storage richiesto.
+
+    Ritorna (matrice, scale): scale è None tranne per int8, dove ogni riga è
+    round(v / scale) con scale = max|v| / 127.
+    """
+    if mode == "float16":
+        return np.ascontiguousarray(mat, dtype=np.float16), None
+    if mode == "int8":
+        max_abs = np.abs(mat).max(axis=1) if mat.shape[0] else np.zeros((0,), dtype=np.float32)
+        scales = (max_abs / 127.0).astype(np.float32)
+        safe = np.where(scales > 0, scales, 1.0).reshape(-1, 1)
+        q = np.clip(np.rint(mat / safe), -127, 127).astype(np.int8)
+        return np.ascontiguousarray(q), scales
+    return np.ascontiguousarray(mat, dtype=np.float32), None
+
+
+def similarities(mat: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+    """mat @ query per matrici float32, float16 o int8 (+ scale per riga)."""
+    if mat.dtype == np.float32:
+        return mat @ query
+    out = np.empty(mat.shape[0], dtype=np.float32)
+    for start in range(0, mat.shape[0], _SCORE_BLOCK_ROWS):
+        block = mat[start:start + _SCORE_BLOCK_ROWS]
+        out[start:start + block.shape[0]] = block.astype(np.float32) @ query
+    if scales is not None:
+        out *= scales
+    return out
+
+
+def similarities_batch(mat: np.ndarray, scales: Optional[np.ndarray], queries: np.ndarray) -> np.ndarray:
+    """queries @ mat.T -> (n_query, n_righe), una sola moltiplicazione matrice-matrice."""
+    if mat.dtype == np.float32:
+        return queries @ mat.T
+    out = np.empty((queries.shape[0], mat.shape[0]), dtype=np.float32)
+    for start in range(0, mat.shape[0], _SCORE_BLOCK_ROWS):
+        block = mat[start:start + _SCORE_BLOCK_ROWS]
+        out[:, start:start + block.shape[0]] = queries @ block.astype(np.float32).T
+    if scales is not None:
+        out *= scales
+    return out
+
+
+@dataclass(frozen=True)
+class IntentMatrices:
+    """Training set di un intent: matrici (n, dim) + testi allineati per riga."""
+
+    matching: np.ndarray
+    matching_texts: Tuple[str, ...]
+    not_matching: np.ndarray
+    not_matching_texts: Tuple[str, ...]
+    # Solo per storage int8: scala per riga
+    matching_scales: Optional[np.ndarray] = None
+    not_matching_scales: Optional[np.ndarray] = None
+
+    @classmethod
+    def build(
+        cls,
+        matching: Sequence[Tuple[str, Any]],
+        not_matching: Sequence[Tuple[str, Any]],
+    ) -> "IntentMatrices":
+        """Costruisce le matrici da coppie (testo, embedding)."""
+        dim = 0
+        for _, emb in list(matching) + list(not_matching):
+            dim = len(emb)
+            break
+        return cls(
+            matching=as_matrix([e for _, e in matching], dim),
+            matching_texts=tuple(t for t, _ in matching),
+            not_matching=as_matrix([e for _, e in not_matching], dim),
+            not_matching_texts=tuple(t for t, _ in not_matching),
+        )
+
+    def quantized(self, mode: str) -> "IntentMatrices":
+        """Copia nello storage richiesto (float32 | float16 | int8)."""
+        if mode not in STORAGE_MODES or mode == self.storage_mode:
+            return self
+        matching, matching_scales = quantize_matrix(self.matching_float32(), mode)
+        not_matching, not_matching_scales = quantize_matrix(self.not_matching_float32(), mode)
+        return IntentMatrices(
+            matching=matching,
+            matching_texts=self.matching_texts,
+            not_matching=not_matching,
+            not_matching_texts=self.not_matching_texts,
+            matching_scales=matching_scales,
+            not_matching_scales=not_matching_scales,
+        )
+
+    def matching_float32(self) -> np.ndarray:
+        return _dequantize(self.matching, self.matching_scales)
+
+    def not_matching_float32(self) -> np.ndarray:
+        return _dequantize(self.not_matching, self.not_matching_scales)
+
+    @property
+    def storage_mode(self) -> str:
+        return self.matching.dtype.name
+
+    @property
+    def nbytes(self) -> int:
+        total = self.matching.nbytes + self.not_matching.nbytes
+        for scales in (self.matching_scales, self.not_matching_scales):
+            if scales is not None:
+                total += scales.nbytes
+        return int(total)
+
+    @property
+    def dim(self) -> int:
+        for mat in (self.matching, self.not_matching):
+            if mat.shape[0]:
+                return int(mat.shape[1])
+        return 0
+
+    @property
+    def matching_count(self) -> int:
+        return int(self.matching.shape[0])
+
+    @property
+    def not_matching_count(self) -> int:
+        return int(self.not_matching.shape[0])
+
+
+def score_intent(entry: IntentMatrices, query: np.ndarray) -> Tuple[float, str]:
+    """
+    Score di un intent per una query normalizzata.
+
+    best = max cosine sulle frasi matching (>0), meno la penalità
+    somma((neg - 0.7) * 0.5) per ogni not-matching sopra soglia.
+    """
+    if entry.dim != query.shape[0]:
+        return 0.0, ""
+
+    best_score = 0.0
+    best_text = ""
+    if entry.matching_count:
+        sims = similarities(entry.matching, entry.matching_scales, query)
+        i = int(np.argmax(sims))
+        if sims[i] > 0:
+            best_score = float(sims[i])
+            best_text = entry.matching_texts[i]
+
+    penalty = 0.0
+    if entry.not_matching_count:
+        neg = similarities(entry.not_matching, entry.not_matching_scales, query)
+        over = neg[neg > NEGATIVE_THRESHOLD]
+        if over.size:
+            penalty = float(((over - NEGATIVE_THRESHOLD) * NEGATIVE_PENALTY_WEIGHT).sum())
+
+    return max(0.0, best_score - penalty), best_text
+
+
+def score_intent_batch(entry: IntentMatrices, queries: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+    """Come score_intent per una matrice di query normalizzate (n_query, dim): (scores, best_texts)."""
+    n = queries.shape[0]
+    scores = np.zeros(n, dtype=np.float32)
+    texts = [""] * n
+    if n == 0 or entry.dim != queries.shape[1]:
+        return scores, texts
+
+    if entry.matching_count:
+        sims = similarities_batch(entry.matching, entry.matching_scales, queries)
+        idx = np.argmax(sims, axis=1)
+        best = sims[np.arange(n), idx]
+        scores = np.where(best > 0, best, 0.0).astype(np.float32)
+        texts = [entry.matching_texts[int(i)] if b > 0 else "" for i, b in zip(idx, best)]
+
+    if entry.not_matching_count:
+        neg = similarities_batch(entry.not_matching, entry.not_matching_scales, queries)
+        over = np.where(neg > NEGATIVE_THRESHOLD, neg - NEGATIVE_THRESHOLD, 0.0)
+        scores = scores - (over * NEGATIVE_PENALTY_WEIGHT).sum(axis=1)
+
+    return np.maximum(scores, 0.0), texts
+
+
+def _dequantize(mat: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    out = np.asarray(mat, dtype=np.float32)
+    if scales is not None:
+        out = out * scales.reshape(-1, 1)
+    return out
+
+
+class IntentIndex:
+    """
+    Registry thread-safe intent_id -> IntentMatrices (solo in memoria).
+
+    ann: backend opzionale (vedi intent_ann_index) che restringe classify a una
+    shortlist di intent candidati; None = brute force esatto su tutti gli intent.
+    """
+
+    def __init__(self, ann: Any = None) -> None:
+        self._lock = threading.RLock()
+        self._entries: Dict[str, IntentMatrices] = {}
+        self._ann = ann
+
+    @property
+    def ann(self) -> Any:
+        return self._ann
+
+    def _sync(self) -> None:
+        """Hook per sottoclassi che caricano entries da storage esterno (no-op in memoria)."""
+
+    def _set_entry(self, intent_id: str, entry: IntentMatrices) -> None:
+        with self._lock:
+            self._entries[intent_id] = entry
+        if self._ann is not None:
+            # Aggiornamento incrementale: solo le posting list di questo intent
+            self._ann.update(intent_id, entry)
+
+    def put(self, intent_id: str, entry: IntentMatrices) -> None:
+        self._set_entry(intent_id, entry)
+
+    def get(self, intent_id: str) -> Optional[IntentMatrices]:
+        self._sync()
+        with self._lock:
+            return self._entries.get(intent_id)
+
+    def remove(self, intent_id: str) -> None:
+        with self._lock:
+            self._entries.pop(intent_id, None)
+        if self._ann is not None:
+            self._ann.remove(intent_id)
+
+    def intent_ids(self) -> List[str]:
+        self._sync()
+        with self._lock:
+            return list(self._entries.keys())
+
+    def __contains__(self, intent_id: object) -> bool:
+        self._sync()
+        with self._lock:
+            return intent_id in self._entries
+
+    def __len__(self) -> int:
+        self._sync()
+        with self._lock:
+            return len(self._entries)
+
+    def classify(
+        self,
+        query: Any,
+        intent_ids: Optional[Iterable[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Ritorna [{intentId, score, bestMatchText}] con score > 0, ordinati per score decrescente."""
+        q = as_query(query)
+        self._sync()
+        ids = list(intent_ids) if intent_ids else None
+        if ids is None and self._ann is not None:
+            # Shortlist approssimata, poi score esatto (con penalità) solo sui candidati
+            ids = self._ann.candidates(q)
+        with self._lock:
+            if ids is None:
+                ids = list(self._entries.keys())
+            entries = [(i, self._entries.get(i)) for i in ids]
+
+        results: List[Dict[str, Any]] = []
+        for intent_id, entry in entries:
+            if entry is None:
+                continue
+            score, best_text = score_intent(entry, q)
+            if score > 0:
+                results.append({
+                    "intentId": intent_id,
+                    "score": score,
+                    "bestMatchText": best_text,
+                })
+
+        results.sort(key=lambda x: x["score"], reverse=True)
+        return results
+
+    def classify_batch(
+        self,
+        queries: Any,
+        intent_ids: Optional[Iterable[str]] = None,
+        top_k: int = 5,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Classifica più query insieme: per ogni intent un solo prodotto Q @ M.T su
+        tutte le query. Ritorna, per query, i top_k risultati con score > 0
+        (stesso formato di classify).
+        """
+        q = as_matrix(queries)
+        n = q.shape[0]
+        if n == 0:
+            return []
+        self._sync()
+        ids = list(intent_ids) if intent_ids else None
+        if ids is None and self._ann is not None:
+            # Unione delle shortlist di tutte le query, poi score esatto
+            shortlist: Dict[str, None] = {}
+            for row in q:
+                found = self._ann.candidates(row)
+                if found is None:
+                    shortlist = {}
+                    break
+                shortlist.update(dict.fromkeys(found))
+            ids = list(shortlist) or None
+        with self._lock:
+            if ids is None:
+                ids = list(self._entries.keys())
+            entries = [(i, e) for i, e in ((i, self._entries.get(i)) for i in ids) if e is not None]
+        if not entries:
+            return [[] for _ in range(n)]
+
+        scores = np.zeros((len(entries), n), dtype=np.float32)
+        texts: List[List[str]] = []
+        for row, (_, entry) in enumerate(entries):
+            scores[row], best_texts = score_intent_batch(entry, q)
+            texts.append(best_texts)
+
+        k = max(1, min(int(top_k), len(entries)))
+        out: List[List[Dict[str, Any]]] = []
+        for col in range(n):
+            column = scores[:, col]
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top], kind="stable")]
+            out.append([
+                {
+                    "intentId": entries[int(r)][0],
+                    "score": float(column[r]),
+                    "bestMatchText": texts[int(r)][col],
+                }
+                for r in top if column[r] > 0
+            ])
+        return out
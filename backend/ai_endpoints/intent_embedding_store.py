@@ -0,0 +1,237 @@
+"""
+Store persistente su disco degli embeddings di training per intent.
+
+Per ogni intent:
+- ``<key>-<version>.npy``: matrice [matching; not-matching] (una riga per frase),
+  float32 oppure float16/int8 secondo OMNIA_EMBEDDINGS_STORAGE
+- ``<key>-<version>.scales.npy``: solo per int8, scala per riga
+- ``<key>.json``: metadati (intentId, conteggi, dim, modello, testi, file .npy corrente)
+
+Le matrici vengono aperte con ``np.load(mmap_mode="r")``: più worker uvicorn
+condividono le stesse pagine della page cache del sistema operativo invece di
+tenere ognuno una copia in RAM. Le scritture sono atomiche (tmp + os.replace) e
+ogni training produce un nuovo file versionato, così i lettori che hanno già
+mappato la versione precedente non vedono mai un file a metà.
+
+Il file ``.stamp`` contiene la versione dell'ultimo training: gli altri worker
+lo rileggono prima di classificare e ricaricano solo gli intent il cui
+metadata ha una versione diversa da quella già caricata.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .intent_ann_index import create_ann_index
+from .intent_embedding_index import STORAGE_MODES, IntentIndex, IntentMatrices
+
+logger = logging.getLogger(__name__)
+
+_STAMP_FILE = ".stamp"
+
+
+def embeddings_store_dir() -> Path:
+    env = (os.environ.get("OMNIA_EMBEDDINGS_STORE_DIR") or "").strip()
+    if env:
+        return Path(env)
+    here = Path(__file__).resolve()
+    return here.parents[1] / "data" / "intent_embeddings"
+
+
+def embeddings_persistence_enabled() -> bool:
+    raw = (os.environ.get("OMNIA_EMBEDDINGS_PERSIST") or "1").strip().lower()
+    return raw not in ("0", "false", "no", "off")
+
+
+def embeddings_storage_mode() -> str:
+    """float32 (default) | float16 | int8 — formato delle matrici salvate."""
+    raw = (os.environ.get("OMNIA_EMBEDDINGS_STORAGE") or "float32").strip().lower()
+    return raw if raw in STORAGE_MODES else "float32"
+
+
+def _save_npy(path: Path, arr: np.ndarray) -> None:
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
+def _intent_key(intent_id: str) -> str:
+    return hashlib.sha1(intent_id.encode("utf-8")).hexdigest()
+
+
+def _atomic_write_bytes(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class PersistentIntentIndex(IntentIndex):
+    """IntentIndex con persistenza su disco e caricamento lazy via memory-map."""
+
+    def __init__(self, directory: Path, model_name: str, ann: Any = None) -> None:
+        super().__init__(ann)
+        self._dir = Path(directory)
+        self._model_name = model_name
+        self._sync_lock = threading.Lock()
+        self._stamp: Optional[bytes] = None
+        # intent_id -> versione (updatedAt) del metadata caricato
+        self._loaded: Dict[str, int] = {}
+
+    @property
+    def directory(self) -> Path:
+        return self._dir
+
+    # ------------------------------------------------------------------ write
+
+    def put(self, intent_id: str, entry: IntentMatrices) -> None:
+        try:
+            entry = self._persist(intent_id, entry)
+        except OSError as e:
+            logger.warning("[Embeddings][STORE] persist failed for %s: %s (kept in memory only)", intent_id, e)
+        super().put(intent_id, entry)
+
+    def _persist(self, intent_id: str, entry: IntentMatrices) -> IntentMatrices:
+        self._dir.mkdir(parents=True, exist_ok=True)
+        key = _intent_key(intent_id)
+        version = time.time_ns()
+        npy_name = f"{key}-{version}.npy"
+        scales_name = None
+
+        stacked = np.ascontiguousarray(np.vstack([entry.matching, entry.not_matching]))
+        _save_npy(self._dir / npy_name, stacked)
+        if entry.matching_scales is not None or entry.not_matching_scales is not None:
+            scales_name = f"{key}-{version}.scales.npy"
+            scales = np.concatenate([
+                entry.matching_scales if entry.matching_scales is not None else np.ones(entry.matching_count, np.float32),
+                entry.not_matching_scales if entry.not_matching_scales is not None else np.ones(entry.not_matching_count, np.float32),
+            ]).astype(np.float32)
+            _save_npy(self._dir / scales_name, scales)
+
+        meta = {
+            "intentId": intent_id,
+            "file": npy_name,
+            "scalesFile": scales_name,
+            "storage": entry.storage_mode,
+            "model": self._model_name,
+            "dim": entry.dim,
+            "matchingCount": entry.matching_count,
+            "notMatchingCount": entry.not_matching_count,
+            "matchingTexts": list(entry.matching_texts),
+            "notMatchingTexts": list(entry.not_matching_texts),
+            "updatedAt": version,
+        }
+        meta_path = self._dir / f"{key}.json"
+        _atomic_write_bytes(meta_path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        _atomic_write_bytes(self._dir / _STAMP_FILE, str(version).encode("ascii"))
+
+        self._remove_stale_versions(key, keep={npy_name, scales_name})
+        loaded = self._open(meta)
+        with self._lock:
+            self._loaded[intent_id] = version
+        return loaded if loaded is not None else entry
+
+    def _remove_stale_versions(self, key: str, keep: set) -> None:
+        for path in self._dir.glob(f"{key}-*.npy"):
+            if path.name in keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                # Su Windows un file ancora mappato da un altro worker non è cancellabile:
+                # verrà rimosso al prossimo training dello stesso intent.
+                pass
+
+    # ------------------------------------------------------------------- read
+
+    def _open(self, meta: Dict[str, Any]) -> Optional[IntentMatrices]:
+        if meta.get("model") != self._model_name:
+            return None
+        n_match = int(meta.get("matchingCount", 0))
+        n_neg = int(meta.get("notMatchingCount", 0))
+        dim = int(meta.get("dim", 0))
+        if n_match + n_neg == 0 or dim == 0:
+            empty = np.zeros((0, dim), dtype=np.float32)
+            return IntentMatrices(empty, (), empty, ())
+        mat = np.load(self._dir / meta["file"], mmap_mode="r")
+        if mat.shape != (n_match + n_neg, dim):
+            raise ValueError(f"shape {mat.shape} does not match metadata")
+        scales = None
+        if meta.get("scalesFile"):
+            scales = np.load(self._dir / meta["scalesFile"], mmap_mode="r")
+            if scales.shape != (n_match + n_neg,):
+                raise ValueError(f"scales shape {scales.shape} does not match metadata")
+        return IntentMatrices(
+            matching=mat[:n_match],
+            matching_texts=tuple(meta.get("matchingTexts") or ()),
+            not_matching=mat[n_match:],
+            not_matching_texts=tuple(meta.get("notMatchingTexts") or ()),
+            matching_scales=scales[:n_match] if scales is not None else None,
+            not_matching_scales=scales[n_match:] if scales is not None else None,
+        )
+
+    def _read_stamp(self) -> Optional[bytes]:
+        try:
+            with open(self._dir / _STAMP_FILE, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _sync(self) -> None:
+        """Carica (lazy) o ricarica gli intent scritti da questo o da altri worker."""
+        stamp = self._read_stamp()
+        if stamp is None or stamp == self._stamp:
+            return
+        with self._sync_lock:
+            if stamp == self._stamp:
+                return
+            # Se un file non è leggibile (es. training concorrente) si riprova al prossimo accesso
+            if self._reload_changed():
+                self._stamp = stamp
+
+    def _reload_changed(self) -> bool:
+        ok = True
+        for meta_path in self._dir.glob("*.json"):
+            try:
+                with open(meta_path, "rb") as f:
+                    meta = json.loads(f.read().decode("utf-8"))
+                intent_id = meta.get("intentId")
+                version = int(meta.get("updatedAt") or 0)
+                if not intent_id:
+                    continue
+                with self._lock:
+                    if self._loaded.get(intent_id) == version:
+                        continue
+                entry = self._open(meta)
+                if entry is None:
+                    continue
+                self._set_entry(intent_id, entry)
+                with self._lock:
+                    self._loaded[intent_id] = version
+            except (OSError, ValueError, KeyError) as e:
+                ok = False
+                logger.warning("[Embeddings][STORE] skipping %s: %s", meta_path.name, e)
+        return ok
+
+
+def create_intent_index(model_name: str) -> IntentIndex:
+    """
+    Index persistente se abilitato (default, OMNIA_EMBEDDINGS_PERSIST), altrimenti solo in memoria.
+    Backend ANN opzionale da OMNIA_EMBEDDINGS_ANN (default brute force).
+    """
+    ann = create_ann_index()
+    if not embeddings_persistence_enabled():
+        return IntentIndex(ann)
+    return PersistentIntentIndex(embeddings_store_dir(), model_name, ann)
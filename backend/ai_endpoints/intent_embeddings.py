@@ -1,9 +1,18 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List, Dict, Optional, Any
+import os
+import asyncio
+import threading
 from numpy import dot
 from numpy.linalg import norm
 
+from .intent_embedding_index import IntentMatrices
+from .intent_embedding_store import create_intent_index, embeddings_storage_mode
+from .embedding_executor import EncodeQueueFull, get_encode_executor, run_encode
+from .embedding_batcher import create_micro_batcher
+from .embedding_cache import create_embedding_cache
+
 # Try import sentence-transformers (locale)
 try:
     from sentence_transformers import SentenceTransformer
@@ -15,13 +24,20 @@ except ImportError:
 
 router = APIRouter()
 
-# In-memory storage per embeddings (in futuro MongoDB)
-_embeddings_cache: Dict[str, Dict] = {}
-_model_ready: Dict[str, bool] = {}
+# Un solo caricamento del modello anche con warm-up e richieste concorrenti
+_local_model_lock = threading.Lock()
 
 # Model locale per training e runtime (multilingua)
 LOCAL_MODEL_NAME = "paraphrase-multilingual-MiniLM-L12-v2"  # Multilingua, open-source
 
+# Storage embeddings: matrici float32 per intent, persistite su disco (.npy in memory-map)
+# e caricate lazy al primo classify; sopravvive ai restart ed è condiviso tra i worker.
+# Un intent è "ready" se ha embeddings nello store.
+_embeddings_cache = create_intent_index(LOCAL_MODEL_NAME)
+
+# Cache testo -> embedding (LRU/TTL, limitata in byte) per testi ripetuti dai chiamanti
+_text_embedding_cache = create_embedding_cache()
+
 def _get_local_model():
     """Lazy load del modello sentence-transformers (solo quando serve)"""
     global _local_model
@@ -32,36 +48,52 @@ def _get_local_model():
         raise ValueError("sentence-transformers not installed. Install with: pip install sentence-transformers")
 
     if _local_model is None:
-        print(f"[Embeddings][INIT] Loading local model: {LOCAL_MODEL_NAME}", flush=True)
-        try:
-            _local_model = SentenceTransformer(LOCAL_MODEL_NAME)
-            print(f"[Embeddings][INIT] Model loaded successfully", flush=True)
-        except Exception as e:
-            print(f"[Embeddings][ERROR] Failed to load model: {str(e)}", flush=True)
-            import traceback
-            print(f"[Embeddings][ERROR] Traceback: {traceback.format_exc()}", flush=True)
-            raise
+        with _local_model_lock:
+            # Ricontrollo sotto lock: un altro thread (es. il warm-up) può averlo appena caricato
+            if _local_model is None:
+                print(f"[Embeddings][INIT] Loading local model: {LOCAL_MODEL_NAME}", flush=True)
+                try:
+                    _local_model = SentenceTransformer(LOCAL_MODEL_NAME)
+                    print(f"[Embeddings][INIT] Model loaded successfully", flush=True)
+                except Exception as e:
+                    print(f"[Embeddings][ERROR] Failed to load model: {str(e)}", flush=True)
+                    import traceback
+                    print(f"[Embeddings][ERROR] Traceback: {traceback.format_exc()}", flush=True)
+                    raise
 
     return _local_model
 
 class TrainBody(BaseModel):
     phrases: List[Dict[str, Any]]  # {id, text, type: 'matching'|'not-matching'}
     intentId: str
+    batchSize: Optional[int] = None  # Override di OMNIA_EMBEDDINGS_TRAIN_BATCH_SIZE
 
 class ClassifyBody(BaseModel):
     text: str
     intentIds: Optional[List[str]] = None
 
+class ClassifyBatchBody(BaseModel):
+    texts: List[str]
+    intentIds: Optional[List[str]] = None
+    topK: int = 5
+
+# Limite di testi per /api/intents/classify-embedding/batch (una richiesta = un job nel pool)
+DEFAULT_CLASSIFY_BATCH_MAX_TEXTS = 1000
+
 def compute_embedding_local(text: str) -> List[float]:
     """
     Calcola embedding usando sentence-transformers LOCALE (gratuito, zero costi).
     Usato sempre per training e runtime.
     """
+    cached = _text_embedding_cache.get(LOCAL_MODEL_NAME, text)
+    if cached is not None:
+        return cached.tolist()
+
     print(f"[Embeddings][LOCAL] Computing embedding for text: '{text[:50]}...'", flush=True)
     try:
         model = _get_local_model()
         print(f"[Embeddings][LOCAL] Model obtained, encoding...", flush=True)
-        embedding = model.encode(text, normalize_embeddings=True).tolist()
+        embedding = _text_embedding_cache.put(LOCAL_MODEL_NAME, text, model.encode(text, normalize_embeddings=True)).tolist()
         print(f"[Embeddings][LOCAL] Encoding completed, embedding length: {len(embedding)}", flush=True)
         return embedding
     except Exception as e:
@@ -70,6 +102,46 @@ def compute_embedding_local(text: str) -> List[float]:
         print(f"[Embeddings][LOCAL][ERROR] Traceback: {traceback.format_exc()}", flush=True)
         raise
 
+def compute_embeddings_local(texts: List[str]):
+    """
+    Embeddings di più testi con una sola model.encode(list): matrice (len(texts), dim)
+    normalizzata. Usata dal micro-batcher per le richieste single-text concorrenti.
+    """
+    model = _get_local_model()
+    vectors = model.encode(texts, batch_size=len(texts), normalize_embeddings=True)
+    print(f"[Embeddings][BATCH] Encoded {len(texts)} texts in one call", flush=True)
+    return vectors
+
+async def _embed_texts(texts: List[str]) -> List[Any]:
+    """
+    Embeddings di più testi per gli endpoint batch: hit dalla cache LRU, i testi
+    mancanti (deduplicati) in un solo job del pool con model.encode(list).
+    """
+    vectors: List[Any] = [_text_embedding_cache.get(LOCAL_MODEL_NAME, t) for t in texts]
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if missing:
+        encoded = await run_encode(_encode_texts_batched, missing)
+        by_text = {t: _text_embedding_cache.put(LOCAL_MODEL_NAME, t, v) for t, v in zip(missing, encoded)}
+        vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+    return vectors
+
+def _encode_texts_batched(texts: List[str]):
+    """model.encode(list) con batch interni di OMNIA_EMBEDDINGS_TRAIN_BATCH_SIZE."""
+    model = _get_local_model()
+    vectors = model.encode(texts, batch_size=_resolve_train_batch_size(), normalize_embeddings=True)
+    print(f"[Embeddings][BATCH] Encoded {len(texts)} texts for batch classify", flush=True)
+    return vectors
+
+# Richieste single-text concorrenti -> un solo encode per batch (vedi embedding_batcher)
+_micro_batcher = create_micro_batcher(compute_embeddings_local)
+
+async def _embed_text(text: str):
+    """Embedding di un testo per gli endpoint async: cache LRU, poi micro-batcher + pool."""
+    cached = _text_embedding_cache.get(LOCAL_MODEL_NAME, text)
+    if cached is not None:
+        return cached
+    return _text_embedding_cache.put(LOCAL_MODEL_NAME, text, await _micro_batcher.encode(text))
+
 def cosine_similarity(a: List[float], b: List[float]) -> float:
     """Calcola cosine similarity tra due vettori"""
     if not a or not b or len(a) != len(b):
@@ -79,6 +151,104 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
     except Exception:
         return 0.0
 
+# Batch size per model.encode durante il training (una chiamata per batch, non per frase)
+DEFAULT_TRAIN_BATCH_SIZE = 64
+
+def _resolve_train_batch_size(requested: Optional[int] = None) -> int:
+    """Batch size richiesto dal client, altrimenti OMNIA_EMBEDDINGS_TRAIN_BATCH_SIZE, altrimenti default."""
+    if requested and requested > 0:
+        return int(requested)
+    raw = (os.environ.get("OMNIA_EMBEDDINGS_TRAIN_BATCH_SIZE") or "").strip()
+    try:
+        value = int(raw)
+        if value > 0:
+            return value
+    except ValueError:
+        pass
+    return DEFAULT_TRAIN_BATCH_SIZE
+
+def _encode_phrase_batch(model, texts: List[str], batch_size: int) -> List[Any]:
+    """
+    Un batch di training: model.encode(list, batch_size=N). Se il batch fallisce,
+    le frasi vengono ricalcolate una per una (None per quelle non valide).
+    """
+    try:
+        return list(model.encode(texts, batch_size=batch_size, normalize_embeddings=True))
+    except Exception as e:
+        print(f"[IntentTrain][ERROR] Batch encode failed, retrying per phrase: {str(e)}", flush=True)
+        vectors = []
+        for text in texts:
+            try:
+                vectors.append(model.encode(text, normalize_embeddings=True))
+            except Exception as phrase_error:
+                print(f"[IntentTrain][ERROR] Failed to compute embedding for '{text[:50]}': {str(phrase_error)}", flush=True)
+                vectors.append(None)
+        return vectors
+
+async def _encode_training_phrases(model, phrases: List[Dict[str, Any]], batch_size: int):
+    """
+    Calcola gli embeddings delle frasi di training, un job del pool di encoding per batch
+    (così classify/compute concorrenti si alternano ai batch invece di attendere tutto il training).
+
+    Ritorna (embeddings_data, processed_count, failed_count).
+    """
+    import time
+
+    embeddings_data = {
+        'matching': [],
+        'not-matching': []
+    }
+    processed_count = 0
+    failed_count = 0
+
+    # Frasi con testo e tipo validi, nell'ordine ricevuto
+    pending = []
+    for i, phrase in enumerate(phrases):
+        phrase_text = phrase.get('text', '')
+        if not phrase_text:
+            continue
+        phrase_type = phrase.get('type', 'matching')
+        if phrase_type not in embeddings_data:
+            print(f"[IntentTrain][ERROR] Unknown phrase type '{phrase_type}' for phrase {i+1}", flush=True)
+            failed_count += 1
+            continue
+        pending.append((phrase.get('id', f'phrase_{i}'), phrase_text, phrase_type))
+
+    total = len(pending)
+    total_batches = (total + batch_size - 1) // batch_size
+    loop_start_time = time.time()
+
+    for batch_index, start in enumerate(range(0, total, batch_size)):
+        batch = pending[start:start + batch_size]
+        texts = [text for _, text, _ in batch]
+        batch_start_time = time.time()
+
+        # wait=True: un training già avviato attende uno slot invece di fallire a metà
+        vectors = await run_encode(_encode_phrase_batch, model, texts, batch_size, wait=True)
+
+        for (phrase_id, phrase_text, phrase_type), embedding in zip(batch, vectors):
+            if embedding is None:
+                failed_count += 1
+                continue
+            embeddings_data[phrase_type].append({
+                'id': phrase_id,
+                'text': phrase_text,
+                'embedding': embedding
+            })
+            processed_count += 1
+
+        done = start + len(batch)
+        elapsed = time.time() - loop_start_time
+        remaining = (total - done) * (elapsed / done) if done else 0.0
+        print(f"[IntentTrain][PROGRESS] Batch {batch_index+1}/{total_batches}: {done}/{total} phrases ({100*done/total:.1f}%), batch={time.time() - batch_start_time:.2f}s, elapsed={elapsed:.2f}s, est_remaining={remaining:.1f}s", flush=True)
+
+    return embeddings_data, processed_count, failed_count
+
+def _queue_full_error(e: EncodeQueueFull) -> HTTPException:
+    """503 immediato quando il pool di encoding è saturo (il client può ritentare)."""
+    print(f"[Embeddings][QUEUE] Rejected: {str(e)}", flush=True)
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
 class ComputeEmbeddingBody(BaseModel):
     text: str
 
@@ -99,12 +269,15 @@ async def compute_embedding_endpoint(body: ComputeEmbeddingBody):
         raise HTTPException(status_code=400, detail="Text is required")
 
     try:
-        embedding = compute_embedding_local(body.text)
+        # model.encode è CPU-bound: gira nel pool dedicato, micro-batchato con le richieste concorrenti
+        embedding = (await _embed_text(body.text)).tolist()
         return {
             "embedding": embedding,
             "length": len(embedding),
             "model": LOCAL_MODEL_NAME
         }
+    except EncodeQueueFull as e:
+        raise _queue_full_error(e)
     except Exception as e:
         print(f"[Embeddings][COMPUTE][ERROR] Failed to compute embedding: {str(e)}", flush=True)
         import traceback
@@ -166,9 +339,11 @@ async def train_intent(intent_id: str, body: TrainBody):
     try:
         print(f"[IntentTrain][MODEL] Loading model {LOCAL_MODEL_NAME}...", flush=True)
         print(f"[IntentTrain][MODEL] Current model state: {_local_model is not None}", flush=True)
-        model = _get_local_model()
+        model = await run_encode(_get_local_model)
         model_load_time = time.time() - model_load_start
         print(f"[IntentTrain][MODEL] Model loaded successfully in {model_load_time:.2f} seconds", flush=True)
+    except EncodeQueueFull as e:
+        raise _queue_full_error(e)
     except Exception as e:
         model_load_time = time.time() - model_load_start
         print(f"[IntentTrain][ERROR] Failed to load model after {model_load_time:.2f} seconds: {str(e)}", flush=True)
@@ -182,63 +357,12 @@ async def train_intent(intent_id: str, body: TrainBody):
     print(f"[IntentTrain][DEBUG] Starting training for intent {intent_id}", flush=True)
     print(f"[IntentTrain][DEBUG] Phrases: {len(body.phrases)}, Method: Local (sentence-transformers)", flush=True)
 
-    embeddings_data = {
-        'matching': [],
-        'not-matching': []
-    }
-
-    processed_count = 0
-    failed_count = 0
+    batch_size = _resolve_train_batch_size(body.batchSize)
 
     loop_start_time = time.time()
-    print(f"[IntentTrain][LOOP] Starting phrase processing loop...", flush=True)
-    print(f"[IntentTrain][LOOP] Total phrases to process: {len(body.phrases)}", flush=True)
-
-    # Calcola embeddings per ogni frase
-    for i, phrase in enumerate(body.phrases):
-        phrase_start_time = time.time()
-        try:
-            phrase_id = phrase.get('id', f'phrase_{i}')
-            phrase_text = phrase.get('text', '')
-            phrase_type = phrase.get('type', 'matching')
-
-            print(f"[IntentTrain][PHRASE {i+1}/{len(body.phrases)}] Processing: id={phrase_id}, type={phrase_type}, text_length={len(phrase_text)}, text={phrase_text[:50]}...", flush=True)
-
-            if not phrase_text:
-                print(f"[IntentTrain][PHRASE {i+1}] Skipping - empty text", flush=True)
-                continue
-
-            # ✅ FIX: Usa il modello già caricato invece di chiamare compute_embedding_local (che ricarica il modello)
-            encode_start = time.time()
-            print(f"[IntentTrain][PHRASE {i+1}] Computing embedding with model...", flush=True)
-            embedding = model.encode(phrase_text, normalize_embeddings=True).tolist()
-            encode_time = time.time() - encode_start
-            print(f"[IntentTrain][PHRASE {i+1}] Embedding computed in {encode_time:.3f}s, length={len(embedding)}", flush=True)
-
-            embeddings_data[phrase_type].append({
-                'id': phrase_id,
-                'text': phrase_text,
-                'embedding': embedding
-            })
-
-            processed_count += 1
-            phrase_time = time.time() - phrase_start_time
-            print(f"[IntentTrain][PHRASE {i+1}] Added to embeddings_data[{phrase_type}], count={len(embeddings_data[phrase_type])}, time={phrase_time:.3f}s", flush=True)
+    print(f"[IntentTrain][LOOP] Encoding {len(body.phrases)} phrases in batches of {batch_size}...", flush=True)
 
-            # Progress log ogni 10 frasi
-            if (i + 1) % 10 == 0:
-                elapsed = time.time() - loop_start_time
-                avg_time = elapsed / (i + 1)
-                remaining = (len(body.phrases) - (i + 1)) * avg_time
-                print(f"[IntentTrain][PROGRESS] Processed {i + 1}/{len(body.phrases)} phrases ({100*(i+1)/len(body.phrases):.1f}%), elapsed={elapsed:.2f}s, avg={avg_time:.3f}s/phrase, est_remaining={remaining:.1f}s", flush=True)
-
-        except Exception as e:
-            failed_count += 1
-            phrase_time = time.time() - phrase_start_time
-            print(f"[IntentTrain][ERROR] Failed to compute embedding for phrase {i+1} after {phrase_time:.3f}s: {str(e)}", flush=True)
-            import traceback
-            print(f"[IntentTrain][ERROR] Traceback: {traceback.format_exc()}", flush=True)
-            continue
+    embeddings_data, processed_count, failed_count = await _encode_training_phrases(model, body.phrases, batch_size)
 
     loop_time = time.time() - loop_start_time
     print(f"[IntentTrain][LOOP] Loop completed in {loop_time:.2f} seconds", flush=True)
@@ -259,9 +383,14 @@ async def train_intent(intent_id: str, body: TrainBody):
     print(f"[IntentTrain][SAVE] Matching phrases: {len(embeddings_data['matching'])}, Not-matching: {len(embeddings_data['not-matching'])}", flush=True)
     print(f"[IntentTrain][SAVE] Cache size before: {len(_embeddings_cache)} intents", flush=True)
 
-    # Salva in cache
-    _embeddings_cache[intent_id] = embeddings_data
-    _model_ready[intent_id] = True
+    # Salva in cache come matrici contigue (una volta sola, al training), nel formato
+    # OMNIA_EMBEDDINGS_STORAGE (float32 | float16 | int8); la scrittura su disco
+    # non deve bloccare l'event loop
+    entry = IntentMatrices.build(
+        [(p['text'], p['embedding']) for p in embeddings_data['matching']],
+        [(p['text'], p['embedding']) for p in embeddings_data['not-matching']],
+    ).quantized(embeddings_storage_mode())
+    await asyncio.get_running_loop().run_in_executor(None, _embeddings_cache.put, intent_id, entry)
 
     save_time = time.time() - save_start_time
     print(f"[IntentTrain][SAVE] Cache saved in {save_time:.3f}s, model marked as ready", flush=True)
@@ -284,7 +413,8 @@ async def train_intent(intent_id: str, body: TrainBody):
             'notMatching': not_matching_count,
             'total': matching_count + not_matching_count,
             'processed': processed_count,
-            'failed': failed_count
+            'failed': failed_count,
+            'batchSize': batch_size
         }
     }
 
@@ -309,47 +439,13 @@ async def get_model_status(intent_id: str):
     try:
         # ✅ FIX: Verifica che le variabili globali siano inizializzate
         print(f"[IntentStatus][GET] Checking global state...", flush=True)
-        print(f"[IntentStatus][GET] _model_ready type: {type(_model_ready)}, keys: {list(_model_ready.keys()) if isinstance(_model_ready, dict) else 'N/A'}", flush=True)
-        print(f"[IntentStatus][GET] _embeddings_cache type: {type(_embeddings_cache)}, keys: {list(_embeddings_cache.keys()) if isinstance(_embeddings_cache, dict) else 'N/A'}", flush=True)
-
-        # ✅ FIX: Usa get con default per evitare KeyError
-        model_ready = False
-        has_embeddings = False
-
-        try:
-            if isinstance(_model_ready, dict):
-                model_ready = _model_ready.get(intent_id, False)
-            else:
-                print(f"[IntentStatus][GET] WARNING: _model_ready is not a dict: {type(_model_ready)}", flush=True)
-                model_ready = False
-        except Exception as e:
-            print(f"[IntentStatus][GET] ERROR getting model_ready: {str(e)}", flush=True)
-            import traceback
-            print(f"[IntentStatus][GET] Traceback: {traceback.format_exc()}", flush=True)
-            model_ready = False
-
-        try:
-            if isinstance(_embeddings_cache, dict):
-                has_embeddings = intent_id in _embeddings_cache
-            else:
-                print(f"[IntentStatus][GET] WARNING: _embeddings_cache is not a dict: {type(_embeddings_cache)}", flush=True)
-                has_embeddings = False
-        except Exception as e:
-            print(f"[IntentStatus][GET] ERROR checking embeddings_cache: {str(e)}", flush=True)
-            import traceback
-            print(f"[IntentStatus][GET] Traceback: {traceback.format_exc()}", flush=True)
-            has_embeddings = False
+        print(f"[IntentStatus][GET] _embeddings_cache intents: {len(_embeddings_cache)}", flush=True)
 
+        cache_data = _embeddings_cache.get(intent_id)
+        has_embeddings = cache_data is not None
+        model_ready = has_embeddings
         if has_embeddings:
-            try:
-                cache_data = _embeddings_cache.get(intent_id, {})
-                matching_count = len(cache_data.get('matching', [])) if isinstance(cache_data, dict) else 0
-                not_matching_count = len(cache_data.get('not-matching', [])) if isinstance(cache_data, dict) else 0
-                print(f"[IntentStatus][GET] Cache found: {matching_count} matching, {not_matching_count} not-matching", flush=True)
-            except Exception as e:
-                print(f"[IntentStatus][GET] ERROR reading cache data: {str(e)}", flush=True)
-                import traceback
-                print(f"[IntentStatus][GET] Traceback: {traceback.format_exc()}", flush=True)
+            print(f"[IntentStatus][GET] Cache found: {cache_data.matching_count} matching, {cache_data.not_matching_count} not-matching", flush=True)
         else:
             print(f"[IntentStatus][GET] No cache found for intent {intent_id}", flush=True)
 
@@ -391,65 +487,92 @@ async def classify_with_embeddings(body: ClassifyBody):
 
     # Calcola embedding del testo input usando modello LOCALE (gratuito, veloce)
     try:
-        text_embedding = compute_embedding_local(body.text)
+        text_embedding = await _embed_text(body.text)
+    except EncodeQueueFull as e:
+        raise _queue_full_error(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to compute embedding locally: {str(e)}. Make sure sentence-transformers is installed."
         )
 
-    # Se intentIds fornito, filtra solo quelli; altrimenti tutti quelli con embeddings
-    intent_ids_to_check = body.intentIds if body.intentIds else list(_embeddings_cache.keys())
-
-    results = []
-
-    for intent_id in intent_ids_to_check:
-        if intent_id not in _embeddings_cache:
-            continue  # Skip se non ha embeddings
-
-        embeddings_data = _embeddings_cache[intent_id]
+    # Se intentIds fornito, filtra solo quelli; altrimenti tutti quelli con embeddings.
+    # Un prodotto matrice-vettore per intent (best match + penalità not-matching).
+    results = _embeddings_cache.classify(text_embedding, body.intentIds)
 
-        # Trova best match tra matching phrases
-        best_match_score = 0.0
-        best_match_text = ""
-
-        for phrase_data in embeddings_data.get('matching', []):
-            phrase_embedding = phrase_data.get('embedding', [])
-            if not phrase_embedding:
-                continue
-
-            score = cosine_similarity(text_embedding, phrase_embedding)
-            if score > best_match_score:
-                best_match_score = score
-                best_match_text = phrase_data.get('text', '')
+    return {
+        'text': body.text,
+        'top': results[:5],  # Top 5
+        'best': results[0] if results else None
+    }
 
-        # Penalità se matcha con not-matching (evita false positive)
-        penalty = 0.0
-        for phrase_data in embeddings_data.get('not-matching', []):
-            phrase_embedding = phrase_data.get('embedding', [])
-            if not phrase_embedding:
-                continue
+@router.post('/api/intents/classify-embedding/batch')
+async def classify_batch_with_embeddings(body: ClassifyBatchBody):
+    """
+    Classifica molti testi in una chiamata (regression run, test-phrase UI).
 
-            neg_score = cosine_similarity(text_embedding, phrase_embedding)
-            if neg_score > 0.7:  # Se molto simile a un negativo
-                penalty += (neg_score - 0.7) * 0.5
+    Encoding di tutti i testi in un solo batch, poi per ogni intent un prodotto
+    matrice-matrice con tutte le query. Ritorna i top-k per testo, nello stesso
+    ordine di body.texts; testi vuoti ritornano top=[] e best=None.
+    """
+    if not body.texts:
+        raise HTTPException(status_code=400, detail="texts is required")
+    max_texts = _resolve_classify_batch_max_texts()
+    if len(body.texts) > max_texts:
+        raise HTTPException(status_code=400, detail=f"Too many texts: {len(body.texts)} (max {max_texts})")
+
+    positions = [i for i, t in enumerate(body.texts) if t and t.strip()]
+    texts = [body.texts[i] for i in positions]
+    try:
+        vectors = await _embed_texts(texts) if texts else []
+    except EncodeQueueFull as e:
+        raise _queue_full_error(e)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to compute embeddings locally: {str(e)}. Make sure sentence-transformers is installed."
+        )
 
-        final_score = max(0.0, best_match_score - penalty)
+    top_k = max(1, body.topK)
+    ranked = await asyncio.get_running_loop().run_in_executor(
+        None, _embeddings_cache.classify_batch, vectors, body.intentIds, top_k
+    ) if vectors else []
 
-        if final_score > 0:
-            results.append({
-                'intentId': intent_id,
-                'score': final_score,
-                'bestMatchText': best_match_text
-            })
+    per_text: Dict[int, List[Dict[str, Any]]] = dict(zip(positions, ranked))
+    results = []
+    for i, text in enumerate(body.texts):
+        top = per_text.get(i, [])
+        results.append({'text': text, 'top': top, 'best': top[0] if top else None})
 
-    # Ordina per score decrescente
-    results.sort(key=lambda x: x['score'], reverse=True)
+    return {'count': len(results), 'results': results}
 
+def _resolve_classify_batch_max_texts() -> int:
+    raw = (os.environ.get("OMNIA_EMBEDDINGS_CLASSIFY_BATCH_MAX_TEXTS") or "").strip()
+    try:
+        value = int(raw)
+        return value if value > 0 else DEFAULT_CLASSIFY_BATCH_MAX_TEXTS
+    except ValueError:
+        return DEFAULT_CLASSIFY_BATCH_MAX_TEXTS
+
+@router.get('/api/embeddings/queue-stats')
+async def get_encode_queue_stats():
+    """Stato del pool di encoding (worker, coda, job rifiutati con 503) e del micro-batcher."""
     return {
-        'text': body.text,
-        'top': results[:5],  # Top 5
-        'best': results[0] if results else None
+        **get_encode_executor().stats(),
+        "microBatch": _micro_batcher.stats()
     }
 
+@router.get('/api/embeddings/cache-stats')
+async def get_embedding_cache_stats():
+    """Contatori della cache testo -> embedding (hit, miss, eviction) per dimensionarla."""
+    return _text_embedding_cache.stats()
 
+@router.get('/api/embeddings/index-stats')
+async def get_embedding_index_stats():
+    """Backend di ricerca degli intent (brute force esatto o ANN) e stato delle posting list."""
+    ann = _embeddings_cache.ann
+    return {
+        "backend": "brute" if ann is None else "ivf",
+        "intents": len(_embeddings_cache),
+        "ann": ann.stats() if ann is not None else None
+    }
@@ -1,6 +1,12 @@
 import os
 import requests
 
+# Sempre backend.llm_singleflight: il registro dei gruppi letto da /api/llm/stats è quello
+try:
+    from backend.llm_singleflight import flight_key, get_single_flight
+except ImportError:
+    from llm_singleflight import flight_key, get_single_flight
+
 GROQ_KEY = os.environ.get("Groq_key") or os.environ.get("GROQ_API_KEY")
 GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
 # Use a smaller model by default for tester speed; can be overridden via env
@@ -10,7 +16,13 @@ MODEL = os.environ.get("GROQ_MODEL", "llama-3.1-8b-instant")
 # Reuse HTTP connection to reduce TLS handshake latency
 _session = requests.Session()
 
+# Chiamate identiche concorrenti condividono una sola richiesta upstream
+_flight = get_single_flight("legacy.call_groq")
+
 def call_groq(messages):
+    return _flight.do(flight_key("groq", MODEL, messages), _call_groq, messages)
+
+def _call_groq(messages):
     if not GROQ_KEY:
         raise ValueError("Missing Groq API key. Set environment variable 'Groq_key' or 'GROQ_API_KEY'.")
     headers = {
@@ -1,6 +1,11 @@
 import os
 import requests
 from typing import Optional
+# Sempre backend.llm_singleflight: il registro dei gruppi letto da /api/llm/stats è quello
+try:
+    from backend.llm_singleflight import flight_key, get_single_flight
+except ImportError:
+    from llm_singleflight import flight_key, get_single_flight
 try:
     import winreg  # type: ignore
 except Exception:
@@ -50,7 +55,18 @@ OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4.1")
 
 _session = requests.Session()
 
+# Chiamate identiche concorrenti condividono una sola richiesta upstream
+_flight = get_single_flight("legacy.call_openai")
+
 def call_openai(messages, model: Optional[str] = None):
+    mdl = model or OPENAI_MODEL
+    return _flight.do(flight_key("openai", mdl, messages), _call_openai, messages, mdl)
+
+def call_openai_json(messages, model: Optional[str] = None):
+    mdl = model or OPENAI_MODEL
+    return _flight.do(flight_key("openai", mdl, messages, "json_object"), _call_openai_json, messages, mdl)
+
+def _call_openai(messages, model: Optional[str] = None):
     if not OPENAI_KEY:
         raise ValueError("Missing OpenAI API key. Set 'OpenAI_key'.")
     mdl = model or OPENAI_MODEL
@@ -79,7 +95,7 @@ def call_openai(messages, model: Optional[str] = None):
     data = resp.json()
     return data.get("choices", [{}])[0].get("message", {}).get("content", "")
 
-def call_openai_json(messages, model: Optional[str] = None):
+def _call_openai_json(messages, model: Optional[str] = None):
     if not OPENAI_KEY:
         raise ValueError("Missing OpenAI API key. Set 'OpenAI_key'.")
     mdl = model or OPENAI_MODEL
@@ -0,0 +1,130 @@
+"""
+Single-flight per chiamate LLM identiche in corso.
+
+Se più richieste concorrenti (tab del browser, retry) fanno la stessa chiamata
+(stessa chiave = provider + modello + messages), solo la prima va upstream e le
+altre ricevono lo stesso risultato (o la stessa eccezione). Al termine la
+chiave viene liberata: nessun caching, solo coalescing di chiamate sovrapposte.
+
+Usato da newBackend/services/svc_ai_client.py e dagli helper legacy
+call_groq / call_openai. Contatori per gruppo: chiamate upstream e chiamate
+risparmiate (coalesced).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import sys
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def flight_key(*parts: Any) -> str:
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Esegue fn una sola volta per chiave tra i thread concorrenti."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.upstream_calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def ado(self, key: str, fn: Callable[..., Awaitable[Any]], *args: Any, **kwargs: Any) -> Any:
+        """
+        Versione async: la chiamata upstream gira in un task condiviso; chi attende
+        può essere cancellato (client disconnesso) senza cancellarla per gli altri.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is not None and not task.done() and task.get_loop() is loop:
+                self.coalesced += 1
+            else:
+                task = loop.create_task(fn(*args, **kwargs))
+                self._tasks[key] = task
+                self.upstream_calls += 1
+                task.add_done_callback(lambda t, k=key: self._forget(k, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._calls) + len(self._tasks)
+        return {
+            "upstreamCalls": self.upstream_calls,
+            "savedCalls": self.coalesced,
+            "inFlight": in_flight,
+        }
+
+
+_groups_lock = threading.Lock()
+_groups: Dict[str, SingleFlight] = {}
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {g.name: g.stats() for g in groups}
+
+
+# Layout legacy: backend/ è anche su sys.path, quindi il modulo è importabile sia come
+# "llm_singleflight" sia come "backend.llm_singleflight". Entrambi i nomi puntano a
+# questo stesso modulo, così esiste un solo registro dei gruppi.
+for _alias in ("llm_singleflight", "backend.llm_singleflight"):
+    sys.modules.setdefault(_alias, sys.modules[__name__])
@@ -0,0 +1,101 @@
+"""
+Script: Benchmark dello storage degli embeddings di training (float32 / float16 / int8)
+
+Genera un training set sintetico con la stessa forma di quello reale
+(vettori 384-dim normalizzati, raggruppati per intent) e riporta:
+- memoria per 10k frasi (matrici + scale) confrontata con le liste Python di float
+- accuratezza rispetto a float32: accordo sul top-1, delta medio/massimo degli score
+- tempo medio di classificazione
+
+Non richiede sentence-transformers: le direzioni degli intent sono casuali e
+le frasi/query sono perturbazioni attorno ad esse.
+
+Uso:
+    python -m backend.scripts.benchmark_embedding_storage [--intents 200] [--phrases 10000] [--queries 500]
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from backend.ai_endpoints.intent_embedding_index import STORAGE_MODES, IntentIndex, IntentMatrices
+
+DIM = 384
+
+
+def _unit_rows(m):
+    return m / np.linalg.norm(m, axis=1, keepdims=True)
+
+
+def _python_list_bytes(n_vectors, dim):
+    """Memoria di n liste Python di float (come il vecchio _embeddings_cache)."""
+    sample = [float(x) for x in np.random.default_rng(0).normal(size=dim)]
+    per_vector = sys.getsizeof(sample) + sum(sys.getsizeof(x) for x in sample)
+    return n_vectors * per_vector
+
+
+def _build_dataset(n_intents, n_phrases, n_queries, seed=42):
+    rng = np.random.default_rng(seed)
+    centers = _unit_rows(rng.normal(size=(n_intents, DIM)))
+    per_intent = max(1, n_phrases // n_intents)
+    intents = {}
+    for i in range(n_intents):
+        pos = _unit_rows(centers[i] + 0.08 * rng.normal(size=(per_intent, DIM)))
+        neg_idx = rng.integers(0, n_intents, size=max(1, per_intent // 5))
+        neg = _unit_rows(centers[neg_idx] + 0.08 * rng.normal(size=(len(neg_idx), DIM)))
+        intents[f"intent_{i}"] = IntentMatrices.build(
+            [(f"i{i}-p{j}", v) for j, v in enumerate(pos)],
+            [(f"i{i}-n{j}", v) for j, v in enumerate(neg)],
+        )
+    query_intents = rng.integers(0, n_intents, size=n_queries)
+    queries = _unit_rows(centers[query_intents] + 0.1 * rng.normal(size=(n_queries, DIM)))
+    return intents, queries
+
+
+def run_benchmark(n_intents, n_phrases, n_queries):
+    intents, queries = _build_dataset(n_intents, n_phrases, n_queries)
+    total_rows = sum(e.matching_count + e.not_matching_count for e in intents.values())
+    scale_to_10k = 10000.0 / total_rows
+
+    reference = None
+    print(f"Dataset: {n_intents} intents, {total_rows} phrases, {n_queries} queries, dim={DIM}\n")
+    print(f"{'storage':<14}{'MB/10k phrases':>16}{'top-1 agree':>14}{'mean |d|':>12}{'max |d|':>12}{'ms/query':>12}")
+
+    py_mb = _python_list_bytes(total_rows, DIM) * scale_to_10k / 1e6
+    print(f"{'python lists':<14}{py_mb:>16.2f}{'-':>14}{'-':>12}{'-':>12}{'-':>12}")
+
+    for mode in STORAGE_MODES:
+        index = IntentIndex()
+        nbytes = 0
+        for intent_id, entry in intents.items():
+            q = entry.quantized(mode)
+            nbytes += q.nbytes
+            index.put(intent_id, q)
+
+        start = time.perf_counter()
+        results = [index.classify(v) for v in queries]
+        elapsed_ms = (time.perf_counter() - start) * 1000.0 / len(queries)
+
+        top1 = [r[0]["intentId"] if r else None for r in results]
+        scores = np.array([r[0]["score"] if r else 0.0 for r in results])
+        if reference is None:
+            reference = (top1, scores)
+        agree = np.mean([a == b for a, b in zip(top1, reference[0])])
+        delta = np.abs(scores - reference[1])
+        mb = nbytes * scale_to_10k / 1e6
+        print(f"{mode:<14}{mb:>16.2f}{agree:>14.4f}{delta.mean():>12.5f}{delta.max():>12.5f}{elapsed_ms:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark intent embedding storage modes")
+    parser.add_argument("--intents", type=int, default=200)
+    parser.add_argument("--phrases", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    run_benchmark(args.intents, args.phrases, args.queries)
+
+
+if __name__ == "__main__":
+    main()
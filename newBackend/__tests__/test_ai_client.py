@@ -0,0 +1,364 @@
+"""Unit tests for the pooled LLM client (no network: httpx.MockTransport)."""
+
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+import requests
+
+from newBackend.services import svc_ai_client as ai
+from newBackend.services import svc_http_pool as pool
+from newBackend.services.svc_groq_model_health import ModelHealth
+
+
+@pytest.fixture(autouse=True)
+def _fresh_model_health(monkeypatch):
+    monkeypatch.setattr(ai, "_model_health", ModelHealth())
+
+
+def _groq_handler(calls):
+    def handler(request):
+        body = json.loads(request.content)
+        calls.append(body["model"])
+        if body["model"] == "old-model":
+            return httpx.Response(400, text="The model old-model has been decommissioned")
+        if body["model"] == "bad-model":
+            return httpx.Response(500, text="internal error")
+        return httpx.Response(200, json={"choices": [{"message": {"content": '{"ok": true}'}}]})
+    return handler
+
+
+def test_sync_client_is_shared_and_falls_back(monkeypatch):
+    calls = []
+    monkeypatch.setattr(pool, "_sync_client", httpx.Client(transport=httpx.MockTransport(_groq_handler(calls))))
+    monkeypatch.setattr(ai, "GROQ_MODEL", "old-model")
+    monkeypatch.setattr(ai, "GROQ_FALLBACKS", ["good-model"])
+
+    assert pool.get_sync_client() is pool.get_sync_client()
+    assert ai.chat_json([{"role": "user", "content": "hi"}]) == '{"ok": true}'
+    assert calls == ["old-model", "good-model"]
+
+    monkeypatch.setattr(ai, "GROQ_MODEL", "bad-model")
+    with pytest.raises(requests.HTTPError):
+        ai.chat_text([{"role": "user", "content": "hi"}])
+
+
+def test_async_client_falls_back(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ai, "GROQ_MODEL", "old-model")
+    monkeypatch.setattr(ai, "GROQ_FALLBACKS", ["good-model"])
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(_groq_handler(calls)))
+        monkeypatch.setattr(pool, "_async_client", client)
+        monkeypatch.setattr(pool, "_async_loop", asyncio.get_running_loop())
+        try:
+            return await ai.achat_json([{"role": "user", "content": "hi"}])
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == '{"ok": true}'
+    assert calls == ["old-model", "good-model"]
+
+
+def test_provider_timeouts_from_env(monkeypatch):
+    monkeypatch.setenv("OMNIA_LLM_TIMEOUT_GROQ", "12")
+    monkeypatch.delenv("OMNIA_LLM_TIMEOUT_OPENAI", raising=False)
+    assert pool.provider_timeout("groq").read == 12.0
+    assert pool.provider_timeout("openai").read == pool.DEFAULT_TIMEOUTS["openai"]
+
+
+def test_response_cache_hits_and_bypass(monkeypatch):
+    from newBackend.services import svc_llm_cache
+
+    calls = []
+    monkeypatch.setattr(pool, "_sync_client", httpx.Client(transport=httpx.MockTransport(_groq_handler(calls))))
+    monkeypatch.setattr(ai, "GROQ_MODEL", "good-model")
+    monkeypatch.setattr(ai, "GROQ_FALLBACKS", [])
+    monkeypatch.setattr(svc_llm_cache, "_llm_cache", svc_llm_cache.LlmResponseCache(mode="memory"))
+    messages = [{"role": "user", "content": "same prompt"}]
+
+    assert ai.chat_json(messages) == ai.chat_json(messages)
+    assert calls == ["good-model"]
+    ai.chat_json(messages, use_cache=False)
+    ai.chat_text(messages)
+    assert len(calls) == 3
+    stats = svc_llm_cache.get_llm_cache().stats()
+    assert stats["memoryHits"] == 1 and stats["entries"] == 2
+
+
+def test_response_cache_lru_ttl_and_redis_down(monkeypatch):
+    from newBackend.services.svc_llm_cache import LlmResponseCache, llm_cache_key
+
+    key = llm_cache_key("groq", "m", [{"role": "user", "content": "x"}], {"type": "json_object"})
+    assert key == llm_cache_key("groq", "m", [{"content": "x", "role": "user"}], {"type": "json_object"})
+    assert key != llm_cache_key("openai", "m", [{"role": "user", "content": "x"}], {"type": "json_object"})
+
+    cache = LlmResponseCache(mode="memory", max_entries=2)
+    for k in ("a", "b", "c"):
+        cache.put(k, k.upper())
+    assert cache.get("a") is None and cache.get("c") == "C"
+    cache.put("empty", "")
+    assert cache.get("empty") is None
+
+    expired = LlmResponseCache(mode="memory", ttl_sec=0.001)
+    expired.put("k", "v")
+    time.sleep(0.01)
+    assert expired.get("k") is None
+
+    offline = LlmResponseCache(mode="redis", redis_url="redis://127.0.0.1:1/0")
+    offline.put("k", "v")
+    assert offline.get("k") == "v"
+    assert offline.get("missing") is None
+
+
+def test_single_flight_coalesces_concurrent_identical_calls(monkeypatch):
+    import threading
+
+    from backend.llm_singleflight import SingleFlight
+
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def upstream(x):
+        calls.append(x)
+        started.set()
+        release.wait(2)
+        return x * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("k", upstream, 21))) for _ in range(4)]
+    threads[0].start()
+    started.wait(2)
+    for t in threads[1:]:
+        t.start()
+    while flight.stats()["savedCalls"] < 3:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(2)
+
+    assert calls == [21] and results == [42] * 4
+    assert flight.stats() == {"upstreamCalls": 1, "savedCalls": 3, "inFlight": 0}
+    assert flight.do("k", upstream, 1) == 2  # chiave liberata: nuova chiamata
+
+
+def test_single_flight_async_shares_result_and_errors():
+    from backend.llm_singleflight import SingleFlight
+
+    flight = SingleFlight("test-async")
+    calls = []
+
+    async def upstream(fail):
+        calls.append(fail)
+        await asyncio.sleep(0.01)
+        if fail:
+            raise requests.HTTPError("boom")
+        return "ok"
+
+    async def run():
+        ok = await asyncio.gather(*(flight.ado("a", upstream, False) for _ in range(3)))
+        errors = await asyncio.gather(*(flight.ado("b", upstream, True) for _ in range(2)), return_exceptions=True)
+        return ok, errors
+
+    ok, errors = asyncio.run(run())
+    assert ok == ["ok"] * 3 and calls == [False, True]
+    assert all(isinstance(e, requests.HTTPError) for e in errors)
+    assert flight.stats()["savedCalls"] == 3
+
+
+def test_scheduler_concurrency_cap_and_fair_lanes():
+    import threading
+
+    from newBackend.services.svc_llm_limiter import LlmScheduler, llm_lane
+
+    scheduler = LlmScheduler({"groq": {"maxConcurrency": 1}})
+    msgs = [{"role": "user", "content": "x"}]
+    first = scheduler.acquire("groq", "m", msgs)
+    order = []
+
+    def worker(lane, tag):
+        with llm_lane(lane):
+            with scheduler.acquire("groq", "m", msgs):
+                order.append(tag)
+
+    # La lane "burst" accoda 3 richieste prima che "other" ne accodi una
+    threads = [threading.Thread(target=worker, args=("burst", f"b{i}")) for i in range(3)]
+    threads.append(threading.Thread(target=worker, args=("other", "o0")))
+    for t in threads:
+        t.start()
+        while sum(len(q) for q in scheduler._lanes.values()) < threads.index(t) + 1:
+            time.sleep(0.001)
+    assert scheduler.stats()["quotas"]["groq"]["active"] == 1
+    first.release()
+    for t in threads:
+        t.join(2)
+
+    assert order == ["b0", "o0", "b1", "b2"]
+    assert scheduler.stats()["quotas"]["groq"]["active"] == 0
+    with scheduler.acquire("openai", "m", msgs):  # provider senza quote: nessun limite
+        pass
+
+
+def test_scheduler_rate_bucket_and_timeout():
+    from newBackend.services.svc_llm_limiter import LlmScheduler
+
+    scheduler = LlmScheduler({"openai": {"rpm": 1}}, queue_timeout=0.05)
+    msgs = [{"role": "user", "content": "x"}]
+    scheduler.acquire("openai", "m", msgs).release()
+    with pytest.raises(requests.HTTPError):
+        scheduler.acquire("openai", "m", msgs)
+
+    async def run():
+        with pytest.raises(requests.HTTPError):
+            await scheduler.aacquire("openai", "m", msgs)
+
+    asyncio.run(run())
+    assert scheduler.stats()["queued"] == {}
+
+
+def test_decommissioned_model_is_skipped_until_probe_succeeds(monkeypatch):
+    calls = []
+    monkeypatch.setattr(pool, "_sync_client", httpx.Client(transport=httpx.MockTransport(_groq_handler(calls))))
+    monkeypatch.setattr(ai, "GROQ_MODEL", "old-model")
+    monkeypatch.setattr(ai, "GROQ_FALLBACKS", ["good-model"])
+    probes = []
+    health = ModelHealth(probe=lambda m: probes.append(m) or True, probe_interval_sec=0)
+    monkeypatch.setattr(ai, "_model_health", health)
+    messages = [{"role": "user", "content": "hi"}]
+
+    ai.chat_json(messages, use_cache=False)
+    ai.chat_json(messages, use_cache=False)
+    assert calls == ["old-model", "good-model", "good-model"]
+    assert "old-model" in health.stats()["unhealthy"]
+
+    assert health.probe_once() is False
+    assert probes == ["old-model"] and health.stats()["unhealthy"] == {}
+    assert health.order(["old-model", "good-model"]) == ["old-model", "good-model"]
+
+
+def test_astream_chat_forwards_deltas_and_sse_fields(monkeypatch):
+    from newBackend.services import svc_llm_cache
+    from newBackend.services.svc_sse import JsonFieldStream, stream_generation
+
+    calls = []
+    chunks = ['{"g1": "Cia', 'o", "g2": ["a", ', '"b"]}']
+
+    def handler(request):
+        body = json.loads(request.content)
+        calls.append(body["model"])
+        if body["model"] == "old-model":
+            return httpx.Response(400, text="The model old-model has been decommissioned")
+        assert body["stream"] is True
+        lines = [f"data: {json.dumps({'choices': [{'delta': {'content': c}}]})}\n\n" for c in chunks]
+        return httpx.Response(200, content="".join(lines) + "data: [DONE]\n\n",
+                              headers={"content-type": "text/event-stream"})
+
+    monkeypatch.setattr(ai, "GROQ_MODEL", "old-model")
+    monkeypatch.setattr(ai, "GROQ_FALLBACKS", ["good-model"])
+    monkeypatch.setattr(svc_llm_cache, "_llm_cache", svc_llm_cache.LlmResponseCache(mode="memory"))
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def run():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(pool, "_async_client", client)
+        monkeypatch.setattr(pool, "_async_loop", asyncio.get_running_loop())
+        try:
+            deltas = [d async for d in ai.astream_chat(messages)]
+            cached = [d async for d in ai.astream_chat(messages)]
+            events = [e async for e in stream_generation(messages, "groq", lambda r: {"success": True, "raw": r}, "test")]
+            return deltas, cached, events
+        finally:
+            await client.aclose()
+
+    deltas, cached, events = asyncio.run(run())
+    assert deltas == chunks
+    assert cached == ["".join(chunks)]
+    assert calls == ["old-model", "good-model"]
+    assert events[0].startswith("event: start")
+    assert events[-1] == 'event: done\ndata: {"success": true, "raw": "' + "".join(chunks).replace('"', '\\"') + '"}\n\n'
+
+    fields = JsonFieldStream()
+    found = [f for c in chunks for f in fields.feed(c)]
+    assert found == [("g1", "Ciao"), ("g2", ["a", "b"])]
+
+
+def test_legacy_helpers_register_in_the_shared_single_flight_registry(monkeypatch):
+    import os
+    import sys
+
+    import backend.llm_singleflight as shared
+
+    # Legacy layout: backend/ on sys.path, helpers imported as top-level modules
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(shared.__file__)))
+    for name in ("call_groq", "call_openai"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    import call_groq
+    import call_openai
+    import llm_singleflight
+
+    assert llm_singleflight is shared
+    monkeypatch.setattr(call_groq, "_call_groq", lambda messages: "ok")
+    assert call_groq.call_groq([{"role": "user", "content": "hi"}]) == "ok"
+
+    stats = shared.single_flight_stats()
+    assert stats["legacy.call_groq"]["upstreamCalls"] >= 1
+    assert "legacy.call_openai" in stats
+
+
+def test_lane_survives_worker_threads_and_retry_executor():
+    from concurrent.futures import ThreadPoolExecutor
+
+    from newBackend.services.retry.retry_strategy import retry_async_with_backoff
+    from newBackend.services.svc_llm_limiter import LlmScheduler, bind_llm_lane, llm_lane
+
+    scheduler = LlmScheduler({"groq": {"maxConcurrency": 1}})
+    msgs = [{"role": "user", "content": "x"}]
+    held = scheduler.acquire("groq", "m", msgs)
+
+    def call():
+        with scheduler.acquire("groq", "m", msgs):
+            return "ok"
+
+    async def via_retry():
+        with llm_lane("/api/nlp/generate-ai-messages"):
+            return await retry_async_with_backoff(call, 1, 0.0, 0.0)
+
+    with llm_lane("/api/plan-engines"), ThreadPoolExecutor(max_workers=1) as workers:
+        pooled = workers.submit(bind_llm_lane(call))
+        loop = asyncio.new_event_loop()
+        retried = loop.create_task(via_retry())
+        while sum(scheduler.stats()["queued"].values()) < 2:
+            loop.run_until_complete(asyncio.sleep(0.001))
+        queued = scheduler.stats()["queued"]
+        held.release()
+        assert loop.run_until_complete(retried) == ("ok", None)
+        loop.close()
+        assert pooled.result(2) == "ok"
+
+    assert queued == {"/api/plan-engines": 1, "/api/nlp/generate-ai-messages": 1}
+
+
+def test_route_lane_is_the_endpoint_template_not_the_path():
+    from fastapi import Depends, FastAPI
+    from fastapi.testclient import TestClient
+
+    from newBackend.services.svc_llm_limiter import _current_lane, route_llm_lane
+
+    app = FastAPI(dependencies=[Depends(route_llm_lane)])
+
+    @app.post("/api/task/{task_id}/test-extraction")
+    def sync_endpoint(task_id: str):
+        return {"lane": _current_lane.get()}
+
+    @app.get("/api/async/{x}")
+    async def async_endpoint(x: str):
+        return {"lane": _current_lane.get()}
+
+    client = TestClient(app)
+    for task_id in ("t1", "t2"):
+        assert client.post(f"/api/task/{task_id}/test-extraction").json() == {"lane": "/api/task/{task_id}/test-extraction"}
+    assert client.get("/api/async/1").json() == {"lane": "/api/async/{x}"}
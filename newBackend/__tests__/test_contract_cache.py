@@ -0,0 +1,107 @@
+"""Unit tests for the task contract cache (Mongo collection replaced by a fake)."""
+
+from newBackend.services.svc_contract_cache import PROJECTION, ContractCache
+
+
+class FakeTasks:
+    def __init__(self, docs):
+        self.docs = {d["_id"]: d for d in docs}
+        self.find_one_calls = []
+
+    def _project(self, doc, projection):
+        return {k: v for k, v in doc.items() if k in projection}
+
+    def find_one(self, query, projection=None):
+        self.find_one_calls.append(projection)
+        ids = {c.get("id") for c in query["$or"]} | {c.get("_id") for c in query["$or"]}
+        for doc in self.docs.values():
+            if doc["_id"] in ids or doc.get("id") in ids:
+                return self._project(doc, projection)
+        return None
+
+    def find(self, query, projection=None):
+        wanted = set(query["_id"]["$in"])
+        return [self._project(d, projection) for d in self.docs.values() if d["_id"] in wanted]
+
+
+def _tasks():
+    return FakeTasks([
+        {"_id": "oid-1", "id": "task-1", "updatedAt": 1, "label": "x" * 1000, "dataContract": {"engines": ["llm"]}},
+        {"_id": "oid-2", "id": "task-2", "updatedAt": 1, "semanticContract": {"parsers": ["ner"]}},
+    ])
+
+
+def test_get_uses_projection_and_serves_hits_from_memory():
+    tasks = _tasks()
+    cache = ContractCache(lambda: tasks, invalidation="ttl")
+
+    first = cache.get("task-1")
+    second = cache.get("task-1")
+
+    assert first == second == {"found": True, "contract": {"engines": ["llm"]}}
+    assert tasks.find_one_calls == [PROJECTION]
+    assert cache.get("task-2")["contract"] == {"parsers": ["ner"]}
+    assert cache.get("missing") == {"found": False, "contract": None}
+    assert cache.stats()["hits"] == 1 and cache.stats()["entries"] == 2
+
+
+def test_explicit_invalidation_and_poll_on_updated_at():
+    tasks = _tasks()
+    cache = ContractCache(lambda: tasks, invalidation="ttl")
+    cache.get("task-1")
+    cache.get("task-2")
+
+    assert cache.invalidate("task-1") == 1
+    cache.get("task-1")
+    assert len(tasks.find_one_calls) == 3
+
+    tasks.docs["oid-1"] = {**tasks.docs["oid-1"], "updatedAt": 2, "dataContract": {"engines": ["regex"]}}
+    del tasks.docs["oid-2"]
+    cache.poll_once()
+
+    assert cache.stats()["entries"] == 0
+    assert cache.get("task-1")["contract"] == {"engines": ["regex"]}
+    assert cache.get("task-2")["found"] is False
+
+
+def test_change_stream_events_invalidate_by_document_key():
+    tasks = _tasks()
+    tasks.watch = lambda pipeline: _Stream([{"operationType": "update", "documentKey": {"_id": "oid-1"}}])
+    cache = ContractCache(lambda: tasks, invalidation="ttl")
+    cache.get("task-1")
+    cache.get("task-2")
+
+    cache._watch_changes()
+
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["invalidations"] == 1
+
+
+class _Stream(list):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_invalidation_during_fetch_is_not_undone_and_object_ids_match():
+    from bson import ObjectId
+
+    oid = ObjectId()
+    tasks = FakeTasks([{"_id": oid, "id": "task-1", "updatedAt": 1, "dataContract": {"v": 1}}])
+    cache = ContractCache(lambda: tasks, invalidation="ttl")
+    fetch = tasks.find_one
+
+    def racing_find_one(query, projection=None):
+        doc = fetch(query, projection)
+        cache._invalidate_doc_ids([oid])  # change-stream event between find_one and the store
+        return doc
+
+    tasks.find_one = racing_find_one
+    assert cache.get("task-1")["contract"] == {"v": 1}
+    assert cache.stats()["entries"] == 0
+
+    tasks.find_one = fetch
+    cache.get("task-1")
+    assert cache.invalidate(str(oid)) == 1
@@ -0,0 +1,204 @@
+"""Unit tests for the compiled ContractExtractor execution plan."""
+
+import pytest
+
+from newBackend.services import contract_extractor as ce
+
+CONTRACT = {
+    "subgroups": [
+        {"subTaskKey": "day", "label": "Giorno", "normalization": "day always numeric (1-31)", "optional": False},
+        {"subTaskKey": "month", "label": "Mese", "normalization": "month always numeric (january -> 1)"},
+        {"subTaskKey": "year", "label": "Anno", "normalization": "year always 4 digits (61 -> 1961)"},
+    ],
+    "outputCanonical": {"keys": ["day", "month", "year"]},
+}
+ENGINE = {"type": "regex", "config": {"regex": r"(?P<day>\d{1,2})\s+(?P<month>[a-z]+)\s+(?P<year>\d{2,4})"}}
+
+
+@pytest.fixture(autouse=True)
+def _empty_plan_cache(monkeypatch):
+    monkeypatch.setattr(ce, "_plans", ce.OrderedDict())
+
+
+def test_regex_extraction_normalizes_and_validates():
+    out = ce.ContractExtractor(CONTRACT, ENGINE).extract("nato il 12 Marzo 61")
+    assert out["values"] == {"day": 12, "month": 3, "year": 1961}
+    assert out["hasMatch"] is True and out["confidence"] == 0.95
+
+    out = ce.ContractExtractor(CONTRACT, ENGINE).extract("40 foo 1800")
+    assert out["errors"] == ["Invalid day: 40 (must be 1-31)", "Invalid year: 1800 (must be 1900-2100)"]
+
+
+def test_plan_is_compiled_once_per_contract_hash():
+    first = ce.ContractExtractor(CONTRACT, ENGINE).plan
+    assert ce.ContractExtractor(dict(CONTRACT), dict(ENGINE)).plan is first
+    assert first.regex.flags & ce.re.IGNORECASE
+    assert [f.normalizer for f in first.fields] == [ce._normalize_day, ce._normalize_month, ce._normalize_year]
+
+    other = {"type": "regex", "config": {"regex": r"(?P<day>\d+)"}}
+    assert ce.ContractExtractor(CONTRACT, other).plan is not first
+
+
+def test_invalid_regex_and_llm_template_are_resolved_at_compile_time():
+    plan = ce.compile_plan(CONTRACT, {"type": "regex", "config": {"regex": "(?P<x"}})
+    assert plan.regex is None and plan.regex_error
+
+    llm = ce.compile_plan(
+        {"subentities": [{"subTaskKey": "Email", "label": "Mail", "type": "email"}]},
+        {"type": "llm", "config": {"aiPrompt": "Fields:\n{subData}\nText: {text}"}},
+    )
+    assert llm.user_prompt_template == "Fields:\n- Email: Mail (email)\nText: {text}"
+    assert dict(llm.llm_key_map) == {"email": "Email"}
+
+
+def test_embedding_examples_are_encoded_once_and_invalidated_on_change(monkeypatch):
+    import numpy as np
+
+    vectors = {"sì": [1.0, 0.0], "certo": [0.8, 0.6], "no": [0.0, 1.0], "va bene": [0.9, 0.1]}
+    batches = []
+
+    def encode_many(texts):
+        batches.append(list(texts))
+        return np.array([vectors[t] for t in texts])
+
+    monkeypatch.setattr(ce, "_embedding_functions", lambda: ("fake-model", encode_many, lambda t: vectors[t]))
+    monkeypatch.setattr(ce, "_example_matrices", ce.OrderedDict())
+    contract = {"subgroups": [{"subTaskKey": "answer"}]}
+    engine = {"type": "embedding", "config": {
+        "embeddingExamples": {"positive": ["sì", "certo"], "negative": ["no"]}, "embeddingThreshold": 0.8}}
+
+    assert ce.ContractExtractor(contract, engine).extract("va bene")["values"] == {"answer": "va bene"}
+    assert ce.ContractExtractor(contract, engine).extract("no")["values"] == {}
+    assert batches == [["sì", "certo", "no"]]
+
+    engine["config"]["embeddingExamples"]["positive"] = ["certo"]
+    ce.ContractExtractor(contract, engine).extract("va bene")
+    assert batches[-1] == ["certo", "no"]
+
+
+def test_cascade_runs_cheap_first_and_stops_early(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ce.ContractExtractor, "_apply_llm_engine", lambda self, text: calls.append(text) or {"day": "5"})
+    engines = [
+        {"type": "llm", "enabled": True},
+        {"type": "regex", "enabled": True, "patterns": [r"(?P<day>\d{1,2})\s+(?P<month>[a-z]+)\s+(?P<year>\d{2,4})"]},
+        {"type": "embedding", "enabled": False},
+    ]
+    cascade = ce.CascadeExtractor(CONTRACT, engines, min_confidence=0.9)
+    assert [e.plan.engine_type for e in cascade.extractors] == ["regex", "llm"]
+
+    out = cascade.extract("il 3 maggio 1990")
+    assert out["source"] == "regex" and out["values"] == {"day": 3, "month": 5, "year": 1990}
+    assert [step["engine"] for step in out["cascade"]] == ["regex"] and calls == []
+
+    # No regex match: falls through to the LLM, whose partial result stays below minConfidence
+    out = cascade.extract("giorno 7")
+    assert [step["engine"] for step in out["cascade"]] == ["regex", "llm"]
+    assert calls == ["giorno 7"] and out["hasMatch"] is False
+    assert ce.cascade_stats()["engines"]["regex"]["runs"] >= 2
+
+
+def test_extract_many_batches_embeddings_and_fans_out_llm(monkeypatch):
+    import numpy as np
+    import threading
+
+    vectors = {"sì": [1.0, 0.0], "no": [0.0, 1.0], "va bene": [0.9, 0.1], "mai": [0.1, 0.9]}
+    batches = []
+
+    def encode_many(texts):
+        batches.append(list(texts))
+        return np.array([vectors[t] for t in texts])
+
+    monkeypatch.setattr(ce, "_embedding_functions", lambda: ("fake-model", encode_many, None))
+    monkeypatch.setattr(ce, "_example_matrices", ce.OrderedDict())
+    contract = {"subgroups": [{"subTaskKey": "answer"}]}
+    engine = {"type": "embedding", "config": {"embeddingExamples": {"positive": ["sì"], "negative": ["no"]}}}
+
+    out = ce.ContractExtractor(contract, engine).extract_many(["va bene", "mai", "sì"])
+    assert [r["values"] for r in out] == [{"answer": "va bene"}, {}, {"answer": "sì"}]
+    assert sorted(batches) == [["sì", "no"], ["va bene", "mai", "sì"]]
+
+    threads = set()
+    monkeypatch.setattr(ce.ContractExtractor, "_apply_llm_engine",
+                        lambda self, text: threads.add(threading.get_ident()) or {"answer": text.upper()})
+    out = ce.ContractExtractor(contract, {"type": "llm", "config": {}}).extract_many(["a", "b", "c"], concurrency=3)
+    assert [r["values"] for r in out] == [{"answer": "A"}, {"answer": "B"}, {"answer": "C"}]
+    assert threading.get_ident() not in threads
+
+
+def test_js_named_groups_compile_for_the_cascade_regex_stage(monkeypatch):
+    monkeypatch.setattr(ce.ContractExtractor, "_apply_llm_engine", lambda self, text: pytest.fail("LLM should not run"))
+    engines = [
+        {"type": "llm", "enabled": True},
+        {"type": "regex", "enabled": True, "patterns": [r"(?<day>\d{1,2})\s+(?<month>[a-z]+)\s+(?<year>\d{2,4})(?<!0000)"]},
+    ]
+    out = ce.CascadeExtractor(CONTRACT, engines, min_confidence=0.9).extract("il 3 maggio 1990")
+
+    assert out["source"] == "regex" and out["values"] == {"day": 3, "month": 5, "year": 1990}
+    assert ce._python_regex(r"(?<d>\d)-\k<d>") == r"(?P<d>\d)-(?P=d)"
+
+
+class _Ent:
+    def __init__(self, text, label):
+        self.text, self.label_ = text, label
+
+
+class _FakeNlp:
+    pipe_names = ["tok2vec", "morphologizer", "parser", "lemmatizer", "attribute_ruler", "ner"]
+
+    def __init__(self, date_entities=True):
+        self.calls = []
+        self.date_entities = date_entities  # it_core_news_sm: only PER/LOC/ORG/MISC
+
+    def _doc(self, text):
+        ents = [_Ent("Mario Rossi", "PER")] if "Mario" in text else []
+        ents += [_Ent("Roma", "LOC")] if "Roma" in text else []
+        ents += [_Ent("12 marzo 1961", "DATE")] if "marzo" in text and self.date_entities else []
+        return type("Doc", (), {"ents": ents, "text": text})()
+
+    def __call__(self, text, disable=()):
+        self.calls.append(("call", 1, tuple(disable)))
+        return self._doc(text)
+
+    def pipe(self, texts, batch_size, n_process, disable=()):
+        self.calls.append(("pipe", len(texts), tuple(disable)))
+        return (self._doc(t) for t in texts)
+
+
+def test_ner_maps_entity_types_onto_subentities_and_batches_with_pipe(monkeypatch):
+    from backend import ner_spacy
+
+    nlp = _FakeNlp()
+    monkeypatch.setattr(ner_spacy, "_nlp", nlp)
+
+    person = {"subgroups": [{"subTaskKey": "nome", "label": "Nome"}, {"subTaskKey": "city", "label": "Città"}]}
+    extractor = ce.ContractExtractor(person, {"type": "ner", "config": {"entityTypes": ["PER", "LOC"]}})
+    assert extractor.plan.ner_fields == (("nome", ("PER",), None), ("city", ("LOC",), None))
+
+    assert extractor.extract("sono Mario Rossi di Roma")["values"] == {"nome": "Mario Rossi", "city": "Roma"}
+    many = extractor.extract_many(["Mario", "Roma", "niente"])
+    assert [r["values"] for r in many] == [{"nome": "Mario Rossi"}, {"city": "Roma"}, {}]
+    assert [c[:2] for c in nlp.calls] == [("call", 1), ("pipe", 3)]
+    assert nlp.calls[1][2] == ("morphologizer", "parser", "lemmatizer", "attribute_ruler")
+
+    # DATE entity split onto day/month/year; explicit mapping form
+    date_engine = {"type": "ner", "config": {"entityTypes": {"day": "DATE", "month": "DATE", "year": "DATE"}}}
+    out = ce.ContractExtractor(CONTRACT, date_engine).extract("il 12 marzo 1961")
+    assert out["values"] == {"day": 12, "month": 3, "year": 1961} and out["hasMatch"] is True
+
+
+def test_ner_dates_without_date_entities_and_missing_model_logged_once(monkeypatch, capsys):
+    from backend import ner_spacy
+
+    monkeypatch.setattr(ner_spacy, "_nlp", _FakeNlp(date_entities=False))
+    date_engine = {"type": "ner", "config": {"entityTypes": ["DATE"]}}
+    out = ce.ContractExtractor(CONTRACT, date_engine).extract("sono nato il 12 marzo 1961")
+    assert out["values"] == {"day": 12, "month": 3, "year": 1961}
+
+    monkeypatch.setattr(ner_spacy, "_nlp", None)
+    monkeypatch.setattr(ner_spacy, "_load_error", "No module named 'spacy'")
+    monkeypatch.setattr(ce, "_ner_unavailable_logged", False)
+    extractor = ce.ContractExtractor(CONTRACT, date_engine)
+    assert [r["values"] for r in extractor.extract_many(["a", "b"])] == [{}, {}]
+    extractor.extract("c")
+    assert capsys.readouterr().out.count("spaCy not available") == 1
@@ -0,0 +1,102 @@
+"""Unit tests for the embedding micro-batcher, the bounded encode pool and the text cache."""
+
+import asyncio
+
+import pytest
+
+from backend.ai_endpoints.embedding_batcher import EmbeddingMicroBatcher
+from backend.ai_endpoints.embedding_executor import EncodeExecutor, EncodeQueueFull
+
+
+def test_concurrent_requests_share_one_encode_call():
+    calls = []
+
+    def encode_many(texts):
+        calls.append(list(texts))
+        return [f"vec:{t}" for t in texts]
+
+    batcher = EmbeddingMicroBatcher(encode_many, max_batch=64, max_wait_ms=20)
+
+    async def run():
+        return await asyncio.gather(*[batcher.encode(t) for t in ["a", "b", "a", "c"]])
+
+    assert asyncio.run(run()) == ["vec:a", "vec:b", "vec:a", "vec:c"]
+    assert calls == [["a", "b", "c"]]
+
+
+def test_errors_reach_every_caller():
+    def encode_many(texts):
+        raise ValueError("boom")
+
+    batcher = EmbeddingMicroBatcher(encode_many, max_batch=2, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(batcher.encode("x"), batcher.encode("y"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_flushed_batch_tasks_are_held_until_done():
+    import gc
+    import threading
+
+    release = threading.Event()
+
+    def encode_many(texts):
+        release.wait(2)
+        return [f"vec:{t}" for t in texts]
+
+    batcher = EmbeddingMicroBatcher(encode_many, max_batch=1, max_wait_ms=50)
+
+    async def run():
+        pending = asyncio.ensure_future(batcher.encode("a"))
+        await asyncio.sleep(0.01)
+        running = list(batcher._running)
+        gc.collect()
+        release.set()
+        return running, await pending
+
+    running, vector = asyncio.run(run())
+    assert len(running) == 1 and vector == "vec:a"
+    assert batcher._running == set()
+
+
+def test_executor_rejects_when_queue_full():
+    executor = EncodeExecutor(workers=1, max_queue=1)
+
+    async def run():
+        gate = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def blocking():
+            asyncio.run_coroutine_threadsafe(gate.wait(), loop).result()
+            return "done"
+
+        first = asyncio.ensure_future(executor.run(blocking))
+        await asyncio.sleep(0.01)
+        with pytest.raises(EncodeQueueFull):
+            await executor.run(lambda: None)
+        gate.set()
+        return await first
+
+    assert asyncio.run(run()) == "done"
+    assert executor.stats()["rejected"] == 1
+
+
+def test_embedding_cache_lru_by_bytes_and_counters():
+    from backend.ai_endpoints.embedding_cache import EmbeddingCache
+
+    vec = [0.5] * 100  # 400 bytes as float32
+    cache = EmbeddingCache(max_bytes=1500, ttl_sec=0)
+    cache.put("m", "uno", vec)
+    cache.put("m", "due", vec)
+    assert cache.get("m", "  uno ") is not None  # whitespace-normalized key
+    cache.put("m", "tre", vec)  # evicts "due" (least recently used)
+
+    assert cache.get("m", "due") is None
+    assert cache.get("other-model", "uno") is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 1 and stats["misses"] == 2
+    assert stats["bytes"] <= 1500
@@ -0,0 +1,214 @@
+"""Unit tests for the vectorized intent embedding index."""
+
+import numpy as np
+
+from backend.ai_endpoints.intent_embedding_index import IntentIndex, IntentMatrices
+
+
+def _unit(rng, n, dim=16):
+    m = rng.normal(size=(n, dim))
+    return m / np.linalg.norm(m, axis=1, keepdims=True)
+
+
+def _loop_score(query, matching, not_matching):
+    """Reference implementation: the original per-pair Python loop."""
+    best, best_text = 0.0, ""
+    for text, emb in matching:
+        s = float(np.dot(query, emb))
+        if s > best:
+            best, best_text = s, text
+    penalty = 0.0
+    for _, emb in not_matching:
+        s = float(np.dot(query, emb))
+        if s > 0.7:
+            penalty += (s - 0.7) * 0.5
+    return max(0.0, best - penalty), best_text
+
+
+def test_classify_matches_loop_reference():
+    rng = np.random.default_rng(0)
+    index = IntentIndex()
+    raw = {}
+    for k in range(5):
+        pos = [(f"i{k}-p{j}", v) for j, v in enumerate(_unit(rng, 7))]
+        neg = [(f"i{k}-n{j}", v) for j, v in enumerate(_unit(rng, 3))]
+        raw[f"intent{k}"] = (pos, neg)
+        index.put(f"intent{k}", IntentMatrices.build(pos, neg))
+
+    query = _unit(rng, 1)[0]
+    results = index.classify(query)
+
+    expected = []
+    for intent_id, (pos, neg) in raw.items():
+        score, text = _loop_score(query, pos, neg)
+        if score > 0:
+            expected.append((intent_id, score, text))
+    expected.sort(key=lambda x: x[1], reverse=True)
+
+    assert [r["intentId"] for r in results] == [e[0] for e in expected]
+    for r, (_, score, text) in zip(results, expected):
+        assert abs(r["score"] - score) < 1e-5
+        assert r["bestMatchText"] == text
+
+
+def test_negative_penalty_and_filter():
+    index = IntentIndex()
+    v = np.array([1.0, 0.0, 0.0])
+    index.put("a", IntentMatrices.build([("yes", v)], [("no", v)]))
+    index.put("b", IntentMatrices.build([("ok", np.array([0.6, 0.8, 0.0]))], []))
+
+    results = index.classify(v)
+    by_id = {r["intentId"]: r["score"] for r in results}
+    assert abs(by_id["a"] - (1.0 - 0.15)) < 1e-6
+    assert abs(by_id["b"] - 0.6) < 1e-6
+
+    only_b = index.classify(v, ["b", "missing"])
+    assert [r["intentId"] for r in only_b] == ["b"]
+
+
+def test_matrices_are_contiguous_float32():
+    entry = IntentMatrices.build([("x", [3.0, 4.0])], [])
+    assert entry.matching.dtype == np.float32
+    assert entry.matching.flags["C_CONTIGUOUS"]
+    assert np.allclose(entry.matching[0], [0.6, 0.8])
+    assert entry.not_matching.shape == (0, 2)
+
+
+def test_persistent_index_shared_between_instances(tmp_path):
+    from backend.ai_endpoints.intent_embedding_store import PersistentIntentIndex
+
+    writer = PersistentIntentIndex(tmp_path, "model-a")
+    reader = PersistentIntentIndex(tmp_path, "model-a")
+    other_model = PersistentIntentIndex(tmp_path, "model-b")
+
+    writer.put("book", IntentMatrices.build([("prenota", [1.0, 0.0])], [("annulla", [0.0, 1.0])]))
+
+    entry = reader.get("book")
+    assert entry is not None
+    assert isinstance(entry.matching, np.memmap)
+    assert entry.matching_texts == ("prenota",)
+    assert entry.not_matching_count == 1
+    assert reader.classify([1.0, 0.0])[0]["intentId"] == "book"
+    assert "book" not in other_model
+
+    writer.put("book", IntentMatrices.build([("riserva", [0.0, 1.0])], []))
+    assert reader.get("book").matching_texts == ("riserva",)
+    assert len(list(tmp_path.glob("*.npy"))) == 1
+
+
+def test_quantized_storage_scores_close_to_float32(tmp_path):
+    from backend.ai_endpoints.intent_embedding_store import PersistentIntentIndex
+
+    rng = np.random.default_rng(1)
+    pos = [(f"p{j}", v) for j, v in enumerate(_unit(rng, 20, dim=64))]
+    neg = [(f"n{j}", v) for j, v in enumerate(_unit(rng, 5, dim=64))]
+    exact = IntentMatrices.build(pos, neg)
+    query = _unit(rng, 1, dim=64)[0]
+
+    for mode, tol in (("float16", 1e-3), ("int8", 2e-2)):
+        q = exact.quantized(mode)
+        assert q.storage_mode == mode
+        assert q.nbytes < exact.nbytes
+        index = PersistentIntentIndex(tmp_path / mode, "m")
+        index.put("x", q)
+        reloaded = PersistentIntentIndex(tmp_path / mode, "m").get("x")
+        assert reloaded.storage_mode == mode
+        for entry in (q, reloaded):
+            got = IntentIndex()
+            got.put("x", entry)
+            ref = IntentIndex()
+            ref.put("x", exact)
+            a, b = got.classify(query), ref.classify(query)
+            assert abs((a[0]["score"] if a else 0) - (b[0]["score"] if b else 0)) < tol
+
+
+def _clustered_index(rng, ann, n_intents=40, per_intent=30, dim=32):
+    centers = _unit(rng, n_intents, dim)
+    index = IntentIndex(ann)
+    for k in range(n_intents):
+        pos = centers[k] + 0.05 * rng.normal(size=(per_intent, dim))
+        index.put(f"intent{k}", IntentMatrices.build([(f"i{k}-p{j}", v) for j, v in enumerate(pos)], []))
+    return index, centers
+
+
+def test_ivf_shortlist_matches_brute_force_top1():
+    from backend.ai_endpoints.intent_ann_index import IvfAnnIndex
+
+    brute, centers = _clustered_index(np.random.default_rng(3), None)
+    ivf_ann = IvfAnnIndex(n_probe=8, min_rows=100, shortlist=5, background_training=False)
+    ivf, _ = _clustered_index(np.random.default_rng(3), ivf_ann)
+
+    rng = np.random.default_rng(4)
+    for k in range(len(centers)):
+        query = centers[k] + 0.05 * rng.normal(size=centers.shape[1])
+        exact = brute.classify(query)[0]
+        approx = ivf.classify(query)
+        assert approx[0]["intentId"] == exact["intentId"]
+        assert approx[0]["score"] == exact["score"]
+        assert len(approx) <= 5
+    assert ivf.ann.stats()["lists"] > 1
+
+
+def test_ivf_incremental_update_touches_only_intent_lists():
+    from backend.ai_endpoints.intent_ann_index import IvfAnnIndex
+
+    rng = np.random.default_rng(5)
+    ann = IvfAnnIndex(n_probe=2, min_rows=100, background_training=False)
+    index, centers = _clustered_index(rng, ann)
+    index.classify(centers[0])  # impacchetta le posting list
+    packed_before = dict(ann._packed)
+
+    # Riaddestra intent0 con le frasi spostate sul centro di intent1
+    moved = centers[1] + 0.05 * rng.normal(size=(10, centers.shape[1]))
+    index.put("intent0", IntentMatrices.build([(f"m{j}", v) for j, v in enumerate(moved)], []))
+    touched = set(ann._dirty)
+    assert touched and len(touched) < len(packed_before)
+
+    top = index.classify(centers[1])
+    assert {r["intentId"] for r in top[:2]} == {"intent0", "intent1"}
+    untouched = set(packed_before) - touched
+    assert all(ann._packed[c] is packed_before[c] for c in untouched)
+
+    index.remove("intent0")
+    assert "intent0" not in [r["intentId"] for r in index.classify(centers[1])]
+
+
+def test_ivf_trains_in_background_and_falls_back_on_short_shortlist(monkeypatch):
+    from backend.ai_endpoints import intent_ann_index as ann_module
+    from backend.ai_endpoints.intent_ann_index import IvfAnnIndex
+
+    ann = IvfAnnIndex(n_probe=1, min_rows=100, shortlist=5)
+    index, centers = _clustered_index(np.random.default_rng(8), ann)
+    assert ann.wait_trained(5) and ann.stats()["lists"] > 1
+
+    # La query non addestra mai: il costo del k-means resta fuori da classify
+    trained = []
+    monkeypatch.setattr(ann_module, "spherical_kmeans", lambda *a, **k: trained.append(1))
+    query = centers[0] / np.linalg.norm(centers[0])
+    ann.shortlist = len(centers)
+    assert ann.candidates(query) is None  # un solo cluster sondato: shortlist più corta di limit
+    brute, _ = _clustered_index(np.random.default_rng(8), None)
+    assert index.classify(query) == brute.classify(query)  # fallback brute force, non "nessun match"
+    assert trained == []
+
+
+def test_classify_batch_matches_single_classify():
+    rng = np.random.default_rng(7)
+    for mode in ("float32", "int8"):
+        index = IntentIndex()
+        for k in range(6):
+            pos = [(f"i{k}-p{j}", v) for j, v in enumerate(_unit(rng, 5))]
+            neg = [(f"i{k}-n{j}", v) for j, v in enumerate(_unit(rng, 2))]
+            index.put(f"intent{k}", IntentMatrices.build(pos, neg).quantized(mode))
+
+        queries = _unit(rng, 4)
+        batch = index.classify_batch(queries, top_k=3)
+        assert len(batch) == 4
+        for query, top in zip(queries, batch):
+            single = index.classify(query)[:3]
+            assert [r["intentId"] for r in top] == [r["intentId"] for r in single]
+            assert [r["bestMatchText"] for r in top] == [r["bestMatchText"] for r in single]
+            assert np.allclose([r["score"] for r in top], [r["score"] for r in single], atol=1e-5)
+
+        filtered = index.classify_batch(queries, intent_ids=["intent1", "missing"], top_k=5)
+        assert all(r["intentId"] == "intent1" for top in filtered for r in top)
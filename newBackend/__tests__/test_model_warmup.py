@@ -0,0 +1,67 @@
+"""Unit tests for the opt-in model warm-up at startup."""
+
+import asyncio
+
+from newBackend.services import svc_model_warmup as warmup
+
+
+def test_preload_models_env(monkeypatch):
+    monkeypatch.delenv("OMNIA_PRELOAD_MODELS", raising=False)
+    assert warmup.preload_models() == []
+    monkeypatch.setenv("OMNIA_PRELOAD_MODELS", "1")
+    assert warmup.preload_models() == ["embeddings", "spacy"]
+    monkeypatch.setenv("OMNIA_PRELOAD_MODELS", "spacy, unknown")
+    assert warmup.preload_models() == ["spacy"]
+
+
+def test_not_ready_until_warmup_finishes(monkeypatch):
+    monkeypatch.setenv("OMNIA_PRELOAD_MODELS", "embeddings,spacy")
+
+    def fail():
+        raise RuntimeError("missing model")
+
+    monkeypatch.setitem(warmup._WARMUPS, "embeddings", lambda: None)
+    monkeypatch.setitem(warmup._WARMUPS, "spacy", fail)
+
+    async def run():
+        task = warmup.start_model_warmup()
+        during = warmup.warmup_status()
+        await task
+        return during, warmup.warmup_status()
+
+    during, after = asyncio.run(run())
+    assert during["ready"] is False
+    assert after["ready"] is True
+    assert after["models"]["embeddings"]["status"] == "ready"
+    assert after["models"]["spacy"]["status"] == "failed"
+
+
+def test_embeddings_warmup_runs_on_encode_pool_and_model_loads_once(monkeypatch):
+    import threading
+    import time
+
+    from backend.ai_endpoints import intent_embeddings as emb
+
+    threads = []
+    monkeypatch.setenv("OMNIA_PRELOAD_MODELS", "embeddings")
+    monkeypatch.setitem(warmup._WARMUPS, "embeddings", lambda: threads.append(threading.current_thread().name))
+    asyncio.run(warmup._run_model_warmup(["embeddings"]))
+    assert threads and threads[0].startswith("embeddings-encode")
+
+    loads = []
+
+    def slow_model(name):
+        loads.append(name)
+        time.sleep(0.05)
+        return object()
+
+    monkeypatch.setattr(emb, "_sentence_transformer_available", True)
+    monkeypatch.setattr(emb, "SentenceTransformer", slow_model, raising=False)
+    monkeypatch.setattr(emb, "_local_model", None, raising=False)
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(emb._get_local_model())) for _ in range(4)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join(2)
+    assert len(loads) == 1 and len(set(map(id, results))) == 1
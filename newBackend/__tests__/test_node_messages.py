@@ -0,0 +1,96 @@
+"""Unit tests for incremental generate-node-messages (AI call replaced by a fake)."""
+
+import json
+import re
+import threading
+
+import pytest
+
+from newBackend.services import svc_node_messages as nm
+from newBackend.services.svc_llm_cache import LlmResponseCache
+
+CONTRACT = {"entity": {"label": "Email", "kind": "email"}}
+
+
+def _matrix():
+    return [
+        {"guid": "s1", "stepType": "start", "escalationIndex": 0},
+        {"guid": "nm1", "stepType": "noMatch", "escalationIndex": 0},
+        {"guid": "nm2", "stepType": "noMatch", "escalationIndex": 1},
+        {"guid": "ok1", "stepType": "success", "escalationIndex": 0},
+    ]
+
+
+@pytest.fixture
+def fake_ai(monkeypatch):
+    monkeypatch.setattr(nm, "_node_messages_cache", LlmResponseCache(mode="memory"))
+    calls = []
+    lock = threading.Lock()
+
+    def chat_json(messages, provider="groq", use_cache=True):
+        guids = re.findall(r"- GUID: (\w+)", messages[1]["content"])
+        with lock:
+            calls.append(guids)
+        if "boom" in guids:
+            raise ValueError("provider down")
+        return json.dumps({g: f"text {g}" for g in guids if g != "lost"})
+
+    monkeypatch.setattr(nm, "chat_json", chat_json)
+    return calls
+
+
+def test_only_changed_entries_are_regenerated(fake_ai):
+    out = nm.generate_node_messages("Email", CONTRACT, _matrix(), batch_size=2, concurrency=2)
+    assert out["messages"] == {g: f"text {g}" for g in ["s1", "nm1", "nm2", "ok1"]}
+    # noMatch escalations stay in the same sub-batch
+    assert sorted(fake_ai) == [["nm1", "nm2"], ["ok1"], ["s1"]]
+
+    fake_ai.clear()
+    matrix = _matrix()
+    matrix[3]["guid"] = "ok2"
+    out = nm.generate_node_messages("Email", CONTRACT, matrix)
+    assert fake_ai == [["ok2"]]
+    assert out["cache"] == {"reused": 3, "generated": 1, "fallbacks": 0}
+
+    fake_ai.clear()
+    nm.generate_node_messages("Email", {"entity": {"label": "Mail", "kind": "email"}}, matrix)
+    assert len(fake_ai) == 1 and len(fake_ai[0]) == 4
+
+
+def test_failed_sub_batch_and_missing_guid_use_fallbacks(fake_ai):
+    matrix = _matrix() + [
+        {"guid": "boom", "stepType": "confirmation", "escalationIndex": 0},
+        {"guid": "lost", "stepType": "notConfirmed", "escalationIndex": 0},
+    ]
+    out = nm.generate_node_messages("Email", CONTRACT, matrix, batch_size=1)
+    assert out["messages"]["boom"] == "Confermi: {input}?"
+    assert out["messages"]["lost"] == "Qual è la email corretta?"
+    assert out["cache"]["fallbacks"] == 2
+
+    fake_ai.clear()
+    nm.generate_node_messages("Email", CONTRACT, matrix, batch_size=1)
+    assert sorted(fake_ai) == [["boom"], ["lost"]]
+
+    with pytest.raises(ValueError):
+        nm.generate_node_messages("Email", CONTRACT, [matrix[4]])
+
+
+def test_single_guid_prompt_builds():
+    messages, guids = nm.build_node_messages_prompt("Email", CONTRACT, [_matrix()[0]], "it")
+    assert guids == ["s1"]
+    assert '"s1": "message text 1"' in messages[1]["content"]
+
+
+def test_regenerated_escalation_keeps_its_level(fake_ai, monkeypatch):
+    prompts = []
+    chat_json = nm.chat_json
+    monkeypatch.setattr(nm, "chat_json", lambda messages, **kw: prompts.append(messages[1]["content"]) or chat_json(messages, **kw))
+
+    matrix = _matrix() + [{"guid": "nm3", "stepType": "noMatch", "escalationIndex": 2}]
+    nm.generate_node_messages("Email", CONTRACT, matrix)
+
+    prompts.clear()
+    matrix[4] = {**matrix[4], "guid": "nm3b"}
+    nm.generate_node_messages("Email", CONTRACT, matrix)
+    assert fake_ai[-1] == ["nm3b"]
+    assert "- GUID: nm3b (escalation 3)" in prompts[0]
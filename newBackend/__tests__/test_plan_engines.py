@@ -0,0 +1,62 @@
+"""Unit tests for the per-node plan-engines fan-out (AI call replaced by a fake)."""
+
+import json
+import threading
+
+import pytest
+
+from newBackend.services import svc_plan_engines as pe
+from newBackend.services.svc_llm_cache import LlmResponseCache
+
+
+def _node(node_id, label, kind="string"):
+    return {"nodeId": node_id, "nodeLabel": label, "contract": {"entity": {"kind": kind}, "subEntities": []}}
+
+
+@pytest.fixture
+def fake_ai(monkeypatch):
+    monkeypatch.setattr(pe, "_plan_cache", LlmResponseCache(mode="memory"))
+    calls = []
+    lock = threading.Lock()
+
+    def chat_json(messages, provider="groq", use_cache=True):
+        prompt = messages[1]["content"]
+        ids = [line.split(":", 1)[1].strip() for line in prompt.splitlines() if line.startswith("- nodeId:")]
+        with lock:
+            calls.append(ids)
+        if "BROKEN" in ids:
+            raise ValueError("bad response")
+        return json.dumps({"parsersPlan": [{"nodeId": i, "engines": ["llm", "regex", "bogus"]} for i in ids]})
+
+    monkeypatch.setattr(pe, "chat_json", chat_json)
+    return calls
+
+
+def test_per_node_chunks_merge_and_cache(fake_ai):
+    nodes = [_node(f"N{i}", f"label {i}") for i in range(5)]
+    out = pe.plan_per_node(nodes, "openai", chunk_size=2, concurrency=3)
+
+    assert [p["nodeId"] for p in out["parsersPlan"]] == ["N0", "N1", "N2", "N3", "N4"]
+    assert all(p["engines"] == ["regex", "llm"] for p in out["parsersPlan"])
+    assert sorted(map(len, fake_ai)) == [1, 2, 2]
+    assert out["cache"] == {"hits": 0, "misses": 5}
+
+    # Solo il nodo modificato torna all'AI
+    fake_ai.clear()
+    nodes[3] = _node("N3", "label 3", kind="date")
+    out = pe.plan_per_node(nodes, "openai", chunk_size=2)
+    assert fake_ai == [["N3"]]
+    assert out["cache"] == {"hits": 4, "misses": 1}
+
+
+def test_failed_chunk_gets_llm_fallback(fake_ai):
+    nodes = [_node("A", "ok"), _node("BROKEN", "ko")]
+    out = pe.plan_per_node(nodes, "openai", chunk_size=1)
+
+    assert out["parsersPlan"] == [{"nodeId": "A", "engines": ["regex", "llm"]}, {"nodeId": "BROKEN", "engines": ["llm"]}]
+    assert out["failedNodes"] == [{"nodeId": "BROKEN", "error": "bad response"}]
+
+    # I fallback non vengono messi in cache
+    fake_ai.clear()
+    pe.plan_per_node(nodes, "openai", chunk_size=1)
+    assert fake_ai == [["BROKEN"]]
@@ -0,0 +1,96 @@
+"""Unit tests for the retry strategy (classification, jitter, deadline, async retry)."""
+
+import asyncio
+import time
+
+import requests
+
+from newBackend.services.retry import retry_strategy as retry
+from newBackend.services.svc_ai_client import LlmHTTPError
+
+
+def test_classify_error():
+    assert retry.classify_error(LlmHTTPError("Groq API error 429: slow down", 429, 2.5)) == (True, 2.5)
+    assert retry.classify_error(requests.HTTPError("OpenAI API error 503: overloaded")) == (True, None)
+    assert retry.classify_error(requests.HTTPError("OpenAI API error 400: bad request"))[0] is False
+    assert retry.classify_error(ValueError("OpenAI API key not configured"))[0] is False
+    assert retry.classify_error(asyncio.TimeoutError())[0] is True
+    try:
+        raise requests.HTTPError("Groq API connection error: boom") from ConnectionError("reset")
+    except requests.HTTPError as e:
+        assert retry.classify_error(e)[0] is True
+
+
+def test_backoff_delay_full_jitter_and_retry_after():
+    delays = [retry.backoff_delay(3, 1.0, 5.0) for _ in range(200)]
+    assert all(0 <= d <= 5.0 for d in delays) and len(set(delays)) > 1
+    assert retry.backoff_delay(0, 1.0, 5.0, retry_after=7.0) == 7.0
+
+
+def test_sync_retry_stops_on_validation_error():
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise requests.HTTPError("OpenAI API error 422: invalid schema")
+
+    result, error = retry.retry_sync_with_backoff(fail, max_retries=3, base_delay=0.0)
+    assert result is None and "422" in error and len(calls) == 1
+
+
+def test_async_retry_does_not_block_loop_and_retries_transient():
+    attempts = []
+
+    def flaky(x):
+        attempts.append(x)
+        if len(attempts) < 3:
+            raise LlmHTTPError("Groq API error 503: unavailable", 503)
+        return x * 2
+
+    async def run():
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(1)
+                await asyncio.sleep(0.005)
+
+        result, _ = await asyncio.gather(
+            retry.retry_async_with_backoff(flaky, max_retries=3, base_delay=0.02, x=21),
+            ticker(),
+        )
+        return result, ticks
+
+    (result, error), ticks = asyncio.run(run())
+    assert result == 42 and error is None and len(attempts) == 3 and len(ticks) == 5
+
+
+def test_async_retry_deadline():
+    async def slow():
+        await asyncio.sleep(1)
+
+    start = time.monotonic()
+    result, error = asyncio.run(retry.retry_async_with_backoff(slow, max_retries=5, base_delay=0.01, deadline=0.05))
+    assert result is None and error and time.monotonic() - start < 0.5
+
+
+def test_async_retry_deadline_does_not_start_a_second_sync_attempt():
+    import threading
+
+    calls = []
+    release = threading.Event()
+
+    def slow_llm_call():
+        calls.append(1)
+        release.wait(2)
+        return "late"
+
+    async def run():
+        try:
+            return await retry.retry_async_with_backoff(slow_llm_call, 5, 0.0, 0.0, deadline=0.05)
+        finally:
+            release.set()
+
+    result, error = asyncio.run(run())
+    assert (result, error) == (None, "retry deadline exceeded")
+    assert calls == [1]
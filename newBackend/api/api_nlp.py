@@ -116,11 +116,72 @@ DO NOT use semantic names like "day", "month", "year", "giorno", "mese", "anno".
     else:
         return 'You are a data extraction expert. Always return valid JSON.'
 
+def _extraction_error(message: str) -> dict:
+    return {
+        "values": {},
+        "hasMatch": False,
+        "source": None,
+        "errors": [message],
+        "confidence": 0
+    }
+
+def _load_extraction_contract(task_id: str):
+    """
+    Contract and engines of a task for test-extraction: (contract, engines, None)
+    or (None, None, error result).
+    """
+    # Contract from the in-process cache (projection on the contract fields, TTL + invalidation)
+    from newBackend.services.svc_contract_cache import CONTRACT_FIELDS, get_contract_cache
+    cached = get_contract_cache().get(task_id)
+
+    if not cached["found"]:
+        return None, None, _extraction_error(f"Task not found: {task_id}")
+
+    # Frontend saves as "dataContract", fallback to "semanticContract"
+    contract = cached["contract"]
+    if not contract:
+        return None, None, _extraction_error(
+            f"Contract not found for task: {task_id}. Expected one of: {list(CONTRACT_FIELDS)}"
+        )
+
+    # ✅ Support both engines (new) and parsers (old) for retrocompatibilità
+    engines = contract.get("engines") or contract.get("parsers", [])
+    if not engines:
+        return None, None, _extraction_error(f"No engines found in contract for task: {task_id}")
+
+    return contract, engines, None
+
+def _build_extractor(contract: dict, engines: list, engine_type: str, min_confidence=None):
+    """ContractExtractor for engine_type (or CascadeExtractor for "cascade"): (extractor, None) or (None, error result)"""
+    from newBackend.services.contract_extractor import CascadeExtractor, ContractExtractor, engine_from_parser
+
+    if engine_type == "cascade":
+        return CascadeExtractor(contract, engines, min_confidence=min_confidence), None
+
+    selected_parser = None
+    for parser in engines:
+        if parser.get("type") == engine_type and parser.get("enabled", True):
+            selected_parser = parser
+            break
+
+    if not selected_parser:
+        return None, _extraction_error(f"Parser {engine_type} not found or disabled in contract")
+
+    # Build engine config from parser; compiled plan cached by contract hash
+    engine = engine_from_parser({**selected_parser, "type": engine_type})
+    return ContractExtractor(contract, engine), None
+
+# Plain def: contract lookup, engines and LLM calls block, FastAPI runs them in the threadpool
 @router.post("/api/task/{task_id}/test-extraction")
-async def test_extraction(task_id: str, body: dict = Body(...)):
+def test_extraction(task_id: str, body: dict = Body(...)):
     """
     Test extraction using Python engines (NER, LLM, Embedding, Rules)
     Regex is handled by VB.NET API
+
+    engineType "cascade" runs all enabled engines of the contract cheap-first
+    (regex -> rules -> ner -> embedding -> llm) and stops at the first validated
+    result with confidence >= minConfidence (optional, default
+    OMNIA_EXTRACTION_CASCADE_MIN_CONFIDENCE); the response adds a per-engine "cascade" trace.
     """
     try:
         text = body.get("text", "")
@@ -128,123 +189,114 @@ async def test_extraction(task_id: str, body: dict = Body(...)):
 
         # Only handle non-regex engines (regex goes to VB.NET)
         if engine_type == "regex":
-            return {
-                "values": {},
-                "hasMatch": False,
-                "source": None,
-                "errors": ["Regex engine should be called via VB.NET API at /api/runtime/task/{taskId}/test-extraction"],
-                "confidence": 0
-            }
+            return _extraction_error("Regex engine should be called via VB.NET API at /api/runtime/task/{taskId}/test-extraction")
 
         if not text:
-            return {
-                "values": {},
-                "hasMatch": False,
-                "source": None,
-                "errors": ["Text is required"],
-                "confidence": 0
-            }
-
-        # Load contract from database
-        from newBackend.services.database_service import databaseService
-        collection = databaseService.db["Tasks"]
-        task = collection.find_one({
-            "$or": [
-                {"id": task_id},
-                {"_id": task_id}
-            ]
-        })
-
-        if not task:
-            return {
-                "values": {},
-                "hasMatch": False,
-                "source": None,
-                "errors": [f"Task not found: {task_id}"],
-                "confidence": 0
-            }
+            return _extraction_error("Text is required")
 
-        # Extract contract — frontend saves as "dataContract", fallback to "semanticContract"
-        contract = task.get("dataContract") or task.get("semanticContract")
-        if not contract:
-            return {
-                "values": {},
-                "hasMatch": False,
-                "source": None,
-                "errors": [f"Contract not found for task: {task_id}. Available fields: {[k for k in task.keys() if k != '_id']}"],
-                "confidence": 0
-            }
+        contract, engines, error = _load_extraction_contract(task_id)
+        if error:
+            return error
 
-        # ✅ Support both engines (new) and parsers (old) for retrocompatibilità
-        engines = contract.get("engines") or contract.get("parsers", [])
-        if not engines:
-            return {
-                "values": {},
-                "hasMatch": False,
-                "source": None,
-                "errors": [f"No engines found in contract for task: {task_id}"],
-                "confidence": 0
-            }
+        extractor, error = _build_extractor(contract, engines, engine_type, body.get("minConfidence"))
+        if error:
+            return error
+        return extractor.extract(text)
 
-        selected_parser = None
-        for parser in engines:
-            if parser.get("type") == engine_type and parser.get("enabled", True):
-                selected_parser = parser
-                break
+    except Exception as e:
+        import traceback
+        print(f"[TEST_EXTRACTION] Error: {str(e)}")
+        traceback.print_exc()
+        return _extraction_error(str(e))
 
-        if not selected_parser:
-            return {
-                "values": {},
-                "hasMatch": False,
-                "source": None,
-                "errors": [f"Parser {engine_type} not found or disabled in contract"],
-                "confidence": 0
-            }
+# Plain def, like test-extraction: the contract lookup and extractor build run off the event loop
+@router.post("/api/task/{task_id}/test-extraction/batch")
+def test_extraction_batch(task_id: str, body: dict = Body(...)):
+    """
+    Run many utterances through one compiled extractor (regression testing of a contract).
 
-        # Build engine config from parser
-        engine = {
-            "type": engine_type,
-            "config": {}
-        }
+    Body: { "texts": [...], "engineType": "llm" | "embedding" | "ner" | "rules" | "cascade",
+            "minConfidence": 0.5 (cascade, optional), "concurrency": 4 (LLM fan-out, optional) }
 
-        # Extract config based on parser type
-        if engine_type == "ner":
-            engine["config"]["entityTypes"] = selected_parser.get("entityTypes", [])
-            engine["config"]["confidence"] = selected_parser.get("confidence", 0.7)
-        elif engine_type == "embedding":
-            engine["config"]["embeddingExamples"] = {
-                "positive": selected_parser.get("positiveExamples", []),
-                "negative": selected_parser.get("negativeExamples", [])
-            }
-            engine["config"]["embeddingThreshold"] = selected_parser.get("threshold", 0.7)
-        elif engine_type == "llm":
-            engine["config"]["systemPrompt"] = selected_parser.get("systemPrompt", "")
-            # aiPrompt is the renamed field from userPromptTemplate (see contractLoader.ts LLMContract)
-            engine["config"]["userPromptTemplate"] = (
-                selected_parser.get("userPromptTemplate") or
-                selected_parser.get("aiPrompt") or ""
-            )
-        elif engine_type == "rules" or engine_type == "rule_based":
-            engine["config"]["extractorCode"] = selected_parser.get("extractorCode", "")
+    The contract is loaded once. Texts are processed in chunks of 32: embedding work
+    is encoded in one batch per chunk, LLM calls are fanned out with bounded
+    concurrency. Response: NDJSON streamed per chunk, one line per text
+    ({"index", "text", "result"}) in input order, then
+    {"summary": {"count", "matched", "totalMs", "avgMs"}}.
+    Validation errors are returned as a single JSON object, like test-extraction.
+    """
+    from starlette.responses import StreamingResponse
+    import json
+    import time
 
-        # Create ContractExtractor and extract
-        from newBackend.services.contract_extractor import ContractExtractor
-        extractor = ContractExtractor(contract, engine)
-        result = extractor.extract(text)
+    texts = body.get("texts") or []
+    engine_type = body.get("engineType", "cascade")
 
-        return result
+    if engine_type == "regex":
+        return _extraction_error("Regex engine should be called via VB.NET API at /api/runtime/task/{taskId}/test-extraction")
+    if not isinstance(texts, list) or not texts:
+        return _extraction_error("texts is required")
 
+    try:
+        contract, engines, error = _load_extraction_contract(task_id)
+        if error:
+            return error
+        extractor, error = _build_extractor(contract, engines, engine_type, body.get("minConfidence"))
+        if error:
+            return error
     except Exception as e:
-        import traceback
-        print(f"[TEST_EXTRACTION] Error: {str(e)}")
-        traceback.print_exc()
-        return {
-            "values": {},
-            "hasMatch": False,
-            "source": None,
-            "errors": [str(e)],
-            "confidence": 0
-        }
+        print(f"[TEST_EXTRACTION][BATCH] Error: {str(e)}")
+        return _extraction_error(str(e))
+
+    texts = [str(t) for t in texts]
+
+    chunk_size = 32
+
+    def lines():
+        # Sync generator: Starlette iterates it in the threadpool, off the event loop.
+        # Chunks keep the batching (one encode / one LLM fan-out per chunk) while results stream.
+        started = time.perf_counter()
+        matched = 0
+        for offset in range(0, len(texts), chunk_size):
+            chunk = texts[offset:offset + chunk_size]
+            try:
+                results = extractor.extract_many(chunk, body.get("concurrency"))
+            except Exception as e:
+                print(f"[TEST_EXTRACTION][BATCH] Error: {str(e)}")
+                results = [_extraction_error(str(e)) for _ in chunk]
+            for index, (text, result) in enumerate(zip(chunk, results), offset):
+                matched += 1 if result.get("hasMatch") else 0
+                yield json.dumps({"index": index, "text": text, "result": result}, ensure_ascii=False, default=str) + "\n"
+        total_ms = (time.perf_counter() - started) * 1000.0
+        yield json.dumps({"summary": {
+            "count": len(texts),
+            "matched": matched,
+            "totalMs": round(total_ms, 2),
+            "avgMs": round(total_ms / len(texts), 2)
+        }}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/api/task/test-extraction/stats")
+def test_extraction_stats():
+    """Compiled extraction plans, per-engine timing/hit statistics of the cascade mode and the contract cache"""
+    from newBackend.services.contract_extractor import cascade_stats, extraction_plan_stats
+    from newBackend.services.svc_contract_cache import get_contract_cache
+    return {
+        "plans": extraction_plan_stats(),
+        "cascade": cascade_stats(),
+        "contracts": get_contract_cache().stats()
+    }
+
+@router.post("/api/task/{task_id}/contract-cache/invalidate")
+def invalidate_contract_cache(task_id: str):
+    """
+    Drop the cached contract of a task (task_id "*" drops all) so the next
+    test-extraction reloads it; for writers that cannot rely on the change-stream/poll invalidation.
+    """
+    from newBackend.services.svc_contract_cache import get_contract_cache
+    removed = get_contract_cache().invalidate(None if task_id == "*" else task_id)
+    return {"success": True, "invalidated": removed}
 
 @router.post("/api/ner/extract")
 def ner_extract(body: dict = Body(...)):
@@ -389,7 +441,7 @@ def generate_canonical_values(body: dict = Body(...)):
         ai_response = chat_json([
             {"role": "system", "content": system_message},
             {"role": "user", "content": prompt}
-        ], provider=provider if provider else "openai")
+        ], provider=provider if provider else "openai", use_cache=not (body or {}).get("bypassCache", False))
 
         # Parse response
         if isinstance(ai_response, str):
@@ -480,7 +532,7 @@ def generate_constraints(body: dict = Body(...)):
         ai_response = chat_json([
             {"role": "system", "content": system_message},
             {"role": "user", "content": prompt}
-        ], provider=provider if provider else "openai")
+        ], provider=provider if provider else "openai", use_cache=not (body or {}).get("bypassCache", False))
 
         # Parse response
         if isinstance(ai_response, str):
@@ -687,7 +739,10 @@ def plan_engines(body: dict = Body(...)):
         },
         "locale": "it",
         "provider": "openai",
-        "model": "gpt-4-turbo-preview"
+        "model": "gpt-4-turbo-preview",
+        "mode": "batch" | "perNode",   (optional, default "batch")
+        "chunkSize": 4,                (optional, perNode only)
+        "concurrency": 4               (optional, perNode only)
     }
 
     Output:
@@ -699,22 +754,20 @@ def plan_engines(body: dict = Body(...)):
             ...
         ]
     }
+
+    mode "perNode" plans the nodes in parallel chunks, caches each node's plan by
+    its contract hash and adds "failedNodes" (nodes that got the ["llm"] fallback)
+    and "cache": {"hits", "misses"} to the output.
     """
-    from newBackend.services.svc_ai_client import chat_json
+    from newBackend.services.svc_plan_engines import plan_batch, plan_per_node
     from newBackend.core.core_settings import OPENAI_KEY
-    import sys
-    import os
-    import json
-
-    # Add backend/ai_prompts to path
-    backend_path = os.path.join(os.path.dirname(__file__), '..', '..', 'backend')
-    if backend_path not in sys.path:
-        sys.path.insert(0, backend_path)
 
     contract_tree = (body or {}).get("contract", {})
     locale = (body or {}).get("locale", "it")
     provider = (body or {}).get("provider", "openai")
     model = (body or {}).get("model")
+    mode = (body or {}).get("mode", "batch")
+    use_cache = not (body or {}).get("bypassCache", False)
 
     if not contract_tree or "nodes" not in contract_tree:
         return {
@@ -728,6 +781,12 @@ def plan_engines(body: dict = Body(...)):
             "error": "OPENAI_KEY not configured"
         }
 
+    if mode not in ("batch", "perNode"):
+        return {
+            "success": False,
+            "error": f"Invalid mode: {mode}. Must be one of: ['batch', 'perNode']"
+        }
+
     try:
         nodes = contract_tree.get("nodes", [])
 
@@ -737,188 +796,18 @@ def plan_engines(body: dict = Body(...)):
                 "error": "At least one node is required in contract tree"
             }
 
-        # Build nodes section for prompt with nodeId, nodeLabel, and dataStructure
-        nodes_sections = []
-        for n in nodes:
-            node_id = n.get("nodeId", "unknown")
-            node_label = n.get("nodeLabel", "unknown")
-            contract = n.get("contract", {})
-
-            # Build data structure representation from contract
-            data_structure = {
-                "entity": contract.get("entity", {}),
-                "subEntities": contract.get("subEntities", [])
-            }
-
-            # Build individual node section
-            node_section = f"""
-NODE {node_id}:
-- nodeId: {node_id}
-- nodeLabel: {node_label}
-- dataStructure:
-{json.dumps(data_structure, indent=2, ensure_ascii=False)}
-"""
-            nodes_sections.append(node_section)
-
-        # Combine all node sections
-        nodes_section = "\n".join(nodes_sections)
-
-        prompt = f"""You are an Engine Planner.
-
-Your task is to determine the minimal set of extraction engines required
-to interpret the user's answer for EACH NODE independently.
-
-You will receive multiple nodes.
-Each node has:
-- nodeId
-- nodeLabel (the task label)
-- dataStructure (the structure of the data to extract)
-
-You MUST evaluate each node independently.
-Nodes MUST NOT influence each other.
-Do NOT compare nodes.
-Do NOT merge logic across nodes.
-Each node must receive its own engine plan.
-
-------------------------------------------------------------
-AVAILABLE ENGINES
-------------------------------------------------------------
-You can choose between 5 extraction engines:
-
-1. regex
-2. rule_based
-3. ner
-4. embedding
-5. llm
-
-------------------------------------------------------------
-ENGINE PRIORITY (FROM CHEAPEST TO MOST EXPENSIVE)
-------------------------------------------------------------
-1. regex      — always preferred when possible
-2. rule_based — for composite or multi-field structures
-3. ner        — for semantic ambiguity in natural language
-4. embedding  — for canonical values or similarity matching
-5. llm        — ALWAYS included as final fallback
-
-------------------------------------------------------------
-MANDATORY RULE (CRITICAL)
-------------------------------------------------------------
-LLM MUST ALWAYS be included as the final fallback engine
-for EVERY NODE, including boolean yes/no tasks.
-
-This is NOT optional.
-
-------------------------------------------------------------
-PRIMARY DECISION DRIVER
-------------------------------------------------------------
-The engine selection MUST be based primarily on the nodeLabel
-(the semantic meaning of the task).
-
-The dataStructure is secondary and should only be used to detect:
-- whether the node is composite (→ rule_based)
-- whether canonical values exist (→ embedding)
-
-Do NOT use the dataStructure as the main driver.
-
-------------------------------------------------------------
-ENGINE SELECTION RULES (CRITICAL)
-------------------------------------------------------------
-
-1. BOOLEAN TASKS:
-   If the nodeLabel expresses a yes/no question (e.g., contains verbs like "ha", "possiede", "esiste", "è disponibile", "è presente", "verifica se", "chiedi se", "controlla se"):
-   - You MUST ALWAYS include: ["regex", "llm"] for this node.
-   - Regex is used to capture yes/no answers and their synonyms.
-   - llm is always the final fallback.
-
-2. FREE-TEXT / DISCURSIVE TASKS:
-   If the task expects a free-text or discursive answer (e.g., labels like "motivo", "descrizione", "cosa è successo", "problema", "note", "commento", "racconto", "spiegazione"):
-   - You MUST NOT include the regex engine.
-   - Regex cannot extract free-form natural language.
-   - Use: ["llm"] only (NER is not useful for free-text without specific entities).
-
-3. COMPOSITE ENTITIES:
-   If the dataStructure (contract) shows that the node represents a composite entity with multiple subfields
-   (e.g., address, personal data, structured records):
-   - You MUST NOT include the regex engine.
-   - Use: ["rule_based", "llm"].
-
-4. CANONICAL VALUES:
-   If the node has canonical values (a closed list of possible values):
-   - If the values are simple, short, and have few or no synonyms (e.g., "rosso, verde, blu", "passaporto, carta d'identità, patente"):
-     → regex MAY be included together with llm (e.g., ["regex", "llm"]).
-   - If the values require semantic interpretation, synonyms, or many linguistic variants:
-     → DO NOT include regex.
-     → Use: ["embedding", "llm"].
-
-5. RIGID PATTERNS:
-   If the expected answer follows a strict, predictable pattern (e.g., codes, numbers, dates in fixed format, CAP, codice fiscale, email, phone):
-   - You SHOULD include regex (e.g., ["regex", "llm"]).
-
-6. LLM ALWAYS:
-   For EVERY node, llm MUST ALWAYS be included as the final fallback engine.
-   This is NOT optional.
-
-7. NODE INDEPENDENCE:
-   You MUST evaluate each node independently.
-   Nodes MUST NOT influence each other.
-   Do NOT compare nodes or merge logic across nodes.
-
-------------------------------------------------------------
-INPUT NODES
-------------------------------------------------------------
-Below are the nodes you must evaluate:
-
-{nodes_section}
-
-------------------------------------------------------------
-OUTPUT FORMAT (strict JSON)
-------------------------------------------------------------
-{{
-  "parsersPlan": [
-    {{ "nodeId": "NODE_ID_1", "engines": ["regex", "llm"] }},
-    {{ "nodeId": "NODE_ID_2", "engines": ["regex", "rule_based", "llm"] }},
-    {{ "nodeId": "NODE_ID_3", "engines": ["regex", "embedding", "llm"] }}
-  ]
-}}
-
-- Include EXACTLY one entry per node.
-- Engines must be in priority order.
-- Return ONLY the JSON object."""
-
-        system_message = (
-            "You are an Engine Planner. "
-            "Your task is to determine the minimal set of extraction engines required for each node independently. "
-            "Return ONLY valid JSON with parsersPlan array, no markdown, no code fences, no comments."
-        )
-
-        # Call AI
-        ai_response = chat_json([
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": prompt}
-        ], provider=provider if provider else "openai")
-
-        # Parse response
-        if isinstance(ai_response, str):
-            result = json.loads(ai_response)
+        response = {"success": True}
+        if mode == "perNode":
+            response.update(plan_per_node(
+                nodes,
+                provider if provider else "openai",
+                use_cache=use_cache,
+                chunk_size=(body or {}).get("chunkSize"),
+                concurrency=(body or {}).get("concurrency")
+            ))
         else:
-            result = ai_response
-
-        # Validate response structure
-        if not isinstance(result, dict) or "parsersPlan" not in result:
-            raise ValueError("AI response must contain parsersPlan array")
-
-        parsers_plan = result.get("parsersPlan", [])
-        if not isinstance(parsers_plan, list):
-            raise ValueError("parsersPlan must be an array")
-
-        # ✅ Define engine priority order (escalation order)
-        engine_priority = {
-            "regex": 1,
-            "rule_based": 2,
-            "ner": 3,
-            "embedding": 4,
-            "llm": 5
-        }
+            response["parsersPlan"] = plan_batch(nodes, provider if provider else "openai", use_cache=use_cache)
+        validated_plan = response["parsersPlan"]
 
         # ✅ Create map of nodeId -> nodeLabel for logging
         node_label_map = {}
@@ -927,59 +816,20 @@ OUTPUT FORMAT (strict JSON)
             node_label = n.get("nodeLabel", "unknown")
             node_label_map[node_id] = node_label
 
-        # Validate and sort engines by priority for each plan entry
-        validated_plan = []
-        valid_engine_types = ["regex", "rule_based", "ner", "llm", "embedding"]
-
-        for entry in parsers_plan:
-            if not isinstance(entry, dict):
-                continue
-            node_id = entry.get("nodeId")
-            engines = entry.get("engines", [])
-
-            if node_id and isinstance(engines, list):
-                # Filter valid engine types
-                valid_engines = [e for e in engines if e in valid_engine_types]
-
-                if valid_engines:
-                    # ✅ Sort engines by priority (escalation order)
-                    valid_engines_sorted = sorted(
-                        valid_engines,
-                        key=lambda e: engine_priority.get(e, 999)
-                    )
-
-                    # ✅ Ensure LLM is always last
-                    if "llm" in valid_engines_sorted:
-                        valid_engines_sorted.remove("llm")
-                        valid_engines_sorted.append("llm")
-
-                    node_label = node_label_map.get(node_id, "unknown")
-
-                    print("", flush=True)
-
-                    validated_plan.append({
-                        "nodeId": node_id,
-                        "engines": valid_engines_sorted
-                    })
-
-        if len(validated_plan) == 0:
-            raise ValueError("No valid engine plans found in AI response")
-
         # ✅ LOG: Summary
         print(f"[plan-engines] ========================================", flush=True)
-        print(f"[plan-engines] SUMMARY:", flush=True)
+        print(f"[plan-engines] SUMMARY ({mode}):", flush=True)
         print(f"  - total nodes: {len(nodes)}", flush=True)
         print(f"  - planned nodes: {len(validated_plan)}", flush=True)
+        if mode == "perNode":
+            print(f"  - cache hits: {response['cache']['hits']}, failed nodes: {len(response['failedNodes'])}", flush=True)
         print(f"[plan-engines] ========================================\n", flush=True)
 
         for plan in validated_plan:
             node_label = node_label_map.get(plan['nodeId'], "unknown")
             print(f"    - {plan['nodeId']} ({node_label}): {', '.join(plan['engines'])}", flush=True)
 
-        return {
-            "success": True,
-            "parsersPlan": validated_plan
-        }
+        return response
 
     except Exception as e:
         print(f"[plan-engines] Error: {str(e)}", flush=True)
@@ -1037,7 +887,7 @@ def generate_test_examples(body: dict = Body(...)):
         ai_response = chat_json([
             {"role": "system", "content": system_message},
             {"role": "user", "content": prompt}
-        ], provider=provider if provider else "openai")
+        ], provider=provider if provider else "openai", use_cache=not (body or {}).get("bypassCache", False))
 
         # Parse response
         if isinstance(ai_response, str):
@@ -1089,6 +939,184 @@ def generate_test_examples(body: dict = Body(...)):
             "error": str(e)
         }
 
+_AI_MESSAGES_STEP_TYPES = ["start", "noInput", "noMatch", "confirmation", "notConfirmed", "success"]
+
+def _import_ai_messages_prompts():
+    import sys
+    import os
+
+    # Add backend/ai_prompts to path
+    backend_path = os.path.join(os.path.dirname(__file__), '..', '..', 'backend')
+    if backend_path not in sys.path:
+        sys.path.insert(0, backend_path)
+
+    from ai_prompts import generate_ai_messages_prompt
+    return generate_ai_messages_prompt
+
+def _parse_ai_json(ai_response):
+    """Risposta JSON del provider (stringa o dict) -> dict"""
+    if isinstance(ai_response, str):
+        import json
+        result = json.loads(ai_response)
+    else:
+        result = ai_response
+
+    # Validate response structure
+    if not isinstance(result, dict):
+        raise ValueError("AI response is not a dictionary")
+    return result
+
+def _ai_messages_request(body: dict):
+    """
+    Validazione e prompt di generate-ai-messages (condivisi con la variante streaming).
+    Ritorna (errore, None) oppure (None, (messages, provider, contract, step_type)).
+    """
+    from newBackend.core.core_settings import OPENAI_KEY
+
+    contract = (body or {}).get("contract")
+    node_label = (body or {}).get("nodeLabel")
+    step_type = (body or {}).get("stepType")  # ✅ NEW: stepType parameter
+    locale = (body or {}).get("locale", "it")  # ✅ NEW: locale parameter
+    provider = (body or {}).get("provider", "openai")
+
+    if not contract:
+        return {"error": "Contract is required"}, None
+
+    if not OPENAI_KEY:
+        return {"error": "OPENAI_KEY not configured"}, None
+
+    prompts = _import_ai_messages_prompts()
+
+    # ✅ NEW: If stepType is provided, generate only for that step
+    if step_type:
+        # Validate stepType
+        if step_type not in _AI_MESSAGES_STEP_TYPES:
+            return {
+                "success": False,
+                "error": f"Invalid stepType: {step_type}. Must be one of: {_AI_MESSAGES_STEP_TYPES}"
+            }, None
+
+        # Generate prompt for specific step
+        prompt = prompts.get_ai_messages_prompt_for_step(contract, step_type, node_label, locale)
+
+        # System message for specific step
+        system_message = (
+            f"You are a Dialogue Messages Generator. "
+            f"Your task is to generate natural, spoken messages for the **{step_type}** step "
+            f"in a voice-based customer care system. "
+            f"Return ONLY valid JSON, no markdown, no code fences, no comments."
+        )
+
+    # ✅ LEGACY: If stepType not provided, generate all steps (backward compatibility)
+    else:
+        # Generate prompt for all steps
+        prompt = prompts.get_ai_messages_prompt(contract, node_label, locale)
+
+        # System message for AI messages generation
+        system_message = (
+            "You are a Dialogue Messages Generator. "
+            "Your task is to generate natural, spoken messages for voice-based customer care systems. "
+            "You must generate messages for: start, noInput, noMatch, confirmation, notConfirmed, and success. "
+            "Return ONLY valid JSON, no markdown, no code fences, no comments."
+        )
+
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": prompt}
+    ]
+    return None, (messages, provider if provider else "openai", contract, step_type)
+
+def _ai_messages_result(ai_response, contract: dict, step_type) -> dict:
+    """Valida la risposta AI di generate-ai-messages e applica i fallback"""
+    result = _parse_ai_json(ai_response)
+
+    if step_type:
+        # Extract messages array
+        messages = result.get("messages", [])
+        if not isinstance(messages, list):
+            # If messages is a string, convert to array
+            if isinstance(messages, str):
+                messages = [messages]
+            else:
+                messages = []
+
+        # Filter to ensure all items are strings
+        validated_messages = [str(msg) for msg in messages if isinstance(msg, str) and msg.strip()]
+
+        # Extract options (only for disambiguation)
+        options = result.get("options", [])
+        if not isinstance(options, list):
+            options = []
+
+        # Fallback if no messages generated
+        if len(validated_messages) == 0:
+            print(f"[generate-ai-messages] Warning: No messages generated for stepType: {step_type}", flush=True)
+            entity_label = contract.get("entity", {}).get("label", "value")
+
+            # Step-specific fallbacks
+            fallbacks = {
+                "start": [f"What's your {entity_label.lower()}?"],
+                "noInput": [f"Could you share the {entity_label.lower()}?"],
+                "noMatch": ["I didn't catch that. Could you repeat?"],
+                "confirmation": ["Is this correct: {{ '{{input}}' }}?"],
+                "notConfirmed": [f"Could you provide the correct {entity_label.lower()}?"],
+                "success": ["Thanks, got it."]
+            }
+            validated_messages = fallbacks.get(step_type, ["Please provide the information."])
+
+        return {
+            "success": True,
+            "messages": validated_messages,
+            "options": []
+        }
+
+    # Ensure all required message types exist
+    validated = {}
+
+    for msg_type in _AI_MESSAGES_STEP_TYPES:
+        if msg_type in result:
+            value = result[msg_type]
+            if isinstance(value, list):
+                # Filter to ensure all items are strings
+                validated[msg_type] = [str(msg) for msg in value if isinstance(msg, str) and msg.strip()]
+            elif isinstance(value, str):
+                # Single value -> convert to array
+                validated[msg_type] = [value.strip()] if value.strip() else []
+            else:
+                validated[msg_type] = []
+        else:
+            validated[msg_type] = []
+
+    # Validate minimum requirements
+    if len(validated["start"]) == 0:
+        print("[generate-ai-messages] Warning: No start messages generated", flush=True)
+        # Create fallback
+        entity_label = contract.get("entity", {}).get("label", "value")
+        validated["start"] = [f"What's your {entity_label.lower()}?"]
+
+    # Ensure noInput has 3 variations (or at least 1)
+    if len(validated["noInput"]) == 0:
+        entity_label = contract.get("entity", {}).get("label", "value")
+        validated["noInput"] = [f"Could you share the {entity_label.lower()}?"]
+
+    # Ensure noMatch has 3 variations (or at least 1)
+    if len(validated["noMatch"]) == 0:
+        entity_label = contract.get("entity", {}).get("label", "value")
+        validated["noMatch"] = ["I didn't catch that. Could you repeat?"]
+
+    # Ensure confirmation has at least 1 message
+    if len(validated["confirmation"]) == 0:
+        validated["confirmation"] = ["Is this correct: {{ '{{input}}' }}?"]
+
+    # Ensure success has at least 1 message
+    if len(validated["success"]) == 0:
+        validated["success"] = ["Thanks, got it."]
+
+    return {
+        "success": True,
+        "messages": validated
+    }
+
 @router.post("/api/nlp/generate-ai-messages")
 def generate_ai_messages(body: dict = Body(...)):
     """
@@ -1125,185 +1153,16 @@ def generate_ai_messages(body: dict = Body(...)):
             }
     """
     from newBackend.services.svc_ai_client import chat_json
-    from newBackend.core.core_settings import OPENAI_KEY
-    import sys
-    import os
-
-    # Add backend/ai_prompts to path
-    backend_path = os.path.join(os.path.dirname(__file__), '..', '..', 'backend')
-    if backend_path not in sys.path:
-        sys.path.insert(0, backend_path)
-
-    from ai_prompts.generate_ai_messages_prompt import get_ai_messages_prompt, get_ai_messages_prompt_for_step
-
-    contract = (body or {}).get("contract")
-    node_label = (body or {}).get("nodeLabel")
-    step_type = (body or {}).get("stepType")  # ✅ NEW: stepType parameter
-    locale = (body or {}).get("locale", "it")  # ✅ NEW: locale parameter
-    provider = (body or {}).get("provider", "openai")
-    model = (body or {}).get("model")
-
-    if not contract:
-        return {"error": "Contract is required"}
-
-    if not OPENAI_KEY:
-        return {"error": "OPENAI_KEY not configured"}
 
     try:
-        # ✅ NEW: If stepType is provided, generate only for that step
-        if step_type:
-            # Validate stepType
-            valid_step_types = ["start", "noInput", "noMatch", "confirmation", "notConfirmed", "success"]
-            if step_type not in valid_step_types:
-                return {
-                    "success": False,
-                    "error": f"Invalid stepType: {step_type}. Must be one of: {valid_step_types}"
-                }
-
-            # Generate prompt for specific step
-            prompt = get_ai_messages_prompt_for_step(contract, step_type, node_label, locale)
-
-            # System message for specific step
-            system_message = (
-                f"You are a Dialogue Messages Generator. "
-                f"Your task is to generate natural, spoken messages for the **{step_type}** step "
-                f"in a voice-based customer care system. "
-                f"Return ONLY valid JSON, no markdown, no code fences, no comments."
-            )
-
-            # Call AI
-            ai_response = chat_json([
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt}
-            ], provider=provider if provider else "openai")
-
-            # Parse response
-            if isinstance(ai_response, str):
-                import json
-                result = json.loads(ai_response)
-            else:
-                result = ai_response
-
-            # Validate response structure
-            if not isinstance(result, dict):
-                raise ValueError("AI response is not a dictionary")
-
-            # Extract messages array
-            messages = result.get("messages", [])
-            if not isinstance(messages, list):
-                # If messages is a string, convert to array
-                if isinstance(messages, str):
-                    messages = [messages]
-                else:
-                    messages = []
-
-            # Filter to ensure all items are strings
-            validated_messages = [str(msg) for msg in messages if isinstance(msg, str) and msg.strip()]
-
-            # Extract options (only for disambiguation)
-            options = result.get("options", [])
-            if not isinstance(options, list):
-                options = []
-
-            # Fallback if no messages generated
-            if len(validated_messages) == 0:
-                print(f"[generate-ai-messages] Warning: No messages generated for stepType: {step_type}", flush=True)
-                entity_label = contract.get("entity", {}).get("label", "value")
-
-                # Step-specific fallbacks
-                fallbacks = {
-                    "start": [f"What's your {entity_label.lower()}?"],
-                    "noInput": [f"Could you share the {entity_label.lower()}?"],
-                    "noMatch": ["I didn't catch that. Could you repeat?"],
-                    "confirmation": ["Is this correct: {{ '{{input}}' }}?"],
-                    "notConfirmed": [f"Could you provide the correct {entity_label.lower()}?"],
-                    "success": ["Thanks, got it."]
-                }
-                validated_messages = fallbacks.get(step_type, ["Please provide the information."])
-
-            return {
-                "success": True,
-                "messages": validated_messages,
-                "options": []
-            }
-
-        # ✅ LEGACY: If stepType not provided, generate all steps (backward compatibility)
-        else:
-            # Generate prompt for all steps
-            prompt = get_ai_messages_prompt(contract, node_label, locale)
-
-            # System message for AI messages generation
-            system_message = (
-                "You are a Dialogue Messages Generator. "
-                "Your task is to generate natural, spoken messages for voice-based customer care systems. "
-                "You must generate messages for: start, noInput, noMatch, confirmation, notConfirmed, and success. "
-                "Return ONLY valid JSON, no markdown, no code fences, no comments."
-            )
-
-            # Call AI
-            ai_response = chat_json([
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt}
-            ], provider=provider if provider else "openai")
-
-            # Parse response
-            if isinstance(ai_response, str):
-                import json
-                result = json.loads(ai_response)
-            else:
-                result = ai_response
-
-            # Validate response structure
-            if not isinstance(result, dict):
-                raise ValueError("AI response is not a dictionary")
-
-            # Ensure all required message types exist
-            required_types = ["start", "noInput", "noMatch", "confirmation", "notConfirmed", "success"]
-            validated = {}
-
-            for msg_type in required_types:
-                if msg_type in result:
-                    value = result[msg_type]
-                    if isinstance(value, list):
-                        # Filter to ensure all items are strings
-                        validated[msg_type] = [str(msg) for msg in value if isinstance(msg, str) and msg.strip()]
-                    elif isinstance(value, str):
-                        # Single value -> convert to array
-                        validated[msg_type] = [value.strip()] if value.strip() else []
-                    else:
-                        validated[msg_type] = []
-                else:
-                    validated[msg_type] = []
-
-            # Validate minimum requirements
-            if len(validated["start"]) == 0:
-                print("[generate-ai-messages] Warning: No start messages generated", flush=True)
-                # Create fallback
-                entity_label = contract.get("entity", {}).get("label", "value")
-                validated["start"] = [f"What's your {entity_label.lower()}?"]
-
-            # Ensure noInput has 3 variations (or at least 1)
-            if len(validated["noInput"]) == 0:
-                entity_label = contract.get("entity", {}).get("label", "value")
-                validated["noInput"] = [f"Could you share the {entity_label.lower()}?"]
-
-            # Ensure noMatch has 3 variations (or at least 1)
-            if len(validated["noMatch"]) == 0:
-                entity_label = contract.get("entity", {}).get("label", "value")
-                validated["noMatch"] = ["I didn't catch that. Could you repeat?"]
-
-            # Ensure confirmation has at least 1 message
-            if len(validated["confirmation"]) == 0:
-                validated["confirmation"] = ["Is this correct: {{ '{{input}}' }}?"]
-
-            # Ensure success has at least 1 message
-            if len(validated["success"]) == 0:
-                validated["success"] = ["Thanks, got it."]
+        error, request = _ai_messages_request(body)
+        if error:
+            return error
+        messages, provider, contract, step_type = request
 
-            return {
-                "success": True,
-                "messages": validated
-            }
+        # Call AI
+        ai_response = chat_json(messages, provider=provider)
+        return _ai_messages_result(ai_response, contract, step_type)
 
     except Exception as e:
         print(f"[generate-ai-messages] Error: {str(e)}", flush=True)
@@ -1314,6 +1173,59 @@ def generate_ai_messages(body: dict = Body(...)):
             "error": str(e)
         }
 
+@router.post("/api/nlp/generate-ai-messages/stream")
+def generate_ai_messages_stream(body: dict = Body(...)):
+    """
+    Streaming variant of generate-ai-messages (Server-Sent Events).
+
+    Events: start, token ({"delta"}), field ({"key", "value"}), done (same payload
+    as /api/nlp/generate-ai-messages), error. Validation errors are returned as
+    plain JSON, like the non-streaming endpoint.
+    """
+    from newBackend.services.svc_sse import sse_response, stream_generation
+
+    try:
+        error, request = _ai_messages_request(body)
+    except Exception as e:
+        print(f"[generate-ai-messages] Error: {str(e)}", flush=True)
+        return {"success": False, "error": str(e)}
+    if error:
+        return error
+    messages, provider, contract, step_type = request
+    return sse_response(stream_generation(
+        messages, provider,
+        lambda ai_response: _ai_messages_result(ai_response, contract, step_type),
+        "generate-ai-messages"
+    ))
+
+def _node_messages_request(body: dict):
+    """
+    Validazione di generate-node-messages (condivisa con la variante streaming).
+    Ritorna (errore, None) oppure (None, parametri per svc_node_messages).
+    """
+    from newBackend.core.core_settings import OPENAI_KEY
+
+    contract = (body or {}).get("contract")
+    message_matrix = (body or {}).get("messageMatrix", [])
+    provider = (body or {}).get("provider", "openai")
+
+    if not contract:
+        return {"success": False, "error": "Contract is required"}, None
+
+    if not message_matrix:
+        return {"success": False, "error": "messageMatrix is required"}, None
+
+    if not OPENAI_KEY:
+        return {"success": False, "error": "OPENAI_KEY not configured"}, None
+
+    return None, {
+        "node_label": (body or {}).get("nodeLabel"),
+        "contract": contract,
+        "message_matrix": message_matrix,
+        "locale": (body or {}).get("locale", "it"),
+        "provider": provider if provider else "openai",
+    }
+
 @router.post("/api/nlp/generate-node-messages")
 def generate_node_messages(body: dict = Body(...)):
     """
@@ -1328,6 +1240,7 @@ def generate_node_messages(body: dict = Body(...)):
             - locale: Locale code (default: "it")
             - provider: AI provider (default: "openai")
             - model: AI model (optional)
+            - bypassCache: regenerate every GUID, ignoring previously generated texts (optional)
 
     Returns:
         {
@@ -1336,187 +1249,26 @@ def generate_node_messages(body: dict = Body(...)):
                 "GUID1": "testo1",
                 "GUID2": "testo2",
                 ...
-            }
+            },
+            "cache": {"reused": 5, "generated": 1, "fallbacks": 0}
         }
-    """
-    from newBackend.services.svc_ai_client import chat_json
-    from newBackend.core.core_settings import OPENAI_KEY
-    import sys
-    import os
-    import json
-
-    # Add backend/ai_prompts to path
-    backend_path = os.path.join(os.path.dirname(__file__), '..', '..', 'backend')
-    if backend_path not in sys.path:
-        sys.path.insert(0, backend_path)
 
-    from ai_prompts.generate_ai_messages_prompt import get_ai_messages_prompt_for_step
-
-    node_id = (body or {}).get("nodeId")
-    node_label = (body or {}).get("nodeLabel")
-    contract = (body or {}).get("contract")
-    message_matrix = (body or {}).get("messageMatrix", [])
-    locale = (body or {}).get("locale", "it")
-    provider = (body or {}).get("provider", "openai")
-    model = (body or {}).get("model")
-
-    if not contract:
-        return {"success": False, "error": "Contract is required"}
-
-    if not message_matrix:
-        return {"success": False, "error": "messageMatrix is required"}
-
-    if not OPENAI_KEY:
-        return {"success": False, "error": "OPENAI_KEY not configured"}
+    Texts of unchanged entries (same contract, stepType, GUID, escalation) are reused;
+    only the changed subset is sent to the AI, in parallel sub-batches.
+    """
+    from newBackend.services.svc_node_messages import generate_node_messages as generate_incremental
 
     try:
-        # Raggruppa messageMatrix per stepType
-        messages_by_step_type = {}
-        for item in message_matrix:
-            step_type = item.get("stepType")
-            guid = item.get("guid")
-            escalation_index = item.get("escalationIndex", 0)
-
-            if step_type not in messages_by_step_type:
-                messages_by_step_type[step_type] = []
-            messages_by_step_type[step_type].append({
-                "guid": guid,
-                "escalationIndex": escalation_index
-            })
-
-        # Costruisci prompt che include TUTTI gli stepType per questo nodo
-        prompt_parts = [
-            f"Generate ALL dialogue messages for the field '{node_label}'.",
-            f"",
-            f"Context:",
-            f"- Field: {node_label}",
-            f"- Type: {contract.get('entity', {}).get('kind', 'string')}",
-            f"- Locale: {locale}",
-            f"",
-            f"Generate the following messages:",
-            f""
-        ]
-
-        # Aggiungi istruzioni per ogni stepType
-        # Note: 'invalid' is generated automatically from constraints, not from AI messages
-        step_descriptions = {
-            "start": "Initial message to ask for the data",
-            "noMatch": "Escalation messages when user input doesn't match (progressively more polite)",
-            "noInput": "Escalation messages when user doesn't respond (progressively more polite)",
-            "confirmation": "Message to confirm the input with {{input}} placeholder",
-            "notConfirmed": "Message when user doesn't confirm",
-            "success": "Success message when data is collected"
-        }
-
-        guid_list = []
-        for step_type, items in messages_by_step_type.items():
-            description = step_descriptions.get(step_type, f"Messages for {step_type}")
-            count = len(items)
-
-            if count == 1:
-                guid = items[0]["guid"]
-                prompt_parts.append(f"1. {step_type.upper()} ({description}):")
-                prompt_parts.append(f"   - GUID: {guid}")
-                guid_list.append(guid)
-            else:
-                prompt_parts.append(f"{count}. {step_type.upper()} ({description}):")
-                for idx, item in enumerate(items, 1):
-                    guid = item["guid"]
-                    prompt_parts.append(f"   - GUID: {guid} (escalation {idx})")
-                    guid_list.append(guid)
-            prompt_parts.append("")
-
-        prompt_parts.extend([
-            f"Return a JSON object mapping each GUID to its message text:",
-            f"{{",
-            f'  "{guid_list[0]}": "message text 1",',
-            f'  "{guid_list[1]}": "message text 2",',
-            f"  ...",
-            f"}}",
-            f"",
-            f"Requirements:",
-            f"- Messages must be natural, spoken Italian (locale: {locale})",
-            f"- Messages must be appropriate for voice-based customer care",
-            f"- Escalation messages must be progressively more polite",
-            f"- Use {{input}} placeholder in confirmation messages",
-            f"- Keep messages concise and clear"
-        ])
-
-        prompt = "\n".join(prompt_parts)
-
-        # System message
-        system_message = (
-            "You are a Dialogue Messages Generator. "
-            "Your task is to generate natural, spoken messages for a voice-based customer care system. "
-            "Return ONLY valid JSON, no markdown, no code fences, no comments."
-        )
-
-        # Call AI
-        ai_response = chat_json([
-            {"role": "system", "content": system_message},
-            {"role": "user", "content": prompt}
-        ], provider=provider if provider else "openai")
-
-        # Parse response
-        if isinstance(ai_response, str):
-            result = json.loads(ai_response)
-        else:
-            result = ai_response
-
-        # Validate response structure
-        if not isinstance(result, dict):
-            raise ValueError("AI response is not a dictionary")
-
-        # Extract messages map
-        messages_map = result.get("messages", {})
-        if not isinstance(messages_map, dict):
-            # Fallback: try to extract from root level
-            messages_map = {k: v for k, v in result.items() if k != "success" and k != "error"}
-
-        # Validate all GUIDs are present
-        missing_guids = [guid for guid in guid_list if guid not in messages_map]
-        if missing_guids:
-            print(f"[generate-node-messages] Warning: Missing GUIDs in response: {missing_guids}", flush=True)
-            # Add fallback messages for missing GUIDs
-            entity_label = contract.get("entity", {}).get("label", "value")
-            fallbacks = {
-                "start": f"Mi dica la sua {entity_label.lower()}",
-                "noMatch": "Può ripetere?",
-                "noInput": "Non ho sentito, può ripetere?",
-                "confirmation": f"Confermi: {{input}}?",
-                "notConfirmed": f"Qual è la {entity_label.lower()} corretta?",
-                "success": "Perfetto, grazie."
-            }
-
-            for guid in missing_guids:
-                # Find stepType for this GUID
-                step_type = None
-                for item in message_matrix:
-                    if item.get("guid") == guid:
-                        step_type = item.get("stepType")
-                        break
-
-                if step_type and step_type in fallbacks:
-                    messages_map[guid] = fallbacks[step_type]
-                else:
-                    messages_map[guid] = f"Messaggio per {entity_label}"
-
-        # Filter to ensure all values are strings
-        validated_messages = {
-            guid: str(text).strip()
-            for guid, text in messages_map.items()
-            if guid in guid_list and isinstance(text, (str, int, float)) and str(text).strip()
-        }
-
-        # Ensure all GUIDs have messages
-        for guid in guid_list:
-            if guid not in validated_messages:
-                entity_label = contract.get("entity", {}).get("label", "value")
-                validated_messages[guid] = f"Messaggio per {entity_label}"
+        error, params = _node_messages_request(body)
+        if error:
+            return error
 
+        # Solo le voci cambiate vanno all'AI (cache per GUID, vedi svc_node_messages)
+        result = generate_incremental(**params, use_cache=not (body or {}).get("bypassCache", False))
         return {
             "success": True,
-            "messages": validated_messages
+            "messages": result["messages"],
+            "cache": result["cache"]
         }
 
     except Exception as e:
@@ -1528,6 +1280,42 @@ def generate_node_messages(body: dict = Body(...)):
             "error": str(e)
         }
 
+@router.post("/api/nlp/generate-node-messages/stream")
+def generate_node_messages_stream(body: dict = Body(...)):
+    """
+    Streaming variant of generate-node-messages (Server-Sent Events).
+
+    Each GUID -> message pair is sent as a ``field`` event as soon as the model
+    has written it; ``done`` carries the same payload as the non-streaming endpoint.
+    The whole matrix is regenerated; the texts refresh the per-GUID cache.
+    """
+    from newBackend.services import svc_node_messages as node_messages
+    from newBackend.services.svc_sse import sse_response, stream_generation
+
+    try:
+        error, params = _node_messages_request(body)
+        if error:
+            return error
+        messages, guid_list = node_messages.build_node_messages_prompt(
+            params["node_label"], params["contract"], params["message_matrix"], params["locale"]
+        )
+    except Exception as e:
+        print(f"[generate-node-messages] Error: {str(e)}", flush=True)
+        return {"success": False, "error": str(e)}
+
+    def finalize(ai_response):
+        texts = node_messages.generated_texts(node_messages.parse_messages_map(ai_response), guid_list)
+        node_messages.remember_texts(texts, **params)
+        return {
+            "success": True,
+            "messages": node_messages.complete_with_fallbacks(texts, params["contract"], params["message_matrix"], guid_list)
+        }
+
+    return sse_response(stream_generation(
+        messages, params["provider"], finalize, "generate-node-messages",
+        use_cache=not (body or {}).get("bypassCache", False)
+    ))
+
 # Add extract endpoint
 @router.post("/extract")
 async def extract_value(body: dict = Body(...)):
@@ -1546,6 +1334,71 @@ async def extract_value(body: dict = Body(...)):
 # WIZARD ENDPOINTS - Structure Generation
 # ============================================================================
 
+def _structure_request(body: dict):
+    """
+    Parametri e validazione di generate-structure (condivisi con la variante streaming).
+    Ritorna (errore, None) oppure (None, parametri).
+    """
+    from newBackend.core.core_settings import OPENAI_KEY
+
+    params = {
+        "task_label": (body or {}).get("taskLabel"),
+        "task_description": (body or {}).get("taskDescription"),
+        "locale": (body or {}).get("locale", "it"),
+        "feedback": (body or {}).get("feedback"),  # Optional: triggers regeneration if provided with previousStructure
+        "previous_structure": (body or {}).get("previousStructure"),  # Optional: triggers regeneration if provided with feedback
+        "provider": (body or {}).get("provider", "openai"),
+        "model": (body or {}).get("model"),
+    }
+
+    if not params["task_label"]:
+        return {"success": False, "error": "taskLabel is required"}, None
+
+    if not OPENAI_KEY:
+        return {"success": False, "error": "OPENAI_KEY not configured"}, None
+
+    # Validate regeneration mode parameters
+    if params["feedback"] is not None and params["previous_structure"] is not None:
+        if not params["feedback"]:
+            return {"success": False, "error": "feedback is required when previousStructure is provided"}, None
+        if not params["previous_structure"]:
+            return {"success": False, "error": "previousStructure is required when feedback is provided"}, None
+
+    return None, params
+
+def _structure_response(ai_response, is_regeneration: bool) -> dict:
+    """Parse + validazione della struttura generata; stessa risposta per la variante streaming"""
+    from newBackend.services.parsing.structure_parser import parse_and_validate_structure
+
+    # Parse and validate (returns 3 values: structure, errors, generalization_info)
+    structure, errors, generalization_info = parse_and_validate_structure(ai_response)
+
+    if errors:
+        return {"success": False, "error": "; ".join(errors), "structure": []}
+
+    # Build response based on mode
+    response = {
+        "success": True,
+        "structure": structure
+    }
+
+    # Add generalization info only for generation mode (not regeneration)
+    if not is_regeneration:
+        response.update({
+            "shouldBeGeneral": generalization_info.get("shouldBeGeneral", False),
+            "generalizedLabel": generalization_info.get("generalizedLabel"),
+            "generalizationReason": generalization_info.get("generalizationReason"),
+            "generalizedMessages": generalization_info.get("generalizedMessages")
+        })
+    else:
+        # For regeneration, extract changes if present
+        changes = []
+        if isinstance(ai_response, dict) and "changes" in ai_response:
+            changes = ai_response["changes"]
+        response["changes"] = changes
+
+    return response
+
 @router.post("/api/nlp/generate-structure")
 async def generate_structure(body: dict = Body(...)):
     """
@@ -1557,78 +1410,27 @@ async def generate_structure(body: dict = Body(...)):
     Used by both Phase A (generation) and Phase B (regeneration) of the wizard.
     """
     from newBackend.services.ai.ai_structure_service import get_structure_ai
-    from newBackend.services.parsing.structure_parser import parse_and_validate_structure
-    from newBackend.core.core_settings import OPENAI_KEY
-
-    task_label = (body or {}).get("taskLabel")
-    task_description = (body or {}).get("taskDescription")
-    locale = (body or {}).get("locale", "it")
-    feedback = (body or {}).get("feedback")  # Optional: triggers regeneration if provided with previousStructure
-    previous_structure = (body or {}).get("previousStructure")  # Optional: triggers regeneration if provided with feedback
-    provider = (body or {}).get("provider", "openai")
-    model = (body or {}).get("model")
-
-    if not task_label:
-        return {"success": False, "error": "taskLabel is required"}
-
-    if not OPENAI_KEY:
-        return {"success": False, "error": "OPENAI_KEY not configured"}
 
-    # Validate regeneration mode parameters
-    is_regeneration = feedback is not None and previous_structure is not None
-    if is_regeneration:
-        if not feedback:
-            return {"success": False, "error": "feedback is required when previousStructure is provided"}
-        if not previous_structure:
-            return {"success": False, "error": "previousStructure is required when feedback is provided"}
+    error, params = _structure_request(body)
+    if error:
+        return error
+    is_regeneration = params["feedback"] is not None and params["previous_structure"] is not None
 
     try:
-        # Retry with backoff
-        from newBackend.services.retry.retry_strategy import retry_sync_with_backoff
-        ai_response, error = retry_sync_with_backoff(
+        # Retry with backoff (non blocca l'event loop: la chiamata sync gira in un thread)
+        from newBackend.services.retry.retry_strategy import default_deadline, retry_async_with_backoff
+        ai_response, error = await retry_async_with_backoff(
             get_structure_ai,
             max_retries=3,
             base_delay=1.0,
-            task_label=task_label,
-            task_description=task_description,
-            locale=locale,
-            feedback=feedback,
-            previous_structure=previous_structure,
-            provider=provider,
-            model=model
+            deadline=default_deadline(),
+            **params
         )
 
         if error:
             return {"success": False, "error": error}
 
-        # Parse and validate (returns 3 values: structure, errors, generalization_info)
-        structure, errors, generalization_info = parse_and_validate_structure(ai_response)
-
-        if errors:
-            return {"success": False, "error": "; ".join(errors), "structure": []}
-
-        # Build response based on mode
-        response = {
-            "success": True,
-            "structure": structure
-        }
-
-        # Add generalization info only for generation mode (not regeneration)
-        if not is_regeneration:
-            response.update({
-                "shouldBeGeneral": generalization_info.get("shouldBeGeneral", False),
-                "generalizedLabel": generalization_info.get("generalizedLabel"),
-                "generalizationReason": generalization_info.get("generalizationReason"),
-                "generalizedMessages": generalization_info.get("generalizedMessages")
-            })
-        else:
-            # For regeneration, extract changes if present
-            changes = []
-            if isinstance(ai_response, dict) and "changes" in ai_response:
-                changes = ai_response["changes"]
-            response["changes"] = changes
-
-        return response
+        return _structure_response(ai_response, is_regeneration)
 
     except Exception as e:
         print(f"[generate-structure] Error: {str(e)}", flush=True)
@@ -1640,6 +1442,35 @@ async def generate_structure(body: dict = Body(...)):
             "structure": []
         }
 
+@router.post("/api/nlp/generate-structure/stream")
+async def generate_structure_stream(body: dict = Body(...)):
+    """
+    Streaming variant of generate-structure (Server-Sent Events).
+
+    Events: start, token ({"delta"}), field ({"key", "value"}), done (same payload
+    as /api/nlp/generate-structure), error. No retry once tokens have been sent.
+    """
+    from newBackend.services.ai.ai_structure_service import get_structure_messages
+    from newBackend.services.svc_sse import sse_response, stream_generation
+
+    error, params = _structure_request(body)
+    if error:
+        return error
+    is_regeneration = params["feedback"] is not None and params["previous_structure"] is not None
+
+    messages = get_structure_messages(
+        task_label=params["task_label"],
+        task_description=params["task_description"],
+        locale=params["locale"],
+        feedback=params["feedback"],
+        previous_structure=params["previous_structure"]
+    )
+    return sse_response(stream_generation(
+        messages, params["provider"],
+        lambda ai_response: _structure_response(ai_response, is_regeneration),
+        "generate-structure"
+    ))
+
 # NOTE: regenerate-structure endpoint has been unified into generate-structure
 # The unified endpoint automatically detects regeneration mode when feedback and previousStructure are provided
 
@@ -1685,12 +1516,13 @@ async def generalize_messages(body: dict = Body(...)):
         return {"success": False, "error": "OPENAI_KEY not configured"}
 
     try:
-        # Retry with backoff
-        from newBackend.services.retry.retry_strategy import retry_sync_with_backoff
-        ai_response, error = retry_sync_with_backoff(
+        # Retry with backoff (non blocca l'event loop: la chiamata sync gira in un thread)
+        from newBackend.services.retry.retry_strategy import default_deadline, retry_async_with_backoff
+        ai_response, error = await retry_async_with_backoff(
             generalize_messages_ai,
             max_retries=3,
             base_delay=1.0,
+            deadline=default_deadline(),
             contextual_messages=contextual_messages,
             contract=contract,
             node_label=node_label,
@@ -1758,12 +1590,13 @@ async def check_generalizability(body: dict = Body(...)):
         return {"success": False, "error": "OPENAI_KEY not configured"}
 
     try:
-        # Retry with backoff
-        from newBackend.services.retry.retry_strategy import retry_sync_with_backoff
-        ai_response, error = retry_sync_with_backoff(
+        # Retry with backoff (non blocca l'event loop: la chiamata sync gira in un thread)
+        from newBackend.services.retry.retry_strategy import default_deadline, retry_async_with_backoff
+        ai_response, error = await retry_async_with_backoff(
             check_generalizability_ai,
             max_retries=3,
             base_delay=1.0,
+            deadline=default_deadline(),
             contract=contract,
             node_label=node_label,
             contextual_messages=contextual_messages,
@@ -1847,12 +1680,13 @@ async def check_template_equivalence(body: dict = Body(...)):
         return {"success": False, "error": "OPENAI_KEY not configured"}
 
     try:
-        # Retry with backoff
-        from newBackend.services.retry.retry_strategy import retry_sync_with_backoff
-        ai_response, error = retry_sync_with_backoff(
+        # Retry with backoff (non blocca l'event loop: la chiamata sync gira in un thread)
+        from newBackend.services.retry.retry_strategy import default_deadline, retry_async_with_backoff
+        ai_response, error = await retry_async_with_backoff(
             check_template_equivalence_ai,
             max_retries=3,
             base_delay=1.0,
+            deadline=default_deadline(),
             current_template=current_template,
             existing_templates=existing_templates,
             provider=provider,
@@ -22,8 +22,16 @@ try:
 except Exception:
     pass
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from newBackend.services.svc_model_warmup import start_model_warmup, warmup_status
+from newBackend.services.svc_http_pool import aclose_clients
+from newBackend.services.svc_llm_cache import get_llm_cache
+from newBackend.services.svc_llm_limiter import get_llm_scheduler, route_llm_lane
+from newBackend.services.svc_ai_client import groq_model_health_stats
+from newBackend.services.svc_plan_engines import get_plan_cache
+from backend.llm_singleflight import single_flight_stats
 from newBackend.api.api_codegen import router as cond_router
 from newBackend.api.api_nlp import router as nlp_router
 from newBackend.api.api_proxy_express import router as proxy_router
@@ -107,6 +115,9 @@ from fastapi import APIRouter
 ner_router = APIRouter()
 llm_extract_router = APIRouter()
 
+# Task di warm-up modelli (riferimento tenuto per evitare garbage collection)
+model_warmup_task: Optional[asyncio.Task] = None
+
 # Cache in memoria per tutti gli agent acts disponibili
 all_agent_acts_cache: Dict[str, dict] = {}
 is_cache_loaded = False
@@ -154,7 +165,10 @@ def get_agent_acts_by_type_from_memory(act_type: str) -> List[dict]:
         if act.get('type') == act_type
     ]
 
-app = FastAPI()
+# Le chiamate LLM di ogni richiesta finiscono nella coda (lane) del proprio endpoint
+# (template della route, vedi route_llm_lane): lo scheduler serve le lane a turno,
+# così un endpoint non affama gli altri
+app = FastAPI(dependencies=[Depends(route_llm_lane)])
 
 # CORS middleware
 app.add_middleware(
@@ -168,8 +182,11 @@ app.add_middleware(
 # Health check endpoint for embedding service
 @app.get("/api/ping")
 def ping():
-    """Health check endpoint for embedding service"""
-    return {"ok": True}
+    """Health check endpoint for embedding service (503 finché il preload dei modelli è in corso)"""
+    warmup = warmup_status()
+    if not warmup["ready"]:
+        return JSONResponse(status_code=503, content={"ok": False, "ready": False, "warmup": warmup})
+    return {"ok": True, "ready": True, "warmup": warmup}
 
 # Include routers
 app.include_router(cond_router)
@@ -263,6 +280,17 @@ async def reload_cache():
     await load_all_agent_acts()
     return {"success": True, "message": "Cache reloaded"}
 
+@app.get("/api/llm/stats")
+def llm_stats():
+    """Cache risposte LLM, chiamate risparmiate dal coalescing e stato delle quote per provider"""
+    return {
+        "responseCache": get_llm_cache().stats(),
+        "singleFlight": single_flight_stats(),
+        "scheduler": get_llm_scheduler().stats(),
+        "groqModels": groq_model_health_stats(),
+        "planEnginesCache": get_plan_cache().stats()
+    }
+
 @app.on_event("startup")
 async def startup_event():
     """Startup event - agent acts loading removed (endpoint /api/factory/agent-acts no longer exists)"""
@@ -270,6 +298,15 @@ async def startup_event():
     # Cache will remain empty unless manually reloaded via /api/debug/reload-cache
     print("[INFO] Agent acts cache loading skipped - endpoint /api/factory/agent-acts no longer exists")
 
+    # Opt-in (OMNIA_PRELOAD_MODELS): carica embeddings/spaCy in background; /api/ping resta 503 fino a fine warm-up
+    global model_warmup_task
+    model_warmup_task = start_model_warmup()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Chiude i client HTTP condivisi verso Groq/OpenAI"""
+    await aclose_clients()
+
 @app.get("/api/agent-acts-from-cache")
 async def get_all_agent_acts_from_cache():
     """Restituisce tutti gli agent acts dalla cache in memoria"""
@@ -17,29 +17,16 @@ from newBackend.services.svc_ai_client import chat_json
 from ai_prompts.generate_structure_prompt import get_structure_prompt
 
 
-def get_structure_ai(
+def get_structure_messages(
     task_label: str,
     task_description: Optional[str] = None,
     locale: str = "it",
     feedback: Optional[str] = None,
-    previous_structure: Optional[List] = None,
-    provider: str = "openai",
-    model: Optional[str] = None
-) -> Dict[str, Any]:
+    previous_structure: Optional[List] = None
+) -> List[Dict[str, str]]:
     """
-    Unified AI structure service: automatically decides between generation and regeneration.
-
-    Args:
-        task_label: Task label
-        task_description: Optional task description
-        locale: Language code (e.g., "it", "en", "pt") - used to maintain language consistency
-        feedback: Optional user feedback (if provided with previous_structure, triggers regeneration)
-        previous_structure: Optional previous structure (if provided with feedback, triggers regeneration)
-        provider: AI provider (openai/groq)
-        model: Optional model override
-
-    Returns:
-        AI response (should be JSON string or dict)
+    Build the chat messages for structure generation or regeneration
+    (shared by get_structure_ai and the streaming endpoint).
     """
     # Determine mode based on feedback and previous_structure
     is_regeneration = feedback is not None and previous_structure is not None
@@ -67,11 +54,44 @@ def get_structure_ai(
             "Return ONLY valid JSON, no markdown, no code fences, no comments."
         )
 
-    messages = [
+    return [
         {"role": "system", "content": system_message},
         {"role": "user", "content": prompt}
     ]
 
+
+def get_structure_ai(
+    task_label: str,
+    task_description: Optional[str] = None,
+    locale: str = "it",
+    feedback: Optional[str] = None,
+    previous_structure: Optional[List] = None,
+    provider: str = "openai",
+    model: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Unified AI structure service: automatically decides between generation and regeneration.
+
+    Args:
+        task_label: Task label
+        task_description: Optional task description
+        locale: Language code (e.g., "it", "en", "pt") - used to maintain language consistency
+        feedback: Optional user feedback (if provided with previous_structure, triggers regeneration)
+        previous_structure: Optional previous structure (if provided with feedback, triggers regeneration)
+        provider: AI provider (openai/groq)
+        model: Optional model override
+
+    Returns:
+        AI response (should be JSON string or dict)
+    """
+    messages = get_structure_messages(
+        task_label=task_label,
+        task_description=task_description,
+        locale=locale,
+        feedback=feedback,
+        previous_structure=previous_structure
+    )
+
     response = chat_json(messages, provider=provider)
     return response
 
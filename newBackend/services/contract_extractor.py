@@ -1,14 +1,458 @@
 """
 ContractExtractor: Python implementation of runtime extraction engine
 Applies both engine and contract for normalization/validation
+
+Contract + engine are compiled once into an immutable ExtractionPlan (compiled
+regex, resolved normalizer functions, key maps, validators, LLM prompt template)
+cached by contract hash: extract() no longer re-reads the contract dicts.
+Cache size: OMNIA_EXTRACTION_PLAN_CACHE_SIZE (default 256).
+
+Embedding engine: the positive/negative example embeddings are encoded once
+(one model.encode(list)) into normalized matrices cached by the hash of the
+examples (OMNIA_EXTRACTION_EXAMPLE_CACHE_SIZE, default 64); an utterance costs
+one forward pass and one vectorized similarity. Changing the examples changes
+the key, so stale matrices are never used.
+
+NER engine: spaCy entities on the shared model of backend/ner_spacy.py, mapped onto
+the contract subentities via the parser entityTypes (resolved at compile time).
+Date parts mapped to DATE fall back to parsing the whole text when the model emits
+no DATE entity (the default it_core_news_sm has only PER/LOC/ORG/MISC).
+Only the NER components run (parser, lemmatizer, tagger... disabled per call);
+extract_many() goes through nlp.pipe (OMNIA_NER_BATCH_SIZE, default 64,
+OMNIA_NER_N_PROCESS, default 1).
 """
+import hashlib
+import json
+import os
 import re
-from typing import Dict, Any, List, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Any, List, Optional, Pattern, Tuple
+
+DEFAULT_PLAN_CACHE_SIZE = 256
+DEFAULT_EXAMPLE_CACHE_SIZE = 64
+DEFAULT_BATCH_CONCURRENCY = 4
+DEFAULT_NER_BATCH_SIZE = 64
+
+_MONTH_NAMES = [
+    'january', 'february', 'march', 'april', 'may', 'june',
+    'july', 'august', 'september', 'october', 'november', 'december',
+    'gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno',
+    'luglio', 'agosto', 'settembre', 'ottobre', 'novembre', 'dicembre',
+    'gen', 'feb', 'mar', 'apr', 'mag', 'giu',
+    'lug', 'ago', 'set', 'ott', 'nov', 'dic'
+]
+# month name -> 1..12 (first occurrence wins, as with list.index)
+_MONTH_INDEX = {}
+for _i, _name in enumerate(_MONTH_NAMES):
+    _MONTH_INDEX.setdefault(_name, (_i % 12) + 1)
+
+# Range checks applied when the subTaskKey contains the name
+_DATE_RANGES = (("day", 1, 31), ("month", 1, 12), ("year", 1900, 2100))
+
+# spaCy entity label -> hints matched against subentity key/label/type
+# (it_core_news_sm uses PER/LOC/ORG/MISC, English models PERSON/GPE/DATE...)
+_NER_PERSON_HINTS = ("name", "nome", "cognome", "surname", "person", "persona")
+_NER_PLACE_HINTS = ("city", "citt", "address", "indirizzo", "place", "luogo", "country", "paese", "location", "comune")
+_NER_LABEL_HINTS = {
+    "PER": _NER_PERSON_HINTS,
+    "PERSON": _NER_PERSON_HINTS,
+    "LOC": _NER_PLACE_HINTS,
+    "GPE": _NER_PLACE_HINTS,
+    "ORG": ("company", "azienda", "organization", "organizzazione", "societ", "ente"),
+    "DATE": ("date", "data", "birth", "nascita", "day", "giorno", "month", "mese", "year", "anno"),
+}
+# Pipeline components never needed for entities, disabled per call when present
+_NER_UNUSED_PIPES = ("parser", "lemmatizer", "trainable_lemmatizer", "tagger", "morphologizer", "senter", "attribute_ruler")
+
+
+def _normalize_year(value: Any) -> Any:
+    """Year normalization: year always 4 digits (61 -> 1961, 05 -> 2005)"""
+    try:
+        num = int(str(value).strip())
+        if num < 100:
+            return 2000 + num if num < 50 else 1900 + num
+        return num
+    except ValueError:
+        return value
+
+
+def _normalize_month(value: Any) -> Any:
+    """Month normalization: month always numeric (january -> 1, february -> 2)"""
+    value_str = str(value).strip()
+    month = _MONTH_INDEX.get(value_str.lower())
+    if month is not None:
+        return month
+
+    # Try numeric
+    try:
+        num = int(value_str)
+        if 1 <= num <= 12:
+            return num
+    except ValueError:
+        pass
+
+    return value
+
+
+def _normalize_day(value: Any) -> Any:
+    """Day normalization: day always numeric (1-31)"""
+    try:
+        num = int(str(value).strip())
+        if 1 <= num <= 31:
+            return num
+    except ValueError:
+        pass
+    return value
+
+
+def _resolve_normalizer(rule: Any) -> Optional[Callable[[Any], Any]]:
+    """Normalization rule string -> function (None = value returned as-is)"""
+    if not rule:
+        return None
+    rule_lower = str(rule).lower()
+    if "year" in rule_lower and "4 digits" in rule_lower:
+        return _normalize_year
+    if "month" in rule_lower and "numeric" in rule_lower:
+        return _normalize_month
+    if "day" in rule_lower and "numeric" in rule_lower:
+        return _normalize_day
+    return None
+
+
+@dataclass(frozen=True)
+class FieldSpec:
+    """A contract subgroup, resolved for normalization and validation."""
+
+    key: str
+    label: Any
+    normalizer: Optional[Callable[[Any], Any]]
+    required: bool
+    is_number: bool
+    ranges: Tuple[Tuple[str, int, int], ...]
+
+
+@dataclass(frozen=True)
+class ExtractionPlan:
+    """Immutable execution plan for one (contract, engine) pair."""
+
+    engine_type: str
+    fields: Tuple[FieldSpec, ...]
+    output_keys: Tuple[str, ...]
+    # regex
+    regex: Optional[Pattern]
+    regex_error: Optional[str]
+    # embedding
+    positive_examples: Tuple[str, ...]
+    negative_examples: Tuple[str, ...]
+    embedding_threshold: float
+    examples_key: Optional[str]
+    single_subgroup_key: Optional[str]
+    # llm
+    system_prompt: str
+    user_prompt_template: str
+    llm_expected_keys: Tuple[str, ...]
+    llm_key_map: Tuple[Tuple[str, str], ...]
+    # ner: (subentity key, accepted entity labels ("*" = any), date part or None)
+    ner_fields: Tuple[Tuple[str, Tuple[str, ...], Optional[str]], ...] = ()
+
+
+def _examples_key(positive: Tuple[str, ...], negative: Tuple[str, ...]) -> Optional[str]:
+    if not positive:
+        return None
+    payload = json.dumps({"positive": positive, "negative": negative}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def contract_hash(contract: Dict[str, Any], engine: Dict[str, Any]) -> str:
+    payload = json.dumps({"contract": contract, "engine": engine}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _compile_fields(contract: Dict[str, Any]) -> Tuple[FieldSpec, ...]:
+    fields = []
+    for subgroup in contract.get("subgroups", []):
+        key = subgroup.get("subTaskKey")
+        key_lower = (key or "").lower()
+        normalization = subgroup.get("normalization")
+        fields.append(FieldSpec(
+            key=key,
+            label=subgroup.get("label"),
+            normalizer=_resolve_normalizer(normalization),
+            required=not subgroup.get("optional", True),
+            is_number=subgroup.get("type") == "number",
+            ranges=tuple(r for r in _DATE_RANGES if r[0] in key_lower),
+        ))
+    return tuple(fields)
+
+
+def _build_llm_prompt_from_contract(contract: Dict[str, Any]) -> str:
+    """Build LLM prompt template from contract (deterministic, not saved)"""
+    try:
+        entity = contract.get("entity", {})
+        entity_label = entity.get("label", "")
+        entity_desc = entity.get("description", "")
+
+        # Support both subentities (new) and subgroups (legacy)
+        subgroups = contract.get("subentities") or contract.get("subgroups", [])
+
+        # Build subentities description
+        subentities_list = []
+        for sg in subgroups:
+            sub_desc = f"- {sg.get('subTaskKey', 'unknown')}: {sg.get('label', '')}"
+            if sg.get('meaning'):
+                sub_desc += f" ({sg.get('meaning')})"
+            if sg.get('type'):
+                sub_desc += f" [type: {sg.get('type')}]"
+            if sg.get('constraints'):
+                sub_desc += f" [constraints: {sg.get('constraints')}]"
+            subentities_list.append(sub_desc)
+
+        # Get output format
+        output_format = contract.get("outputCanonical", {})
+        output_keys = output_format.get("keys", [])
+
+        # Build the prompt template
+        prompt = f"Extract information from the following text.\n\n"
+
+        if entity_label:
+            prompt += f"Entity to extract: {entity_label}\n"
+        if entity_desc:
+            prompt += f"Description: {entity_desc}\n"
+
+        if subentities_list:
+            prompt += f"\nFields to extract:\n"
+            prompt += "\n".join(subentities_list)
+            prompt += "\n"
+
+        prompt += f"\nOutput format: {output_format.get('format', 'object')}\n"
+        if output_keys:
+            prompt += f"Output keys: {', '.join(output_keys)}\n"
+
+        prompt += "\nText to analyze:\n{text}\n\n"
+        prompt += "Return a JSON object with the extracted values matching the output format above."
+
+        return prompt
+    except Exception as e:
+        print(f"[ContractExtractor] Error building LLM prompt from contract: {e}")
+        import traceback
+        traceback.print_exc()
+        return ""
+
+
+def _sub_data_list(subgroups: List[Dict[str, Any]]) -> str:
+    return "\n".join([
+        f"- {sg.get('subTaskKey', 'unknown')}: {sg.get('label', '')} ({sg.get('type', 'text')})"
+        for sg in subgroups
+    ])
+
+
+def _compile_ner_fields(subentities: List[Dict[str, Any]], entity_types: Any) -> Tuple[Tuple[str, Tuple[str, ...], Optional[str]], ...]:
+    """
+    entityTypes -> per-subentity accepted labels. Accepted forms:
+    {"subTaskKey": "PER" | [...]}, [{"subTaskKey", "entityType"}], or ["PER", "LOC"]
+    (matched via _NER_LABEL_HINTS; a single subentity takes every listed label).
+    """
+    keyed = [sg for sg in subentities if sg.get("subTaskKey")]
+    explicit: Dict[str, List[str]] = {}
+    if isinstance(entity_types, dict):
+        for key, labels in entity_types.items():
+            explicit[key] = [labels] if isinstance(labels, str) else list(labels or [])
+    labels: List[str] = []
+    for item in entity_types if isinstance(entity_types, list) else []:
+        if isinstance(item, dict):
+            key = item.get("subTaskKey") or item.get("key")
+            label = item.get("entityType") or item.get("label") or item.get("type")
+            if key and label:
+                explicit.setdefault(key, []).append(label)
+        elif item:
+            labels.append(str(item))
+
+    fields = []
+    for sg in keyed:
+        key = sg["subTaskKey"]
+        if key in explicit:
+            accepted = explicit[key]
+        elif len(keyed) == 1 and not explicit:
+            accepted = labels or ["*"]
+        else:
+            text = " ".join(str(sg.get(k) or "") for k in ("subTaskKey", "label", "type")).lower()
+            candidates = labels or list(_NER_LABEL_HINTS)
+            accepted = [l for l in candidates if any(h in text for h in _NER_LABEL_HINTS.get(l.upper(), ()))]
+        if accepted:
+            date_part = next((name for name, _, _ in _DATE_RANGES if name in key.lower()), None)
+            fields.append((key, tuple(l.upper() for l in accepted), date_part))
+    return tuple(fields)
+
+
+# JS/.NET named groups and backreferences, as saved by the editor: (?<name>...), \k<name>
+# (lookbehinds (?<= and (?<! are left alone)
+_JS_NAMED_GROUP = re.compile(r"(?<!\\)\(\?<(?![=!])")
+_JS_BACKREF = re.compile(r"\\k<(\w+)>")
+
+
+def _python_regex(pattern: str) -> str:
+    """Contract regex (JS/.NET syntax) -> Python re syntax"""
+    return _JS_BACKREF.sub(r"(?P=\1)", _JS_NAMED_GROUP.sub("(?P<", pattern))
+
+
+def compile_plan(contract: Dict[str, Any], engine: Dict[str, Any]) -> ExtractionPlan:
+    """Compile contract + engine into an ExtractionPlan (no caching, see get_extraction_plan)"""
+    engine_type = engine.get("type", "regex")
+    config = engine.get("config", {}) or {}
+
+    regex, regex_error = None, None
+    if engine_type == "regex" and config.get("regex"):
+        try:
+            regex = re.compile(_python_regex(config["regex"]), re.IGNORECASE)
+        except re.error as e:
+            regex_error = str(e)
+
+    examples = config.get("embeddingExamples", {}) or {}
+    positive_examples = tuple(examples.get("positive", []))
+    negative_examples = tuple(examples.get("negative", []))
+    subgroups = contract.get("subgroups", [])
+
+    # LLM: support both subentities (new) and subgroups (legacy)
+    llm_subgroups = contract.get("subentities") or contract.get("subgroups", [])
+    output_keys = tuple(contract.get("outputCanonical", {}).get("keys", []))
+    subgroup_keys = [sg.get("subTaskKey") for sg in llm_subgroups if sg.get("subTaskKey")]
+    llm_expected_keys = tuple(dict.fromkeys(subgroup_keys + list(output_keys)))
+    llm_key_map = {}
+    for expected_key in llm_expected_keys:
+        llm_key_map.setdefault(expected_key.lower(), expected_key)
+
+    system_prompt, user_prompt_template = "", ""
+    if engine_type == "llm":
+        system_prompt = config.get("systemPrompt", "You are a data extraction expert. Always return valid JSON.")
+        # Support both userPromptTemplate (backend) and aiPrompt (frontend field name)
+        user_prompt_template = config.get("userPromptTemplate") or config.get("aiPrompt") or ""
+        # If no user prompt template, generate it from contract (deterministic, not saved)
+        if not user_prompt_template:
+            user_prompt_template = _build_llm_prompt_from_contract(contract)
+        if "{subData}" in user_prompt_template:
+            user_prompt_template = user_prompt_template.replace("{subData}", _sub_data_list(llm_subgroups))
+
+    return ExtractionPlan(
+        engine_type=engine_type,
+        fields=_compile_fields(contract),
+        output_keys=output_keys,
+        regex=regex,
+        regex_error=regex_error,
+        positive_examples=positive_examples,
+        negative_examples=negative_examples,
+        embedding_threshold=config.get("embeddingThreshold", 0.7),
+        examples_key=_examples_key(positive_examples, negative_examples) if engine_type == "embedding" else None,
+        single_subgroup_key=subgroups[0].get("subTaskKey") if len(subgroups) == 1 else None,
+        system_prompt=system_prompt,
+        user_prompt_template=user_prompt_template,
+        llm_expected_keys=llm_expected_keys,
+        llm_key_map=tuple(llm_key_map.items()),
+        ner_fields=_compile_ner_fields(llm_subgroups, config.get("entityTypes")) if engine_type == "ner" else (),
+    )
+
+
+def _env_size(name: str, default: int) -> int:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = int(raw)
+        return value if value > 0 else default
+    except ValueError:
+        return default
+
+
+_plan_lock = threading.Lock()
+_plans: "OrderedDict[str, ExtractionPlan]" = OrderedDict()
+_plan_stats = {"hits": 0, "misses": 0}
+
+
+def get_extraction_plan(contract: Dict[str, Any], engine: Dict[str, Any], key: Optional[str] = None) -> ExtractionPlan:
+    """Compiled plan for contract + engine, reused across requests (LRU by contract hash)"""
+    key = key or contract_hash(contract, engine)
+    with _plan_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            _plan_stats["hits"] += 1
+            return plan
+        _plan_stats["misses"] += 1
+    plan = compile_plan(contract, engine)
+    with _plan_lock:
+        _plans[key] = plan
+        _plans.move_to_end(key)
+        while len(_plans) > _env_size("OMNIA_EXTRACTION_PLAN_CACHE_SIZE", DEFAULT_PLAN_CACHE_SIZE):
+            _plans.popitem(last=False)
+    return plan
+
+
+def extraction_plan_stats() -> Dict[str, Any]:
+    with _plan_lock:
+        return {"entries": len(_plans), **_plan_stats, "exampleMatrices": len(_example_matrices)}
+
+
+_ner_unavailable_logged = False
+
+
+def _ner_pipeline() -> Tuple[Any, List[str]]:
+    """(shared spaCy model or None, pipeline components to disable for entity extraction)"""
+    from backend import ner_spacy
+
+    global _ner_unavailable_logged
+    nlp = ner_spacy._get_nlp()
+    if nlp is None:
+        # _get_nlp non riprova dopo un errore: basta segnalarlo una volta
+        if not _ner_unavailable_logged:
+            _ner_unavailable_logged = True
+            print(f"[ContractExtractor] NER engine: spaCy not available - {ner_spacy._load_error}", flush=True)
+        return None, []
+    return nlp, [name for name in nlp.pipe_names if name in _NER_UNUSED_PIPES]
+
+
+def _embedding_functions():
+    """(model name, encode(list) -> matrix, encode(text) -> vector) of the local intent model"""
+    from backend.ai_endpoints.intent_embeddings import (
+        LOCAL_MODEL_NAME,
+        _encode_texts_batched,
+        compute_embedding_local
+    )
+    return LOCAL_MODEL_NAME, _encode_texts_batched, compute_embedding_local
+
+
+_example_matrices: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+
+
+def get_example_matrices(plan: ExtractionPlan) -> Tuple[Any, Any]:
+    """(positive, negative) normalized example matrices for the plan, encoded once per examples hash"""
+    from backend.ai_endpoints.intent_embedding_index import as_matrix
+
+    model_name, encode_many, _ = _embedding_functions()
+    key = f"{model_name}:{plan.examples_key}"
+    with _plan_lock:
+        cached = _example_matrices.get(key)
+        if cached is not None:
+            _example_matrices.move_to_end(key)
+            return cached
+
+    texts = list(plan.positive_examples) + list(plan.negative_examples)
+    mat = as_matrix(encode_many(texts))
+    n_pos = len(plan.positive_examples)
+    matrices = (mat[:n_pos], mat[n_pos:])
+    print(f"[ContractExtractor] Embedding engine: encoded {len(texts)} examples", flush=True)
+    with _plan_lock:
+        _example_matrices[key] = matrices
+        while len(_example_matrices) > _env_size("OMNIA_EXTRACTION_EXAMPLE_CACHE_SIZE", DEFAULT_EXAMPLE_CACHE_SIZE):
+            _example_matrices.popitem(last=False)
+    return matrices
+
 
 class ContractExtractor:
-    def __init__(self, contract: Dict[str, Any], engine: Dict[str, Any]):
+    def __init__(self, contract: Dict[str, Any], engine: Dict[str, Any], plan: Optional[ExtractionPlan] = None):
         self.contract = contract
         self.engine = engine
+        self.plan = plan or get_extraction_plan(contract, engine)
 
     def extract(self, text: str) -> Dict[str, Any]:
         """
@@ -16,8 +460,29 @@ class ContractExtractor:
         Returns canonical output format
         """
         # 1. Apply engine to extract raw values
-        raw_values = self._apply_engine(text)
+        return self._finish(self._apply_engine(text))
 
+    def extract_many(self, texts: List[str], concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        extract() over many texts with the same compiled plan: the embedding engine
+        encodes all texts in one batch, the LLM engine fans out on a bounded pool
+        (concurrency, default OMNIA_EXTRACTION_BATCH_CONCURRENCY).
+        """
+        texts = list(texts)
+        if self.plan.engine_type == "ner" and len(texts) > 1:
+            return [self._finish(raw) for raw in self._apply_ner_engine_batch(texts)]
+        if self.plan.engine_type == "embedding" and len(texts) > 1:
+            return [self._finish(raw) for raw in self._apply_embedding_engine_batch(texts)]
+        if self.plan.engine_type == "llm" and len(texts) > 1:
+            from newBackend.services.svc_llm_limiter import bind_llm_lane
+
+            workers = concurrency or _env_size("OMNIA_EXTRACTION_BATCH_CONCURRENCY", DEFAULT_BATCH_CONCURRENCY)
+            with ThreadPoolExecutor(max_workers=min(workers, len(texts)), thread_name_prefix="extract-llm") as pool:
+                return list(pool.map(bind_llm_lane(self.extract), texts))
+        return [self.extract(text) for text in texts]
+
+    def _finish(self, raw_values: Dict[str, Any]) -> Dict[str, Any]:
+        """Contract steps applied to the raw values of an engine"""
         # 2. Apply contract for normalization
         normalized_values = self._apply_contract_normalization(raw_values)
 
@@ -38,7 +503,7 @@ class ContractExtractor:
 
     def _apply_engine(self, text: str) -> Dict[str, Any]:
         """Apply engine to extract raw values"""
-        engine_type = self.engine.get("type", "regex")
+        engine_type = self.plan.engine_type
 
         if engine_type == "regex":
             return self._apply_regex_engine(text)
@@ -55,13 +520,16 @@ class ContractExtractor:
 
     def _apply_regex_engine(self, text: str) -> Dict[str, Any]:
         """Apply regex engine"""
-        regex = self.engine.get("config", {}).get("regex")
-        if not regex:
+        if self.plan.regex_error:
+            print(f"[ContractExtractor] Regex error: {self.plan.regex_error}")
+            return {}
+        regex = self.plan.regex
+        if regex is None:
             return {}
 
         try:
             # Find all matches and get the longest one
-            matches = list(re.finditer(regex, text, re.IGNORECASE))
+            matches = list(regex.finditer(text))
             if not matches:
                 return {}
 
@@ -81,76 +549,148 @@ class ContractExtractor:
             return {}
 
     def _apply_ner_engine(self, text: str) -> Dict[str, Any]:
-        """Apply NER engine using spaCy or similar"""
-        # TODO: Implement NER extraction using spaCy
-        # For now, return empty (will be implemented later)
-        print(f"[ContractExtractor] NER engine not yet implemented")
-        return {}
-
-    def _apply_embedding_engine(self, text: str) -> Dict[str, Any]:
-        """Apply embedding engine using similarity matching"""
-        examples = self.engine.get("config", {}).get("embeddingExamples", {})
-        threshold = self.engine.get("config", {}).get("embeddingThreshold", 0.7)
+        """Apply NER engine using spaCy (shared model, only the entity components)"""
+        return self._apply_ner_engine_batch([text])[0]
 
-        positive_examples = examples.get("positive", [])
-        negative_examples = examples.get("negative", [])
+    def _apply_ner_engine_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """NER engine over many texts: one nlp.pipe over all inputs"""
+        if not self.plan.ner_fields:
+            return [{} for _ in texts]
 
-        if not positive_examples:
-            return {}
+        nlp, disabled = _ner_pipeline()
+        if nlp is None:
+            return [{} for _ in texts]
 
         try:
-            # Import embedding functions
-            from backend.ai_endpoints.intent_embeddings import (
-                compute_embedding_local,
-                cosine_similarity
-            )
-
-            # Compute embedding for input text
-            text_embedding = compute_embedding_local(text)
-
-            # Find best match among positive examples
-            best_match_score = 0.0
-            best_match_text = ""
-
-            for example_text in positive_examples:
-                example_embedding = compute_embedding_local(example_text)
-                score = cosine_similarity(text_embedding, example_embedding)
-
-                if score > best_match_score:
-                    best_match_score = score
-                    best_match_text = example_text
-
-            # Apply penalty for negative examples
-            penalty = 0.0
-            for neg_example in negative_examples:
-                neg_embedding = compute_embedding_local(neg_example)
-                neg_score = cosine_similarity(text_embedding, neg_embedding)
-                if neg_score > 0.7:
-                    penalty += (neg_score - 0.7) * 0.5
-
-            final_score = max(0.0, best_match_score - penalty)
-
-            # If score >= threshold, extract value
-            if final_score >= threshold:
-                extracted = {}
-                subgroups = self.contract.get("subgroups", [])
+            if len(texts) == 1:
+                docs = [nlp(texts[0], disable=disabled)]
+            else:
+                docs = nlp.pipe(
+                    texts,
+                    batch_size=_env_size("OMNIA_NER_BATCH_SIZE", DEFAULT_NER_BATCH_SIZE),
+                    n_process=_env_size("OMNIA_NER_N_PROCESS", 1),
+                    disable=disabled
+                )
+            return [self._ner_values(doc) for doc in docs]
+        except Exception as e:
+            print(f"[ContractExtractor] NER error: {e}")
+            import traceback
+            traceback.print_exc()
+            return [{} for _ in texts]
 
-                # If single subentity, use that
-                if len(subgroups) == 1:
-                    extracted[subgroups[0].get("subTaskKey")] = text
+    def _ner_values(self, doc: Any) -> Dict[str, Any]:
+        """
+        First entity of an accepted label per subentity; DATE entities fill day/month/year parts.
+        The default it_core_news_sm emits only PER/LOC/ORG/MISC: without a DATE entity the
+        date parts mapped to DATE are parsed from the whole text, as /api/ner/extract does.
+        """
+        from backend.ner_spacy import _parse_dob
+
+        extracted = {}
+        has_date_entity = False
+        for ent in doc.ents:
+            label = ent.label_.upper()
+            has_date_entity = has_date_entity or label == "DATE"
+            parsed = None
+            for key, labels, date_part in self.plan.ner_fields:
+                if key in extracted or (label not in labels and "*" not in labels):
+                    continue
+                if date_part and label == "DATE":
+                    if parsed is None:
+                        candidates = _parse_dob(ent.text)
+                        parsed = candidates[0] if candidates else {}
+                    if parsed.get(date_part) is not None:
+                        extracted[key] = parsed[date_part]
                 else:
-                    # Otherwise map from best_match_text
-                    extracted["value"] = best_match_text
-
-                return extracted
+                    extracted[key] = ent.text.strip()
+
+        date_fields = [(key, part) for key, labels, part in self.plan.ner_fields
+                       if part and "DATE" in labels and key not in extracted]
+        if date_fields and not has_date_entity:
+            candidates = _parse_dob(doc.text)
+            if candidates:
+                for key, part in date_fields:
+                    if candidates[0].get(part) is not None:
+                        extracted[key] = candidates[0][part]
+        return extracted
 
+    def _apply_embedding_engine(self, text: str) -> Dict[str, Any]:
+        """Apply embedding engine using similarity matching"""
+        if not self.plan.positive_examples:
             return {}
+
+        try:
+            from backend.ai_endpoints.intent_embedding_index import as_query
+
+            # Example matrices are encoded once per examples hash; the input costs one forward pass
+            _, _, encode_one = _embedding_functions()
+            return self._embedding_values(text, as_query(encode_one(text)))
         except Exception as e:
             print(f"[ContractExtractor] Embedding error: {e}")
             import traceback
             traceback.print_exc()
             return {}
 
+    def _apply_embedding_engine_batch(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """Embedding engine over many texts: one model.encode(list) for all inputs"""
+        if not self.plan.positive_examples:
+            return [{} for _ in texts]
+
+        try:
+            from backend.ai_endpoints.intent_embedding_index import as_matrix
+
+            _, encode_many, _ = _embedding_functions()
+            queries = as_matrix(encode_many(texts))
+            return [self._embedding_values(text, query) for text, query in zip(texts, queries)]
+        except Exception as e:
+            print(f"[ContractExtractor] Embedding error: {e}")
+            import traceback
+            traceback.print_exc()
+            return [{} for _ in texts]
+
+    def _embedding_values(self, text: str, query: Any) -> Dict[str, Any]:
+        """Score a normalized query vector against the example matrices"""
+        from backend.ai_endpoints.intent_embedding_index import (
+            NEGATIVE_PENALTY_WEIGHT,
+            NEGATIVE_THRESHOLD,
+            similarities
+        )
+
+        positive_matrix, negative_matrix = get_example_matrices(self.plan)
+
+        # Find best match among positive examples
+        best_match_score = 0.0
+        best_match_text = ""
+        positive_scores = similarities(positive_matrix, None, query)
+        best = int(positive_scores.argmax())
+        if float(positive_scores[best]) > best_match_score:
+            best_match_score = float(positive_scores[best])
+            best_match_text = self.plan.positive_examples[best]
+
+        # Apply penalty for negative examples
+        penalty = 0.0
+        if negative_matrix.shape[0]:
+            negative_scores = similarities(negative_matrix, None, query)
+            over = negative_scores[negative_scores > NEGATIVE_THRESHOLD]
+            penalty = float(((over - NEGATIVE_THRESHOLD) * NEGATIVE_PENALTY_WEIGHT).sum())
+
+        final_score = max(0.0, best_match_score - penalty)
+
+        # If score >= threshold, extract value
+        if final_score >= self.plan.embedding_threshold:
+            extracted = {}
+
+            # If single subentity, use that
+            if len(self.plan.fields) == 1:
+                extracted[self.plan.single_subgroup_key] = text
+            else:
+                # Otherwise map from best_match_text
+                extracted["value"] = best_match_text
+
+            return extracted
+
+        return {}
+
     def _apply_llm_engine(self, text: str) -> Dict[str, Any]:
         """Apply LLM engine using OpenAI/Anthropic"""
         try:
@@ -161,36 +701,16 @@ class ContractExtractor:
                 print(f"[ContractExtractor] LLM engine: OPENAI_KEY not configured")
                 return {}
 
-            config = self.engine.get("config", {})
-            system_prompt = config.get("systemPrompt", "You are a data extraction expert. Always return valid JSON.")
-            # Support both userPromptTemplate (backend) and aiPrompt (frontend field name)
-            user_prompt_template = (
-                config.get("userPromptTemplate") or
-                config.get("aiPrompt") or ""
-            )
-
-            print(f"[ContractExtractor] LLM engine: systemPrompt present={bool(system_prompt)}, userPromptTemplate present={bool(user_prompt_template)}")
-
-            # If no user prompt template, generate it from contract (deterministic, not saved)
+            # Template resolved at compile time (config or generated from contract, {subData} filled in)
+            system_prompt = self.plan.system_prompt
+            user_prompt_template = self.plan.user_prompt_template
             if not user_prompt_template:
-                print(f"[ContractExtractor] LLM engine: userPromptTemplate empty, generating from contract")
-                user_prompt_template = self._build_llm_prompt_from_contract()
-                if not user_prompt_template:
-                    print(f"[ContractExtractor] LLM engine: ERROR - could not generate prompt from contract")
-                    return {}
+                print(f"[ContractExtractor] LLM engine: ERROR - could not generate prompt from contract")
+                return {}
 
             # Replace placeholders in user prompt
             user_prompt = user_prompt_template.replace("{text}", text)
 
-            # Replace {subData} placeholder if present
-            if "{subData}" in user_prompt:
-                subgroups = self.contract.get("subentities") or self.contract.get("subgroups", [])
-                sub_data_list = "\n".join([
-                    f"- {sg.get('subTaskKey', 'unknown')}: {sg.get('label', '')} ({sg.get('type', 'text')})"
-                    for sg in subgroups
-                ])
-                user_prompt = user_prompt.replace("{subData}", sub_data_list)
-
             # Call LLM
             messages = [
                 {"role": "system", "content": system_prompt},
@@ -216,13 +736,9 @@ class ContractExtractor:
 
                 # Check if response is a dict
                 if isinstance(response_data, dict):
-                    # Get contract structure — support both subentities (new) and subgroups (legacy)
-                    subgroups = self.contract.get("subentities") or self.contract.get("subgroups", [])
-                    subgroup_keys = [sg.get("subTaskKey") for sg in subgroups if sg.get("subTaskKey")]
-
-                    # Also check outputCanonical.keys as fallback
-                    output_keys = self.contract.get("outputCanonical", {}).get("keys", [])
-                    all_expected_keys = list(set(subgroup_keys + output_keys))
+                    # Expected keys: subentities/subgroups + outputCanonical.keys (precomputed)
+                    all_expected_keys = list(self.plan.llm_expected_keys)
+                    key_map = dict(self.plan.llm_key_map)
 
                     print(f"[ContractExtractor] LLM engine: Expected keys: {all_expected_keys}")
                     print(f"[ContractExtractor] LLM engine: Response keys: {list(response_data.keys())}")
@@ -232,11 +748,8 @@ class ContractExtractor:
                         if key in all_expected_keys:
                             extracted[key] = value
                         # Also check case-insensitive match
-                        elif all_expected_keys:
-                            for expected_key in all_expected_keys:
-                                if key.lower() == expected_key.lower():
-                                    extracted[expected_key] = value
-                                    break
+                        elif key.lower() in key_map:
+                            extracted[key_map[key.lower()]] = value
 
                     # Strategy 2: If single expected key and response has "value", map it
                     if not extracted and len(all_expected_keys) == 1 and "value" in response_data:
@@ -272,59 +785,6 @@ class ContractExtractor:
             traceback.print_exc()
             return {}
 
-    def _build_llm_prompt_from_contract(self) -> str:
-        """Build LLM prompt template from contract (deterministic, not saved)"""
-        try:
-            entity = self.contract.get("entity", {})
-            entity_label = entity.get("label", "")
-            entity_desc = entity.get("description", "")
-
-            # Support both subentities (new) and subgroups (legacy)
-            subgroups = self.contract.get("subentities") or self.contract.get("subgroups", [])
-
-            # Build subentities description
-            subentities_list = []
-            for sg in subgroups:
-                sub_desc = f"- {sg.get('subTaskKey', 'unknown')}: {sg.get('label', '')}"
-                if sg.get('meaning'):
-                    sub_desc += f" ({sg.get('meaning')})"
-                if sg.get('type'):
-                    sub_desc += f" [type: {sg.get('type')}]"
-                if sg.get('constraints'):
-                    sub_desc += f" [constraints: {sg.get('constraints')}]"
-                subentities_list.append(sub_desc)
-
-            # Get output format
-            output_format = self.contract.get("outputCanonical", {})
-            output_keys = output_format.get("keys", [])
-
-            # Build the prompt template
-            prompt = f"Extract information from the following text.\n\n"
-
-            if entity_label:
-                prompt += f"Entity to extract: {entity_label}\n"
-            if entity_desc:
-                prompt += f"Description: {entity_desc}\n"
-
-            if subentities_list:
-                prompt += f"\nFields to extract:\n"
-                prompt += "\n".join(subentities_list)
-                prompt += "\n"
-
-            prompt += f"\nOutput format: {output_format.get('format', 'object')}\n"
-            if output_keys:
-                prompt += f"Output keys: {', '.join(output_keys)}\n"
-
-            prompt += "\nText to analyze:\n{text}\n\n"
-            prompt += "Return a JSON object with the extracted values matching the output format above."
-
-            return prompt
-        except Exception as e:
-            print(f"[ContractExtractor] Error building LLM prompt from contract: {e}")
-            import traceback
-            traceback.print_exc()
-            return ""
-
     def _apply_rule_based_engine(self, text: str) -> Dict[str, Any]:
         """Apply rule-based engine using extractor code"""
         # TODO: Implement rule-based extraction
@@ -336,123 +796,40 @@ class ContractExtractor:
         """Apply contract normalization rules"""
         normalized = {}
 
-        subgroups = self.contract.get("subgroups", [])
-        for subgroup in subgroups:
-            sub_task_key = subgroup.get("subTaskKey")
-            if sub_task_key not in raw_values:
+        for field in self.plan.fields:
+            if field.key not in raw_values:
                 continue
 
-            raw_value = raw_values[sub_task_key]
-            normalization = subgroup.get("normalization")
-
-            if normalization:
-                normalized[sub_task_key] = self._apply_normalization_rule(
-                    raw_value,
-                    normalization,
-                    sub_task_key
-                )
-            else:
-                normalized[sub_task_key] = raw_value
+            raw_value = raw_values[field.key]
+            normalized[field.key] = field.normalizer(raw_value) if field.normalizer else raw_value
 
         return normalized
 
-    def _apply_normalization_rule(self, value: Any, rule: str, sub_task_key: str) -> Any:
-        """Apply a single normalization rule"""
-        value_str = str(value).strip()
-
-        # Year normalization: "year always 4 digits (61 -> 1961, 05 -> 2005)"
-        if "year" in rule.lower() and "4 digits" in rule.lower():
-            try:
-                num = int(value_str)
-                if num < 100:
-                    return 2000 + num if num < 50 else 1900 + num
-                return num
-            except ValueError:
-                return value
-
-        # Month normalization: "month always numeric (january -> 1, february -> 2)"
-        if "month" in rule.lower() and "numeric" in rule.lower():
-            month_names = [
-                'january', 'february', 'march', 'april', 'may', 'june',
-                'july', 'august', 'september', 'october', 'november', 'december',
-                'gennaio', 'febbraio', 'marzo', 'aprile', 'maggio', 'giugno',
-                'luglio', 'agosto', 'settembre', 'ottobre', 'novembre', 'dicembre',
-                'gen', 'feb', 'mar', 'apr', 'mag', 'giu',
-                'lug', 'ago', 'set', 'ott', 'nov', 'dic'
-            ]
-
-            value_lower = value_str.lower()
-            if value_lower in month_names:
-                month_index = month_names.index(value_lower)
-                return (month_index % 12) + 1
-
-            # Try numeric
-            try:
-                num = int(value_str)
-                if 1 <= num <= 12:
-                    return num
-            except ValueError:
-                pass
-
-            return value
-
-        # Day normalization: "day always numeric (1-31)"
-        if "day" in rule.lower() and "numeric" in rule.lower():
-            try:
-                num = int(value_str)
-                if 1 <= num <= 31:
-                    return num
-            except ValueError:
-                pass
-            return value
-
-        # Default: return as-is
-        return value
-
     def _validate_with_contract(self, values: Dict[str, Any]) -> Dict[str, Any]:
         """Validate extracted values against contract"""
         errors = []
 
-        subgroups = self.contract.get("subgroups", [])
-        for subgroup in subgroups:
-            sub_task_key = subgroup.get("subTaskKey")
-            value = values.get(sub_task_key)
+        for field in self.plan.fields:
+            value = values.get(field.key)
 
             # Check required fields (if not optional)
-            if not subgroup.get("optional", True) and (value is None or value == ""):
-                errors.append(f"Missing required field: {subgroup.get('label')} ({sub_task_key})")
+            if field.required and (value is None or value == ""):
+                errors.append(f"Missing required field: {field.label} ({field.key})")
 
             # Type validation
             if value is not None and value != "":
-                sub_type = subgroup.get("type")
-                if sub_type == "number":
+                if field.is_number:
                     try:
                         int(str(value))
                     except ValueError:
-                        errors.append(f"Invalid number for {subgroup.get('label')}: {value}")
-
-                # Range validation for dates
-                if "day" in sub_task_key.lower():
-                    try:
-                        day = int(str(value))
-                        if not (1 <= day <= 31):
-                            errors.append(f"Invalid day: {day} (must be 1-31)")
-                    except ValueError:
-                        pass
+                        errors.append(f"Invalid number for {field.label}: {value}")
 
-                if "month" in sub_task_key.lower():
+                # Range validation for dates (day / month / year keys)
+                for name, low, high in field.ranges:
                     try:
-                        month = int(str(value))
-                        if not (1 <= month <= 12):
-                            errors.append(f"Invalid month: {month} (must be 1-12)")
-                    except ValueError:
-                        pass
-
-                if "year" in sub_task_key.lower():
-                    try:
-                        year = int(str(value))
-                        if not (1900 <= year <= 2100):
-                            errors.append(f"Invalid year: {year} (must be 1900-2100)")
+                        number = int(str(value))
+                        if not (low <= number <= high):
+                            errors.append(f"Invalid {name}: {number} (must be {low}-{high})")
                     except ValueError:
                         pass
 
@@ -472,7 +849,7 @@ class ContractExtractor:
         if not validation.get("valid"):
             return 0.0
 
-        expected_keys = self.contract.get("outputCanonical", {}).get("keys", [])
+        expected_keys = self.plan.output_keys
         extracted_keys = list(values.keys())
 
         # Confidence based on how many expected keys were extracted
@@ -491,3 +868,175 @@ class ContractExtractor:
 
         # Low confidence if minimal extraction
         return 0.5
+
+
+# ============================================================================
+# Cascade mode: cheap engines first, early exit on the first accepted result
+# ============================================================================
+
+# Cheap-first order of the cascade (rules/rule_based are the same engine)
+CASCADE_ORDER = {"regex": 1, "rules": 2, "rule_based": 2, "ner": 3, "embedding": 4, "llm": 5}
+DEFAULT_CASCADE_MIN_CONFIDENCE = 0.5
+
+
+def engine_from_parser(parser: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the engine config expected by ContractExtractor from a contract engine/parser entry"""
+    engine_type = parser.get("type")
+    engine = {
+        "type": engine_type,
+        "config": {}
+    }
+
+    # Extract config based on parser type
+    if engine_type == "regex":
+        patterns = parser.get("patterns") or []
+        engine["config"]["regex"] = parser.get("regex") or (patterns[0] if patterns else "")
+    elif engine_type == "ner":
+        engine["config"]["entityTypes"] = parser.get("entityTypes", [])
+        engine["config"]["confidence"] = parser.get("confidence", 0.7)
+    elif engine_type == "embedding":
+        engine["config"]["embeddingExamples"] = {
+            "positive": parser.get("positiveExamples", []),
+            "negative": parser.get("negativeExamples", [])
+        }
+        engine["config"]["embeddingThreshold"] = parser.get("threshold", 0.7)
+    elif engine_type == "llm":
+        engine["config"]["systemPrompt"] = parser.get("systemPrompt", "")
+        # aiPrompt is the renamed field from userPromptTemplate (see contractLoader.ts LLMContract)
+        engine["config"]["userPromptTemplate"] = (
+            parser.get("userPromptTemplate") or
+            parser.get("aiPrompt") or ""
+        )
+    elif engine_type == "rules" or engine_type == "rule_based":
+        engine["config"]["extractorCode"] = parser.get("extractorCode", "")
+
+    return engine
+
+
+def _cascade_min_confidence() -> float:
+    raw = (os.environ.get("OMNIA_EXTRACTION_CASCADE_MIN_CONFIDENCE") or "").strip()
+    try:
+        return float(raw) if raw else DEFAULT_CASCADE_MIN_CONFIDENCE
+    except ValueError:
+        return DEFAULT_CASCADE_MIN_CONFIDENCE
+
+
+class _EngineStats:
+    __slots__ = ("runs", "hits", "total_ms")
+
+    def __init__(self) -> None:
+        self.runs = 0
+        self.hits = 0
+        self.total_ms = 0.0
+
+
+_cascade_lock = threading.Lock()
+_cascade_stats: Dict[str, _EngineStats] = {}
+_cascade_totals = {"extractions": 0, "unresolved": 0}
+
+
+def _record_engine(engine_type: str, elapsed_ms: float, accepted: bool) -> None:
+    with _cascade_lock:
+        stats = _cascade_stats.setdefault(engine_type, _EngineStats())
+        stats.runs += 1
+        stats.total_ms += elapsed_ms
+        if accepted:
+            stats.hits += 1
+
+
+def cascade_stats() -> Dict[str, Any]:
+    """Per-engine runs, accepted hits and timing of the cascade since process start"""
+    with _cascade_lock:
+        return {
+            **_cascade_totals,
+            "engines": {
+                name: {
+                    "runs": s.runs,
+                    "hits": s.hits,
+                    "hitRate": (s.hits / s.runs) if s.runs else 0.0,
+                    "avgMs": round(s.total_ms / s.runs, 2) if s.runs else 0.0,
+                }
+                for name, s in sorted(_cascade_stats.items(), key=lambda kv: CASCADE_ORDER.get(kv[0], 99))
+            },
+        }
+
+
+class CascadeExtractor:
+    """
+    Runs the contract's enabled engines cheap-first (regex -> rules -> ner -> embedding -> llm)
+    and stops at the first result that has values, passes contract validation and
+    reaches min_confidence. Output: the canonical extract() format plus a per-engine
+    "cascade" trace; "source" is the engine that produced the result.
+    """
+
+    def __init__(self, contract: Dict[str, Any], engines: List[Dict[str, Any]], min_confidence: Optional[float] = None):
+        self.contract = contract
+        self.min_confidence = _cascade_min_confidence() if min_confidence is None else float(min_confidence)
+        enabled = [p for p in engines if p.get("enabled", True) and p.get("type") in CASCADE_ORDER]
+        # sorted() is stable: engines of the same kind keep the contract order
+        self.extractors = [
+            ContractExtractor(contract, engine_from_parser(p))
+            for p in sorted(enabled, key=lambda p: CASCADE_ORDER[p.get("type")])
+        ]
+
+    def _accepted(self, result: Dict[str, Any]) -> bool:
+        return bool(result.get("values")) and result.get("hasMatch") and result.get("confidence", 0) >= self.min_confidence
+
+    def extract(self, text: str) -> Dict[str, Any]:
+        return self.extract_many([text])[0]
+
+    def extract_many(self, texts: List[str], concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Cascade over many texts, one engine stage at a time: each stage runs only on
+        the texts not yet accepted, batched by ContractExtractor.extract_many.
+        """
+        texts = list(texts)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        traces: List[List[Dict[str, Any]]] = [[] for _ in texts]
+        last: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        pending = list(range(len(texts)))
+
+        for extractor in self.extractors:
+            if not pending:
+                break
+            engine_type = extractor.plan.engine_type
+            started = time.perf_counter()
+            outputs = extractor.extract_many([texts[i] for i in pending], concurrency)
+            # Batched stages: time per text is the stage time divided among its texts
+            elapsed_ms = (time.perf_counter() - started) * 1000.0 / len(pending)
+            still_pending = []
+            for i, result in zip(pending, outputs):
+                accepted = self._accepted(result)
+                _record_engine(engine_type, elapsed_ms, accepted)
+                traces[i].append({
+                    "engine": engine_type,
+                    "ms": round(elapsed_ms, 2),
+                    "hasMatch": result.get("hasMatch", False),
+                    "confidence": result.get("confidence", 0),
+                    "accepted": accepted
+                })
+                if result.get("values"):
+                    last[i] = result
+                if accepted:
+                    results[i] = {**result, "cascade": traces[i]}
+                else:
+                    still_pending.append(i)
+            pending = still_pending
+
+        with _cascade_lock:
+            _cascade_totals["extractions"] += len(texts)
+            _cascade_totals["unresolved"] += len(pending)
+        for i in pending:
+            # No engine accepted: return the last result with values (if any), flagged as no match
+            if last[i] is not None:
+                results[i] = {**last[i], "hasMatch": False, "cascade": traces[i]}
+            else:
+                results[i] = {
+                    "values": {},
+                    "hasMatch": False,
+                    "errors": [] if self.extractors else ["No enabled engines in contract"],
+                    "source": None,
+                    "confidence": 0,
+                    "cascade": traces[i]
+                }
+        return results
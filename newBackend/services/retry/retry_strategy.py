@@ -2,37 +2,137 @@
 Retry Strategy
 
 Implements retry logic with exponential backoff for AI calls.
+
+- Full jitter: delay = random(0, min(max_delay, base_delay * 2^attempt))
+- Only transient errors are retried (429, 408, 5xx, timeouts / connection errors);
+  validation and client errors (400/401/403/404/422, ValueError, bad JSON) fail immediately
+- Retry-After from the provider is honored when present
+- Optional overall deadline (seconds) across all attempts and sleeps
+
+retry_async_with_backoff is the non-blocking version for async endpoints: it
+awaits coroutines directly and runs synchronous functions in a worker thread.
 """
 
 from typing import Callable, Any, Optional, Tuple
+import asyncio
+import contextvars
+import functools
 import logging
+import os
+import random
+import re
+import socket
+import time
 
 logger = logging.getLogger(__name__)
 
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+DEFAULT_DEADLINE_SEC = 120.0
+
+_STATUS_RE = re.compile(r"\berror (\d{3})\b", re.IGNORECASE)
+_TRANSIENT_MARKERS = ("connection error", "timed out", "timeout", "temporarily unavailable", "limiter")
+
 
-def retry_with_backoff(
+def default_deadline() -> float:
+    """Overall retry budget for endpoint calls (OMNIA_LLM_RETRY_DEADLINE_SEC)."""
+    raw = (os.environ.get("OMNIA_LLM_RETRY_DEADLINE_SEC") or "").strip()
+    try:
+        value = float(raw)
+        return value if value > 0 else DEFAULT_DEADLINE_SEC
+    except ValueError:
+        return DEFAULT_DEADLINE_SEC
+
+
+def classify_error(error: BaseException) -> Tuple[bool, Optional[float]]:
+    """
+    Classify an exception raised by an AI call.
+
+    Returns:
+        Tuple of (retryable, retry_after_seconds)
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError, socket.timeout)):
+        return True, None
+
+    status = getattr(error, "status_code", None)
+    retry_after = getattr(error, "retry_after", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    if status is None:
+        match = _STATUS_RE.search(str(error))
+        if match:
+            status = int(match.group(1))
+    if status is not None:
+        return int(status) in RETRYABLE_STATUS, retry_after
+
+    cause = error.__cause__
+    if cause is not None and cause is not error:
+        retryable, _ = classify_error(cause)
+        if retryable:
+            return True, retry_after
+
+    message = str(error).lower()
+    return any(m in message for m in _TRANSIENT_MARKERS), retry_after
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float, retry_after: Optional[float] = None) -> float:
+    """Full-jitter delay for the given attempt (0-based), never shorter than Retry-After."""
+    delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _next_delay(
+    error: BaseException,
+    attempt: int,
+    max_retries: int,
+    base_delay: float,
+    max_delay: float,
+    deadline_at: Optional[float],
+) -> Optional[float]:
+    """Delay before the next attempt, or None if the call must not be retried."""
+    retryable, retry_after = classify_error(error)
+    if not retryable:
+        logger.error(f"[retry] Non-retryable error: {error}")
+        return None
+    if attempt >= max_retries - 1:
+        logger.error(f"[retry] All {max_retries} attempts failed")
+        return None
+    delay = backoff_delay(attempt, base_delay, max_delay, retry_after)
+    if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+        logger.error(f"[retry] Deadline reached, not retrying (next delay {delay:.2f}s)")
+        return None
+    logger.info(f"[retry] Retrying in {delay:.2f} seconds...")
+    return delay
+
+
+def retry_sync_with_backoff(
     func: Callable,
     max_retries: int = 3,
     base_delay: float = 1.0,
     max_delay: float = 10.0,
     *args,
+    deadline: Optional[float] = None,
     **kwargs
 ) -> Tuple[Any, Optional[str]]:
     """
-    Retry a function with exponential backoff (synchronous version).
+    Retry a synchronous function with exponential backoff (blocking sleep:
+    only for sync callers, use retry_async_with_backoff in async endpoints).
 
     Args:
-        func: Function to retry (synchronous)
-        max_retries: Maximum number of retries
+        func: Synchronous function to retry
+        max_retries: Maximum number of attempts
         base_delay: Base delay in seconds
         max_delay: Maximum delay in seconds
         *args: Positional arguments for func
+        deadline: Optional overall time budget in seconds
         **kwargs: Keyword arguments for func
 
     Returns:
         Tuple of (result, error_message)
     """
-    import time
+    deadline_at = time.monotonic() + deadline if deadline else None
     last_error = None
 
     for attempt in range(max_retries):
@@ -42,56 +142,78 @@ def retry_with_backoff(
         except Exception as e:
             last_error = str(e)
             logger.warning(f"[retry] Attempt {attempt + 1}/{max_retries} failed: {last_error}")
-
-            if attempt < max_retries - 1:
-                # Calculate delay with exponential backoff
-                delay = min(base_delay * (2 ** attempt), max_delay)
-                logger.info(f"[retry] Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                logger.error(f"[retry] All {max_retries} attempts failed")
+            delay = _next_delay(e, attempt, max_retries, base_delay, max_delay, deadline_at)
+            if delay is None:
+                break
+            time.sleep(delay)
 
     return None, last_error
 
 
-def retry_sync_with_backoff(
+# Same behaviour as retry_sync_with_backoff (kept for existing imports)
+retry_with_backoff = retry_sync_with_backoff
+
+
+async def retry_async_with_backoff(
     func: Callable,
     max_retries: int = 3,
     base_delay: float = 1.0,
     max_delay: float = 10.0,
     *args,
+    deadline: Optional[float] = None,
     **kwargs
 ) -> Tuple[Any, Optional[str]]:
     """
-    Retry a synchronous function with exponential backoff.
+    Retry a coroutine function (or a sync function, run in a worker thread)
+    without blocking the event loop.
 
     Args:
-        func: Synchronous function to retry
-        max_retries: Maximum number of retries
+        func: Coroutine function or synchronous function to retry
+        max_retries: Maximum number of attempts
         base_delay: Base delay in seconds
         max_delay: Maximum delay in seconds
         *args: Positional arguments for func
+        deadline: Optional overall time budget in seconds. Each attempt is awaited
+            with the remaining budget; when it runs out the call stops without
+            retrying. Coroutine attempts are cancelled, sync attempts are only
+            abandoned (the worker thread keeps running), so no new attempt is
+            started next to them
         **kwargs: Keyword arguments for func
 
     Returns:
         Tuple of (result, error_message)
     """
-    import time
+    loop = asyncio.get_running_loop()
+    deadline_at = time.monotonic() + deadline if deadline else None
     last_error = None
 
     for attempt in range(max_retries):
         try:
-            result = func(*args, **kwargs)
-            return result, None
+            remaining = deadline_at - time.monotonic() if deadline_at is not None else None
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError("retry deadline exceeded")
+            if asyncio.iscoroutinefunction(func):
+                call = func(*args, **kwargs)
+            else:
+                # copy_context: il worker vede le ContextVar del chiamante (es. la lane LLM)
+                call = loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args, **kwargs))
+            if remaining is None:
+                return await call, None
+            try:
+                return await asyncio.wait_for(call, timeout=remaining), None
+            except asyncio.TimeoutError:
+                if time.monotonic() < deadline_at:
+                    raise  # timeout sollevato dalla funzione stessa, non dal budget
+                # Budget esaurito: un tentativo sync resta in esecuzione nel worker e un
+                # nuovo tentativo gli si affiancherebbe (doppia chiamata LLM, quota scheduler)
+                logger.error(f"[retry] Deadline reached during attempt {attempt + 1}/{max_retries}, not retrying")
+                return None, "retry deadline exceeded"
         except Exception as e:
-            last_error = str(e)
+            last_error = str(e) or type(e).__name__
             logger.warning(f"[retry] Attempt {attempt + 1}/{max_retries} failed: {last_error}")
-
-            if attempt < max_retries - 1:
-                delay = min(base_delay * (2 ** attempt), max_delay)
-                logger.info(f"[retry] Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                logger.error(f"[retry] All {max_retries} attempts failed")
+            delay = _next_delay(e, attempt, max_retries, base_delay, max_delay, deadline_at)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
 
     return None, last_error
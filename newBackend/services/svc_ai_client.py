@@ -1,132 +1,358 @@
 import requests
+import httpx
 import json
+import time
+from email.utils import parsedate_to_datetime
 from newBackend.core.core_settings import GROQ_KEY, GROQ_URL, GROQ_MODEL, GROQ_FALLBACKS, OPENAI_KEY, OPENAI_URL, OPENAI_MODEL
+from newBackend.services.svc_http_pool import get_async_client, get_sync_client, provider_timeout
+from newBackend.services.svc_llm_cache import get_llm_cache, llm_cache_key
+from newBackend.services.svc_llm_limiter import get_llm_scheduler, llm_lane
+from newBackend.services.svc_groq_model_health import create_model_health
+from backend.llm_singleflight import get_single_flight
 
-def chat_text(messages: list[dict]) -> str:
-    """Call Groq API for text responses with model fallback logic"""
-    headers = {
+# Tutte le chiamate passano dai client condivisi di svc_http_pool (keep-alive, pool, timeout per provider).
+# Versioni async (achat_text / achat_json) per gli endpoint async, con la stessa logica di fallback.
+# astream_chat usa lo streaming del provider ("stream": true) per gli endpoint SSE.
+
+_GROQ_TEXT_BUILTINS = ["llama-3.1-70b-instruct", "llama-3.1-8b-instant", "llama-3.1-405b-instruct"]
+_GROQ_JSON_BUILTINS = ["llama-3.1-70b-instruct", "llama-3.1-8b-instant"]
+_JSON_FORMAT = {"type": "json_object"}
+
+# Richieste identiche in corso condividono una sola chiamata upstream (vedi backend/llm_singleflight)
+_flight = get_single_flight("svc_ai_client")
+
+class LlmHTTPError(requests.HTTPError):
+    """requests.HTTPError con status e Retry-After del provider (usati dalla classificazione dei retry)"""
+
+    def __init__(self, message: str, status_code: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def _retry_after(resp):
+    """Header Retry-After in secondi (numero o data HTTP), None se assente"""
+    raw = (resp.headers.get("retry-after") or "").strip()
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(raw).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _groq_headers() -> dict:
+    return {
         "Authorization": f"Bearer {GROQ_KEY}",
         "Content-Type": "application/json"
     }
 
-    # Build candidate model list
-    builtins = ["llama-3.1-70b-instruct", "llama-3.1-8b-instant", "llama-3.1-405b-instruct"]
+def _groq_models(builtins: list) -> list:
+    """Build candidate model list"""
     models_to_try = []
     for m in [GROQ_MODEL, *GROQ_FALLBACKS, *builtins]:
         if m and m not in models_to_try:
             models_to_try.append(m)
+    return models_to_try
 
-    last_error = None
-    for model in models_to_try:
-        data = {"model": model, "messages": messages}
-        resp = requests.post(GROQ_URL, headers=headers, json=data)
+def _groq_payload(model: str, messages: list[dict], json_mode: bool) -> dict:
+    data = {"model": model, "messages": messages}
+    if json_mode:
+        data["response_format"] = {"type": "json_object"}
+    return data
 
-        try:
+def _is_model_error(txt: str, json_mode: bool = True) -> bool:
+    """Errore che riguarda il modello (decommissioned/invalid/not found): si passa al successivo"""
+    markers = ("decommissioned", "invalid", "not found") if json_mode else ("decommissioned", "invalid")
+    return "model" in txt.lower() and any(m in txt.lower() for m in markers)
+
+def _probe_groq_model(model: str):
+    """Richiesta minima per il probe della tabella di salute: True/False, None se incerto"""
+    with llm_lane("groq-model-probe"), get_llm_scheduler().acquire("groq", model, []):
+        resp = get_sync_client().post(GROQ_URL, headers=_groq_headers(), timeout=provider_timeout("groq"), json={
+            "model": model,
+            "messages": [{"role": "user", "content": "ping"}],
+            "max_tokens": 1
+        })
+    if resp.status_code < 400:
+        return True
+    return False if _is_model_error(resp.text or "") else None
+
+# Modelli Groq decommissioned/invalid saltati per un TTL (vedi svc_groq_model_health)
+_model_health = create_model_health(_probe_groq_model)
+
+def _groq_result(resp, model: str, messages: list[dict], json_mode: bool):
+    """
+    Interpreta la risposta Groq: (content, None) se ok, (None, errore) se il modello
+    va saltato (decommissioned/invalid), altrimenti solleva requests.HTTPError.
+    """
+    try:
+        if json_mode:
+            print(f"[GROQ][REQ][json] model={model} messages={len(messages)}")
+        else:
             print(f"[GROQ][REQ] model={model} url={GROQ_URL} messages={len(messages)}")
-            print(f"[GROQ][RES] status={resp.status_code} body_snippet={(resp.text or '')[:280]!r}")
-        except Exception:
-            pass
-
-        if resp.status_code >= 400:
-            txt = resp.text or ""
-            if "model" in txt.lower() and ("decommissioned" in txt.lower() or "invalid" in txt.lower()):
-                last_error = f"Groq API error {resp.status_code}: {txt}"
-                try:
-                    print("[GROQ][FALLBACK] switching model due to error -> trying next")
-                except Exception:
-                    pass
-                continue
-            raise requests.HTTPError(f"Groq API error {resp.status_code}: {txt}")
+        print(f"[GROQ][RES] status={resp.status_code} body_snippet={(resp.text or '')[:280]!r}")
+    except Exception:
+        pass
 
-        try:
-            j = resp.json()
-        except Exception:
-            raise requests.HTTPError(f"Groq API: invalid JSON response: {(resp.text or '')[:200]}")
+    if resp.status_code >= 400:
+        txt = resp.text or ""
+        if _is_model_error(txt, json_mode):
+            try:
+                print("[GROQ][FALLBACK] switching model due to error -> trying next")
+            except Exception:
+                pass
+            _model_health.mark_unhealthy(model, txt)
+            return None, f"Groq API error {resp.status_code}: {txt}"
+        # No fallback - raise error immediately
+        raise LlmHTTPError(f"Groq API error {resp.status_code}: {txt}", resp.status_code, _retry_after(resp))
+
+    try:
+        j = resp.json()
+    except Exception:
+        raise requests.HTTPError(f"Groq API: invalid JSON response: {(resp.text or '')[:200]}")
+
+    _model_health.mark_healthy(model)
+    return j.get("choices", [{}])[0].get("message", {}).get("content", ""), None
+
+def _groq_chat(messages: list[dict], json_mode: bool) -> str:
+    """Call Groq API with model fallback logic"""
+    client = get_sync_client()
+    last_error = None
+    for model in _model_health.order(_groq_models(_GROQ_JSON_BUILTINS if json_mode else _GROQ_TEXT_BUILTINS)):
+        # Permesso dallo scheduler (concorrenza + rpm/tpm di config/llmLimits.json)
+        with get_llm_scheduler().acquire("groq", model, messages):
+            try:
+                resp = client.post(GROQ_URL, headers=_groq_headers(), json=_groq_payload(model, messages, json_mode),
+                                   timeout=provider_timeout("groq"))
+            except httpx.HTTPError as e:
+                raise requests.HTTPError(f"Groq API connection error: {str(e)}") from e
+        content, last_error = _groq_result(resp, model, messages, json_mode)
+        if content is not None:
+            return content
+
+    raise requests.HTTPError(last_error or "Groq API: all model candidates failed")
 
-        return j.get("choices", [{}])[0].get("message", {}).get("content", "")
+async def _agroq_chat(messages: list[dict], json_mode: bool) -> str:
+    client = get_async_client()
+    last_error = None
+    for model in _model_health.order(_groq_models(_GROQ_JSON_BUILTINS if json_mode else _GROQ_TEXT_BUILTINS)):
+        with await get_llm_scheduler().aacquire("groq", model, messages):
+            try:
+                resp = await client.post(GROQ_URL, headers=_groq_headers(), json=_groq_payload(model, messages, json_mode),
+                                         timeout=provider_timeout("groq"))
+            except httpx.HTTPError as e:
+                raise requests.HTTPError(f"Groq API connection error: {str(e)}") from e
+        content, last_error = _groq_result(resp, model, messages, json_mode)
+        if content is not None:
+            return content
 
     raise requests.HTTPError(last_error or "Groq API: all model candidates failed")
 
-def chat_json(messages: list[dict], provider: str = "groq") -> dict:
-    """Call AI API for JSON responses with configurable provider"""
+def _openai_request(messages: list[dict]) -> tuple:
+    if not OPENAI_KEY:
+        raise ValueError("OpenAI API key not configured. Set OPENAI_KEY environment variable.")
 
-    if provider == "openai":
-        # OpenAI implementation
-        if not OPENAI_KEY:
-            raise ValueError("OpenAI API key not configured. Set OPENAI_KEY environment variable.")
-
-        headers = {
-            "Authorization": f"Bearer {OPENAI_KEY}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "model": OPENAI_MODEL,
-            "messages": messages,
-            "response_format": {"type": "json_object"}
-        }
+    headers = {
+        "Authorization": f"Bearer {OPENAI_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": OPENAI_MODEL,
+        "messages": messages,
+        "response_format": {"type": "json_object"}
+    }
+    print(f"[OPENAI][REQ] model={OPENAI_MODEL} url={OPENAI_URL} messages={len(messages)}")
+    return headers, payload
 
+def _openai_result(resp) -> str:
+    print(f"[OPENAI][RES] status={resp.status_code} body_snippet={(resp.text or '')[:280]!r}")
+    if resp.status_code >= 400:
         try:
-            print(f"[OPENAI][REQ] model={OPENAI_MODEL} url={OPENAI_URL} messages={len(messages)}")
-            resp = requests.post(OPENAI_URL, headers=headers, json=payload, timeout=45)
-            print(f"[OPENAI][RES] status={resp.status_code} body_snippet={(resp.text or '')[:280]!r}")
-        except Exception as e:
-            raise requests.HTTPError(f"OpenAI API connection error: {str(e)}")
+            detail = resp.json()
+        except Exception:
+            detail = resp.text
+        raise LlmHTTPError(f"OpenAI API error {resp.status_code}: {detail}", resp.status_code, _retry_after(resp))
 
-        if resp.status_code >= 400:
-            try:
-                detail = resp.json()
-            except Exception:
-                detail = resp.text
-            raise requests.HTTPError(f"OpenAI API error {resp.status_code}: {detail}")
+    data = resp.json()
+    return data.get("choices", [{}])[0].get("message", {}).get("content", "")
 
-        data = resp.json()
-        return data.get("choices", [{}])[0].get("message", {}).get("content", "")
+def _request_key(provider: str, messages: list[dict], json_mode: bool) -> str:
+    """Chiave di una richiesta: usata per la cache risposte e per il coalescing"""
+    if provider == "openai":
+        model = OPENAI_MODEL
+    else:
+        model = ",".join(_groq_models(_GROQ_JSON_BUILTINS if json_mode else _GROQ_TEXT_BUILTINS))
+    return llm_cache_key(provider, model, messages, _JSON_FORMAT if json_mode else None)
 
-    elif provider == "groq":
-        # Groq implementation (existing logic)
-        headers = {
-            "Authorization": f"Bearer {GROQ_KEY}",
-            "Content-Type": "application/json"
-        }
-
-        # Build candidate model list
-        builtins = ["llama-3.1-70b-instruct", "llama-3.1-8b-instant"]
-        models_to_try = []
-        for m in [GROQ_MODEL, *GROQ_FALLBACKS, *builtins]:
-            if m and m not in models_to_try:
-                models_to_try.append(m)
-
-        last_error = None
-        for model in models_to_try:
-            data = {"model": model, "messages": messages, "response_format": {"type": "json_object"}}
-            resp = requests.post(GROQ_URL, headers=headers, json=data)
+def chat_text(messages: list[dict], use_cache: bool = True) -> str:
+    """Call Groq API for text responses with model fallback logic"""
+    cache = get_llm_cache()
+    key = _request_key("groq", messages, False)
+    cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        return cached
+    content = _flight.do(key, _groq_chat, messages, json_mode=False)
+    if use_cache:
+        cache.put(key, content)
+    return content
+
+def chat_json(messages: list[dict], provider: str = "groq", use_cache: bool = True) -> dict:
+    """
+    Call AI API for JSON responses with configurable provider.
+    use_cache=False salta la cache risposte (OMNIA_LLM_CACHE) per questa richiesta.
+    """
+    cache = get_llm_cache()
+    key = _request_key(provider, messages, True)
+    cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        return cached
+    content = _flight.do(key, _chat_json, messages, provider)
+    if use_cache:
+        cache.put(key, content)
+    return content
 
+def _chat_json(messages: list[dict], provider: str) -> dict:
+    if provider == "openai":
+        headers, payload = _openai_request(messages)
+        with get_llm_scheduler().acquire("openai", OPENAI_MODEL, messages):
             try:
-                print(f"[GROQ][REQ][json] model={model} messages={len(messages)}")
-                print(f"[GROQ][RES] status={resp.status_code} body_snippet={(resp.text or '')[:280]!r}")
-            except Exception:
-                pass
+                resp = get_sync_client().post(OPENAI_URL, headers=headers, json=payload, timeout=provider_timeout("openai"))
+            except Exception as e:
+                raise requests.HTTPError(f"OpenAI API connection error: {str(e)}") from e
+        return _openai_result(resp)
 
-            if resp.status_code >= 400:
-                txt = resp.text or ""
-                if "model" in txt.lower() and ("decommissioned" in txt.lower() or "invalid" in txt.lower() or "not found" in txt.lower()):
-                    last_error = f"Groq API error {resp.status_code}: {txt}"
-                    try:
-                        print("[GROQ][FALLBACK] switching model due to error -> trying next")
-                    except Exception:
-                        pass
-                    continue
-                # No fallback - raise error immediately
-                raise requests.HTTPError(f"Groq API error {resp.status_code}: {txt}")
+    elif provider == "groq":
+        return _groq_chat(messages, json_mode=True)
 
-            try:
-                j = resp.json()
-            except Exception:
-                raise requests.HTTPError(f"Groq API: invalid JSON response: {(resp.text or '')[:200]}")
+    else:
+        raise ValueError(f"Unsupported provider: {provider}")
 
-            return j.get("choices", [{}])[0].get("message", {}).get("content", "")
+async def achat_text(messages: list[dict], use_cache: bool = True) -> str:
+    """Versione async di chat_text (AsyncClient condiviso, non blocca l'event loop)"""
+    cache = get_llm_cache()
+    key = _request_key("groq", messages, False)
+    cached = await cache.aget(key) if use_cache else None
+    if cached is not None:
+        return cached
+    content = await _flight.ado(key, _agroq_chat, messages, json_mode=False)
+    if use_cache:
+        await cache.aput(key, content)
+    return content
 
-        raise requests.HTTPError(last_error or "Groq API: all model candidates failed")
+async def achat_json(messages: list[dict], provider: str = "groq", use_cache: bool = True) -> dict:
+    """Versione async di chat_json"""
+    cache = get_llm_cache()
+    key = _request_key(provider, messages, True)
+    cached = await cache.aget(key) if use_cache else None
+    if cached is not None:
+        return cached
+    content = await _flight.ado(key, _achat_json, messages, provider)
+    if use_cache:
+        await cache.aput(key, content)
+    return content
+
+async def _achat_json(messages: list[dict], provider: str) -> dict:
+    if provider == "openai":
+        headers, payload = _openai_request(messages)
+        with await get_llm_scheduler().aacquire("openai", OPENAI_MODEL, messages):
+            try:
+                resp = await get_async_client().post(OPENAI_URL, headers=headers, json=payload, timeout=provider_timeout("openai"))
+            except Exception as e:
+                raise requests.HTTPError(f"OpenAI API connection error: {str(e)}") from e
+        return _openai_result(resp)
+
+    elif provider == "groq":
+        return await _agroq_chat(messages, json_mode=True)
 
     else:
         raise ValueError(f"Unsupported provider: {provider}")
+
+def _stream_delta(line: str):
+    """Contenuto di una riga SSE del provider ("data: {...}"); None se non porta testo, False a fine stream"""
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return False
+    try:
+        j = json.loads(data)
+    except ValueError:
+        return None
+    return (j.get("choices") or [{}])[0].get("delta", {}).get("content") or None
+
+async def _astream_response(resp):
+    async for line in resp.aiter_lines():
+        delta = _stream_delta(line)
+        if delta is False:
+            return
+        if delta:
+            yield delta
+
+async def _astream_openai(messages: list[dict], json_mode: bool):
+    headers, payload = _openai_request(messages)
+    if not json_mode:
+        payload.pop("response_format", None)
+    payload["stream"] = True
+    with await get_llm_scheduler().aacquire("openai", OPENAI_MODEL, messages):
+        try:
+            async with get_async_client().stream("POST", OPENAI_URL, headers=headers, json=payload,
+                                                 timeout=provider_timeout("openai")) as resp:
+                if resp.status_code >= 400:
+                    await resp.aread()
+                    _openai_result(resp)
+                async for delta in _astream_response(resp):
+                    yield delta
+        except httpx.HTTPError as e:
+            raise requests.HTTPError(f"OpenAI API connection error: {str(e)}") from e
+
+async def _astream_groq(messages: list[dict], json_mode: bool):
+    last_error = None
+    for model in _model_health.order(_groq_models(_GROQ_JSON_BUILTINS if json_mode else _GROQ_TEXT_BUILTINS)):
+        payload = _groq_payload(model, messages, json_mode)
+        payload["stream"] = True
+        with await get_llm_scheduler().aacquire("groq", model, messages):
+            try:
+                async with get_async_client().stream("POST", GROQ_URL, headers=_groq_headers(), json=payload,
+                                                     timeout=provider_timeout("groq")) as resp:
+                    if resp.status_code >= 400:
+                        await resp.aread()
+                        _, last_error = _groq_result(resp, model, messages, json_mode)
+                        continue
+                    print(f"[GROQ][REQ][stream] model={model} messages={len(messages)}")
+                    async for delta in _astream_response(resp):
+                        yield delta
+            except httpx.HTTPError as e:
+                raise requests.HTTPError(f"Groq API connection error: {str(e)}") from e
+        _model_health.mark_healthy(model)
+        return
+
+    raise requests.HTTPError(last_error or "Groq API: all model candidates failed")
+
+async def astream_chat(messages: list[dict], provider: str = "groq", json_mode: bool = True, use_cache: bool = True):
+    """
+    Async generator dei frammenti di testo della risposta (streaming del provider).
+    Il fallback di modello Groq avviene solo prima del primo frammento; a stream
+    completo la risposta va in cache, e un hit viene restituito in un solo frammento.
+    """
+    if provider not in ("groq", "openai"):
+        raise ValueError(f"Unsupported provider: {provider}")
+    cache = get_llm_cache()
+    key = _request_key(provider, messages, json_mode)
+    cached = await cache.aget(key) if use_cache else None
+    if cached is not None:
+        yield cached
+        return
+
+    stream = _astream_openai(messages, json_mode) if provider == "openai" else _astream_groq(messages, json_mode)
+    parts = []
+    async for delta in stream:
+        parts.append(delta)
+        yield delta
+    if use_cache:
+        await cache.aput(key, "".join(parts))
+
+def groq_model_health_stats() -> dict:
+    return _model_health.stats()
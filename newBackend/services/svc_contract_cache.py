@@ -0,0 +1,248 @@
+"""
+Cache in processo dei contratti dei task per test-extraction.
+
+Chiave: task id (campo ``id`` o ``_id``, come la query originale). Dal documento
+vengono letti solo i campi del contratto (projection), non l'intero task.
+
+Invalidazione:
+- TTL: OMNIA_CONTRACT_CACHE_TTL_SEC (default 300, 0 = cache disattivata)
+- esplicita: invalidate(task_id) / invalidate() e POST /api/task/{task_id}/contract-cache/invalidate
+- in background, secondo OMNIA_CONTRACT_CACHE_INVALIDATION:
+  - ``auto`` (default): change stream MongoDB su Tasks; se non disponibile
+    (es. server standalone senza replica set) si passa al polling
+  - ``watch``: solo change stream
+  - ``poll``: ogni OMNIA_CONTRACT_CACHE_POLL_SEC (default 5) una sola query sugli
+    _id in cache confronta updatedAt e scarta i contratti cambiati o cancellati
+  - ``ttl``: nessun thread, solo TTL e invalidazione esplicita
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SEC = 300.0
+DEFAULT_POLL_SEC = 5.0
+INVALIDATION_MODES = ("auto", "watch", "poll", "ttl")
+
+CONTRACT_FIELDS = ("dataContract", "semanticContract")
+PROJECTION = {"_id": 1, "id": 1, "updatedAt": 1, **{f: 1 for f in CONTRACT_FIELDS}}
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = float(raw)
+        return value if value >= 0 else default
+    except ValueError:
+        return default
+
+
+class _Entry:
+    __slots__ = ("doc_id", "contract", "updated_at", "expires")
+
+    def __init__(self, doc_id: Any, contract: Optional[Dict[str, Any]], updated_at: Any, expires: float) -> None:
+        self.doc_id = doc_id
+        self.contract = contract
+        self.updated_at = updated_at
+        self.expires = expires
+
+
+class ContractCache:
+    """
+    get(task_id) -> {"found": bool, "contract": dict | None}; il contratto restituito
+    è condiviso tra le richieste e va trattato come read-only.
+    """
+
+    def __init__(
+        self,
+        collection: Callable[[], Any],
+        ttl_sec: float = DEFAULT_TTL_SEC,
+        invalidation: str = "auto",
+        poll_sec: float = DEFAULT_POLL_SEC,
+    ) -> None:
+        self._collection = collection
+        self.ttl_sec = ttl_sec
+        self.invalidation = invalidation if invalidation in INVALIDATION_MODES else "auto"
+        self.poll_sec = poll_sec
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.active_invalidation = "ttl"
+        # Incrementata a ogni invalidazione: un fetch iniziato prima non viene salvato
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # ----------------------------------------------------------------- lookup
+
+    def _fetch(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return self._collection().find_one(
+            {"$or": [{"id": task_id}, {"_id": task_id}]},
+            projection=PROJECTION,
+        )
+
+    def get(self, task_id: str) -> Dict[str, Any]:
+        if self.ttl_sec <= 0:
+            doc = self._fetch(task_id)
+            return {"found": doc is not None, "contract": _contract_of(doc)}
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None and entry.expires > now:
+                self.hits += 1
+                return {"found": True, "contract": entry.contract}
+            self.misses += 1
+            generation = self._generation
+
+        self._ensure_watcher()
+        doc = self._fetch(task_id)
+        if doc is None:
+            # I task mancanti non vengono messi in cache (potrebbero essere appena creati)
+            with self._lock:
+                self._entries.pop(task_id, None)
+            return {"found": False, "contract": None}
+
+        contract = _contract_of(doc)
+        with self._lock:
+            # Un'invalidazione arrivata durante find_one può riguardare questo documento:
+            # il risultato viene restituito ma non salvato, la prossima get rilegge
+            if generation == self._generation:
+                self._entries[task_id] = _Entry(doc.get("_id"), contract, doc.get("updatedAt"), now + self.ttl_sec)
+        return {"found": True, "contract": contract}
+
+    # ----------------------------------------------------------- invalidation
+
+    def invalidate(self, task_id: Optional[str] = None) -> int:
+        """Scarta il contratto di un task (o tutti se task_id è None); ritorna quanti."""
+        with self._lock:
+            self._generation += 1
+            if task_id is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                removed = 0
+                # _id può essere un ObjectId: confronto come stringa, come _invalidate_doc_ids
+                for key in [k for k, e in self._entries.items() if k == task_id or str(e.doc_id) == task_id]:
+                    del self._entries[key]
+                    removed += 1
+            self.invalidations += removed
+        return removed
+
+    def _invalidate_doc_ids(self, doc_ids: List[Any]) -> None:
+        targets = set(map(str, doc_ids))
+        with self._lock:
+            self._generation += 1
+            for key in [k for k, e in self._entries.items() if str(e.doc_id) in targets]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def poll_once(self) -> None:
+        """Una query sugli _id in cache: scarta i contratti con updatedAt cambiato o cancellati."""
+        with self._lock:
+            cached = {str(e.doc_id): e.updated_at for e in self._entries.values()}
+            doc_ids = [e.doc_id for e in self._entries.values()]
+        if not doc_ids:
+            return
+        current = {
+            str(d.get("_id")): d.get("updatedAt")
+            for d in self._collection().find({"_id": {"$in": doc_ids}}, projection={"_id": 1, "updatedAt": 1})
+        }
+        stale = [doc_id for doc_id, updated in cached.items() if doc_id not in current or current[doc_id] != updated]
+        if stale:
+            self._invalidate_doc_ids(stale)
+
+    # --------------------------------------------------------------- watcher
+
+    def _ensure_watcher(self) -> None:
+        if self.invalidation == "ttl" or self._watcher is not None:
+            return
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch_loop, name="contract-cache-watch", daemon=True)
+            self._watcher.start()
+
+    def _watch_loop(self) -> None:
+        if self.invalidation in ("auto", "watch"):
+            try:
+                self.active_invalidation = "watch"
+                self._watch_changes()
+                return
+            except Exception as e:
+                logger.warning("[contract-cache] change stream unavailable: %s", e)
+                if self.invalidation == "watch":
+                    self.active_invalidation = "ttl"
+                    return
+        print(f"[CONTRACT_CACHE] Polling updatedAt every {self.poll_sec:.0f}s", flush=True)
+        self.active_invalidation = "poll"
+        while not self._stop.wait(self.poll_sec):
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.warning("[contract-cache] poll failed: %s", e)
+
+    def _watch_changes(self) -> None:
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        with self._collection().watch(pipeline) as stream:
+            print("[CONTRACT_CACHE] Watching Tasks change stream", flush=True)
+            for change in stream:
+                if self._stop.is_set():
+                    return
+                doc_id = (change.get("documentKey") or {}).get("_id")
+                if doc_id is not None:
+                    self._invalidate_doc_ids([doc_id])
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "ttlSec": self.ttl_sec,
+            "invalidation": self.active_invalidation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": (self.hits / lookups) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+def _contract_of(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not doc:
+        return None
+    # Frontend saves as "dataContract", fallback to "semanticContract"
+    return doc.get("dataContract") or doc.get("semanticContract")
+
+
+def _tasks_collection():
+    from newBackend.services.database_service import databaseService
+    return databaseService.db["Tasks"]
+
+
+_contract_cache: Optional[ContractCache] = None
+_contract_cache_lock = threading.Lock()
+
+
+def get_contract_cache() -> ContractCache:
+    global _contract_cache
+    with _contract_cache_lock:
+        if _contract_cache is None:
+            _contract_cache = ContractCache(
+                _tasks_collection,
+                ttl_sec=_env_float("OMNIA_CONTRACT_CACHE_TTL_SEC", DEFAULT_TTL_SEC),
+                invalidation=(os.environ.get("OMNIA_CONTRACT_CACHE_INVALIDATION") or "auto").strip().lower(),
+                poll_sec=_env_float("OMNIA_CONTRACT_CACHE_POLL_SEC", DEFAULT_POLL_SEC) or DEFAULT_POLL_SEC,
+            )
+        return _contract_cache
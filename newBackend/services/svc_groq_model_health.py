@@ -0,0 +1,142 @@
+"""
+Tabella di salute dei modelli Groq condivisa dal processo.
+
+Un modello che risponde decommissioned / invalid / not found viene saltato per
+OMNIA_GROQ_MODEL_SKIP_TTL_SEC: le chiamate successive partono direttamente dal
+primo modello sano invece di pagare ogni volta un round-trip fallito.
+Un thread in background (ogni OMNIA_GROQ_MODEL_PROBE_INTERVAL_SEC) riprova i
+modelli marcati con una richiesta minima e li riabilita se rispondono.
+Se tutti i candidati sono marcati vengono comunque provati, in coda.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SKIP_TTL_SEC = 600.0
+DEFAULT_PROBE_INTERVAL_SEC = 300.0
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = float(raw)
+        return value if value >= 0 else default
+    except ValueError:
+        return default
+
+
+class ModelHealth:
+    """
+    probe(model) -> True (sano), False (ancora non valido) o None (esito incerto,
+    es. rate limit): usato dal thread di probe; None disattiva il probe.
+    """
+
+    def __init__(
+        self,
+        skip_ttl_sec: float = DEFAULT_SKIP_TTL_SEC,
+        probe_interval_sec: float = DEFAULT_PROBE_INTERVAL_SEC,
+        probe: Optional[Callable[[str], Optional[bool]]] = None,
+    ) -> None:
+        self.skip_ttl_sec = skip_ttl_sec
+        self.probe_interval_sec = probe_interval_sec
+        self.probe = probe
+        self._lock = threading.Lock()
+        # model -> {"until": monotonic, "reason": str, "failures": int}
+        self._unhealthy: Dict[str, Dict[str, Any]] = {}
+        self._probe_thread: Optional[threading.Thread] = None
+        self.skipped = 0
+
+    def order(self, models: List[str]) -> List[str]:
+        """Candidati sani nell'ordine configurato, poi quelli marcati (ultima risorsa)."""
+        now = time.monotonic()
+        with self._lock:
+            healthy, marked = [], []
+            for m in models:
+                entry = self._unhealthy.get(m)
+                if entry is not None and entry["until"] <= now:
+                    del self._unhealthy[m]
+                    entry = None
+                (healthy if entry is None else marked).append(m)
+            self.skipped += len(marked)
+        return healthy + marked
+
+    def mark_unhealthy(self, model: str, reason: str) -> None:
+        with self._lock:
+            entry = self._unhealthy.setdefault(model, {"failures": 0})
+            entry["failures"] += 1
+            entry["reason"] = (reason or "")[:200]
+            entry["until"] = time.monotonic() + self.skip_ttl_sec
+        print(f"[GROQ][HEALTH] model={model} skipped for {self.skip_ttl_sec:.0f}s")
+        self._ensure_probe()
+
+    def mark_healthy(self, model: str) -> None:
+        if model not in self._unhealthy:
+            return
+        with self._lock:
+            self._unhealthy.pop(model, None)
+
+    def _marked(self) -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            return [m for m, e in self._unhealthy.items() if e["until"] > now]
+
+    # ----------------------------------------------------------------- probe
+
+    def _ensure_probe(self) -> None:
+        if self.probe is None or self.probe_interval_sec <= 0:
+            return
+        with self._lock:
+            if self._probe_thread is not None and self._probe_thread.is_alive():
+                return
+            self._probe_thread = threading.Thread(target=self._probe_loop, name="groq-model-probe", daemon=True)
+            self._probe_thread.start()
+
+    def _probe_loop(self) -> None:
+        while True:
+            time.sleep(self.probe_interval_sec)
+            if not self.probe_once():
+                return
+
+    def probe_once(self) -> bool:
+        """Riprova i modelli marcati; ritorna False quando non ne restano (il thread termina)."""
+        for model in self._marked():
+            try:
+                ok = self.probe(model)
+            except Exception as e:
+                logger.warning("[groq-health] probe %s failed: %s", model, e)
+                ok = None
+            if ok:
+                self.mark_healthy(model)
+                print(f"[GROQ][HEALTH] model={model} healthy again")
+            elif ok is False:
+                with self._lock:
+                    entry = self._unhealthy.get(model)
+                    if entry is not None:
+                        entry["until"] = time.monotonic() + self.skip_ttl_sec
+        return bool(self._marked())
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "skipped": self.skipped,
+                "unhealthy": {
+                    m: {"reason": e["reason"], "failures": e["failures"], "skipForSec": round(max(0.0, e["until"] - now), 1)}
+                    for m, e in self._unhealthy.items()
+                },
+            }
+
+
+def create_model_health(probe: Optional[Callable[[str], Optional[bool]]] = None) -> ModelHealth:
+    return ModelHealth(
+        skip_ttl_sec=_env_float("OMNIA_GROQ_MODEL_SKIP_TTL_SEC", DEFAULT_SKIP_TTL_SEC),
+        probe_interval_sec=_env_float("OMNIA_GROQ_MODEL_PROBE_INTERVAL_SEC", DEFAULT_PROBE_INTERVAL_SEC),
+        probe=probe,
+    )
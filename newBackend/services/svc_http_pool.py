@@ -0,0 +1,97 @@
+"""
+Client HTTP condivisi per le chiamate LLM (Groq / OpenAI).
+
+Un solo httpx.Client (sync, thread-safe) e un httpx.AsyncClient per processo,
+con keep-alive e pool di connessioni limitato: le chiamate successive riusano
+la connessione TLS invece di rifare handshake ad ogni richiesta.
+HTTP/2 viene attivato solo se il pacchetto ``h2`` è installato.
+
+Configurazione:
+- OMNIA_LLM_TIMEOUT_GROQ / OMNIA_LLM_TIMEOUT_OPENAI: timeout di lettura per provider (secondi)
+- OMNIA_LLM_CONNECT_TIMEOUT: timeout di connessione (secondi)
+- OMNIA_LLM_MAX_CONNECTIONS / OMNIA_LLM_MAX_KEEPALIVE: limiti del pool
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    _http2_available = True
+except ImportError:
+    _http2_available = False
+
+DEFAULT_TIMEOUTS = {"groq": 60.0, "openai": 45.0}
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE = 10
+
+_lock = threading.Lock()
+_sync_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = float(raw)
+        return value if value > 0 else default
+    except ValueError:
+        return default
+
+
+def provider_timeout(provider: str) -> httpx.Timeout:
+    """Timeout per provider: lettura da OMNIA_LLM_TIMEOUT_<PROVIDER>, connessione condivisa."""
+    read = _env_float(f"OMNIA_LLM_TIMEOUT_{provider.upper()}", DEFAULT_TIMEOUTS.get(provider, 60.0))
+    return httpx.Timeout(read, connect=_env_float("OMNIA_LLM_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT))
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(_env_float("OMNIA_LLM_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)),
+        max_keepalive_connections=int(_env_float("OMNIA_LLM_MAX_KEEPALIVE", DEFAULT_MAX_KEEPALIVE)),
+    )
+
+
+def get_sync_client() -> httpx.Client:
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            _sync_client = httpx.Client(http2=_http2_available, limits=_limits())
+        return _sync_client
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    AsyncClient del processo, legato all'event loop corrente: uvicorn ne ha uno
+    per worker; un loop diverso (es. test client) riceve un client nuovo.
+    """
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if _async_client is None or _async_loop is not loop:
+            _async_client = httpx.AsyncClient(http2=_http2_available, limits=_limits())
+            _async_loop = loop
+        return _async_client
+
+
+async def aclose_clients() -> None:
+    """Chiude i client condivisi (shutdown FastAPI)."""
+    global _sync_client, _async_client, _async_loop
+    with _lock:
+        sync_client, _sync_client = _sync_client, None
+        async_client, _async_client = _async_client, None
+        same_loop = _async_loop is asyncio.get_running_loop()
+        _async_loop = None
+    if sync_client is not None:
+        sync_client.close()
+    if async_client is not None and same_loop:
+        await async_client.aclose()
+
@@ -0,0 +1,225 @@
+"""
+Cache opzionale delle risposte LLM, indirizzata per contenuto.
+
+Chiave: sha256 di (provider, modello, messages, response_format); lo stesso
+prompt byte-per-byte (es. l'utente che torna indietro nel wizard) viene servito
+dalla cache senza richiamare Groq/OpenAI. Solo le risposte riuscite e non vuote
+vengono salvate.
+
+OMNIA_LLM_CACHE:
+- ``off`` (default): nessuna cache
+- ``memory``: LRU in processo (OMNIA_LLM_CACHE_MAX_ENTRIES)
+- ``redis``: LRU in processo + Redis condiviso tra worker (OMNIA_LLM_CACHE_REDIS_URL)
+
+Scadenza: OMNIA_LLM_CACHE_TTL_SEC. Se Redis non è raggiungibile la cache
+continua a funzionare solo in memoria.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import redis
+    _redis_available = True
+except ImportError:
+    redis = None
+    _redis_available = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SEC = 3600.0
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_REDIS_URL = "redis://localhost:6379/0"
+DEFAULT_REDIS_PREFIX = "omnia:llm:"
+
+# Dopo un errore Redis il tier remoto viene saltato per questo intervallo
+_REDIS_RETRY_SEC = 30.0
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = float(raw)
+        return value if value >= 0 else default
+    except ValueError:
+        return default
+
+
+def llm_cache_key(provider: str, model: str, messages: List[Dict[str, Any]], response_format: Any = None) -> str:
+    payload = json.dumps(
+        {"provider": provider, "model": model, "messages": messages, "response_format": response_format},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LlmResponseCache:
+    def __init__(
+        self,
+        mode: str = "off",
+        ttl_sec: float = DEFAULT_TTL_SEC,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        redis_url: str = DEFAULT_REDIS_URL,
+        redis_prefix: str = DEFAULT_REDIS_PREFIX,
+    ) -> None:
+        self.mode = mode if mode in ("memory", "redis") else "off"
+        self.ttl_sec = float(ttl_sec)
+        self.max_entries = max(1, int(max_entries))
+        self.redis_url = redis_url
+        self.redis_prefix = redis_prefix
+        self._lock = threading.Lock()
+        # key -> (content, expires_at)
+        self._items: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._redis = None
+        self._redis_down_until = 0.0
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    # ---------------------------------------------------------------- memory
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            content, expires_at = item
+            if expires_at and expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return content
+
+    def _memory_put(self, key: str, content: str) -> None:
+        expires_at = time.monotonic() + self.ttl_sec if self.ttl_sec > 0 else 0.0
+        with self._lock:
+            self._items[key] = (content, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    # ----------------------------------------------------------------- redis
+
+    def _redis_client(self):
+        if self.mode != "redis" or not _redis_available or time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(
+                self.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5, decode_responses=True
+            )
+        return self._redis
+
+    def _redis_failed(self, e: Exception) -> None:
+        self.redis_errors += 1
+        self._redis_down_until = time.monotonic() + _REDIS_RETRY_SEC
+        logger.warning("[llm-cache] redis unavailable, memory only for %ss: %s", _REDIS_RETRY_SEC, e)
+
+    def _redis_get(self, key: str) -> Optional[str]:
+        client = self._redis_client()
+        if client is None:
+            return None
+        try:
+            return client.get(self.redis_prefix + key)
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+
+    def _redis_put(self, key: str, content: str) -> None:
+        client = self._redis_client()
+        if client is None:
+            return
+        try:
+            ex = int(max(1, self.ttl_sec)) if self.ttl_sec > 0 else None
+            client.set(self.redis_prefix + key, content, ex=ex)
+        except Exception as e:
+            self._redis_failed(e)
+
+    # ------------------------------------------------------------------- api
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        content = self._memory_get(key)
+        if content is not None:
+            self.memory_hits += 1
+            return content
+        content = self._redis_get(key)
+        if content is not None:
+            self.redis_hits += 1
+            self._memory_put(key, content)
+            return content
+        self.misses += 1
+        return None
+
+    def put(self, key: str, content: Any) -> None:
+        if not self.enabled or not isinstance(content, str) or not content:
+            return
+        self._memory_put(key, content)
+        self._redis_put(key, content)
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Come get, ma il round-trip Redis gira in un thread (non blocca l'event loop)."""
+        if self.mode != "redis":
+            return self.get(key)
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, key)
+
+    async def aput(self, key: str, content: Any) -> None:
+        if self.mode != "redis":
+            return self.put(key, content)
+        await asyncio.get_running_loop().run_in_executor(None, self.put, key, content)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = len(self._items)
+        hits = self.memory_hits + self.redis_hits
+        lookups = hits + self.misses
+        return {
+            "mode": self.mode,
+            "entries": entries,
+            "ttlSec": self.ttl_sec,
+            "memoryHits": self.memory_hits,
+            "redisHits": self.redis_hits,
+            "misses": self.misses,
+            "redisErrors": self.redis_errors,
+            "hitRate": (hits / lookups) if lookups else 0.0,
+        }
+
+
+def create_llm_cache() -> LlmResponseCache:
+    return LlmResponseCache(
+        mode=(os.environ.get("OMNIA_LLM_CACHE") or "off").strip().lower(),
+        ttl_sec=_env_float("OMNIA_LLM_CACHE_TTL_SEC", DEFAULT_TTL_SEC),
+        max_entries=int(_env_float("OMNIA_LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+        redis_url=os.environ.get("OMNIA_LLM_CACHE_REDIS_URL") or DEFAULT_REDIS_URL,
+        redis_prefix=os.environ.get("OMNIA_LLM_CACHE_REDIS_PREFIX") or DEFAULT_REDIS_PREFIX,
+    )
+
+
+_llm_cache: Optional[LlmResponseCache] = None
+
+
+def get_llm_cache() -> LlmResponseCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = create_llm_cache()
+    return _llm_cache
@@ -0,0 +1,353 @@
+"""
+Scheduler lato client per le chiamate LLM: limiti di concorrenza e token bucket.
+
+Per provider e (opzionalmente) per modello:
+- ``maxConcurrency``: richieste contemporanee
+- ``rpm``: richieste al minuto (token bucket, burst = rpm)
+- ``tpm``: token al minuto, stimati dal prompt (~4 caratteri per token) più
+  ``outputTokens`` di margine per la risposta
+
+Le quote vengono lette da OMNIA_LLM_LIMITS_FILE (default config/llmLimits.json);
+un provider senza quote non viene limitato. Le richieste in attesa sono in coda
+per "lane" (di default il template della route, vedi route_llm_lane) e servite a turno
+tra le lane: una raffica di plan_engines non affama generate_node_messages.
+Se un permesso non arriva entro OMNIA_LLM_QUEUE_TIMEOUT_SEC la chiamata fallisce
+con requests.HTTPError, come un errore del provider.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+import requests
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "config", "llmLimits.json")
+DEFAULT_QUEUE_TIMEOUT_SEC = 60.0
+DEFAULT_OUTPUT_TOKENS = 500
+
+_CHARS_PER_TOKEN = 4
+_MAX_POLL_SEC = 0.05
+
+_current_lane: contextvars.ContextVar[str] = contextvars.ContextVar("llm_lane", default="default")
+
+
+@contextmanager
+def llm_lane(name: str) -> Iterator[None]:
+    """Assegna le chiamate LLM del contesto corrente a una lane della coda (es. l'endpoint)."""
+    token = _current_lane.set(name)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def set_llm_lane(name: str) -> None:
+    _current_lane.set(name)
+
+
+async def route_llm_lane(request: Request) -> None:
+    """
+    Dipendenza FastAPI: lane = template della route ("/api/task/{task_id}/test-extraction"),
+    non il path con gli id, così una lane è un endpoint. Async: la ContextVar resta nel
+    contesto della richiesta e passa agli endpoint def (threadpool) e ai loro worker.
+    """
+    route = request.scope.get("route")
+    _current_lane.set(getattr(route, "path", None) or request.url.path)
+
+
+_T = TypeVar("_T")
+
+
+def bind_llm_lane(fn: Callable[..., _T]) -> Callable[..., _T]:
+    """
+    fn con la lane del chiamante, per eseguirla su un altro thread (ThreadPoolExecutor):
+    le ContextVar non passano ai worker e la chiamata finirebbe nella lane "default".
+    """
+    lane = _current_lane.get()
+
+    def run(*args: Any, **kwargs: Any) -> _T:
+        with llm_lane(lane):
+            return fn(*args, **kwargs)
+
+    return run
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], output_tokens: int = DEFAULT_OUTPUT_TOKENS) -> int:
+    chars = sum(len(str(m.get("content") or "")) for m in messages if isinstance(m, dict))
+    return chars // _CHARS_PER_TOKEN + output_tokens
+
+
+class TokenBucket:
+    """Bucket con capacità = quota al minuto, ricarica continua."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """0 se amount è disponibile, altrimenti i secondi stimati di attesa."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def take(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Quota:
+    def __init__(self, name: str, conf: Dict[str, Any]) -> None:
+        self.name = name
+        self.max_concurrency = int(conf.get("maxConcurrency") or 0)
+        self.requests = TokenBucket(conf["rpm"]) if conf.get("rpm") else None
+        self.tokens = TokenBucket(conf["tpm"]) if conf.get("tpm") else None
+        self.active = 0
+        self.granted = 0
+        self.throttled = 0
+
+    def wait_time(self, tokens: int, now: float) -> Optional[float]:
+        """None = bloccato dalla concorrenza (si libera con un release), altrimenti secondi di attesa."""
+        if self.max_concurrency and self.active >= self.max_concurrency:
+            return None
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def take(self, tokens: int) -> None:
+        self.active += 1
+        self.granted += 1
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "maxConcurrency": self.max_concurrency,
+            "granted": self.granted,
+            "throttled": self.throttled,
+            "rpmAvailable": round(self.requests.tokens, 1) if self.requests else None,
+            "tpmAvailable": round(self.tokens.tokens, 1) if self.tokens else None,
+        }
+
+
+class _Ticket:
+    __slots__ = ("quotas", "tokens", "lane", "granted")
+
+    def __init__(self, quotas: List[_Quota], tokens: int, lane: str) -> None:
+        self.quotas = quotas
+        self.tokens = tokens
+        self.lane = lane
+        self.granted = False
+
+
+class Permit:
+    def __init__(self, scheduler: "LlmScheduler", quotas: List[_Quota]) -> None:
+        self._scheduler = scheduler
+        self._quotas = quotas
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self._quotas)
+
+    def __enter__(self) -> "Permit":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+
+class LlmScheduler:
+    def __init__(self, limits: Dict[str, Any], queue_timeout: float = DEFAULT_QUEUE_TIMEOUT_SEC) -> None:
+        self.queue_timeout = queue_timeout
+        self.output_tokens = int(limits.get("outputTokens") or DEFAULT_OUTPUT_TOKENS)
+        self._cond = threading.Condition()
+        self._providers: Dict[str, _Quota] = {}
+        self._models: Dict[Tuple[str, str], _Quota] = {}
+        for provider, conf in limits.items():
+            if not isinstance(conf, dict):
+                continue
+            self._providers[provider] = _Quota(provider, conf)
+            for model, model_conf in (conf.get("models") or {}).items():
+                self._models[(provider, model)] = _Quota(f"{provider}/{model}", model_conf)
+        # lane -> ticket in attesa (FIFO); l'ordine delle lane è il turno round-robin
+        self._lanes: "OrderedDict[str, Deque[_Ticket]]" = OrderedDict()
+
+    def _quotas_for(self, provider: str, model: Optional[str]) -> List[_Quota]:
+        quotas = []
+        if provider in self._providers:
+            quotas.append(self._providers[provider])
+        if model and (provider, model) in self._models:
+            quotas.append(self._models[(provider, model)])
+        return quotas
+
+    # --------------------------------------------------------------- dispatch
+
+    def _dispatch_locked(self) -> float:
+        """Assegna permessi alle teste delle lane a turno; ritorna l'attesa minima per i bucket."""
+        next_wait = _MAX_POLL_SEC
+        granted_any = False
+        progress = True
+        while progress and self._lanes:
+            progress = False
+            for lane in list(self._lanes.keys()):
+                queue = self._lanes[lane]
+                ticket = queue[0]
+                now = time.monotonic()
+                waits = [q.wait_time(ticket.tokens, now) for q in ticket.quotas]
+                if any(w is None for w in waits):
+                    continue
+                wait = max(waits, default=0.0)
+                if wait > 0:
+                    next_wait = min(next_wait, wait)
+                    continue
+                for q in ticket.quotas:
+                    q.take(ticket.tokens)
+                ticket.granted = True
+                queue.popleft()
+                # La lane servita passa in fondo al turno
+                del self._lanes[lane]
+                if queue:
+                    self._lanes[lane] = queue
+                progress = granted_any = True
+                break
+        if granted_any:
+            self._cond.notify_all()
+        return next_wait
+
+    def _enqueue(self, provider: str, model: Optional[str], messages: List[Dict[str, Any]]) -> Optional[_Ticket]:
+        quotas = self._quotas_for(provider, model)
+        if not quotas:
+            return None
+        ticket = _Ticket(quotas, estimate_tokens(messages, self.output_tokens), _current_lane.get())
+        with self._cond:
+            self._lanes.setdefault(ticket.lane, deque()).append(ticket)
+            self._dispatch_locked()
+            if not ticket.granted:
+                for q in quotas:
+                    q.throttled += 1
+        return ticket
+
+    def _abandon(self, ticket: _Ticket) -> None:
+        with self._cond:
+            queue = self._lanes.get(ticket.lane)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._lanes[ticket.lane]
+            elif ticket.granted:
+                self._release_locked(ticket.quotas)
+
+    def _timeout_error(self, provider: str, model: Optional[str]) -> requests.HTTPError:
+        logger.warning("[llm-limiter] queue timeout provider=%s model=%s", provider, model)
+        return requests.HTTPError(
+            f"LLM limiter: no {provider} capacity within {self.queue_timeout:.0f}s (model={model})"
+        )
+
+    def acquire(self, provider: str, model: Optional[str], messages: List[Dict[str, Any]]) -> Permit:
+        ticket = self._enqueue(provider, model, messages)
+        if ticket is None:
+            return Permit(self, [])
+        deadline = time.monotonic() + self.queue_timeout
+        with self._cond:
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait = self._dispatch_locked()
+                if not ticket.granted:
+                    self._cond.wait(min(remaining, wait))
+        if not ticket.granted:
+            self._abandon(ticket)
+            raise self._timeout_error(provider, model)
+        return Permit(self, ticket.quotas)
+
+    async def aacquire(self, provider: str, model: Optional[str], messages: List[Dict[str, Any]]) -> Permit:
+        ticket = self._enqueue(provider, model, messages)
+        if ticket is None:
+            return Permit(self, [])
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            while not ticket.granted:
+                if time.monotonic() >= deadline:
+                    raise self._timeout_error(provider, model)
+                with self._cond:
+                    wait = self._dispatch_locked()
+                if not ticket.granted:
+                    await asyncio.sleep(min(wait, _MAX_POLL_SEC))
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        return Permit(self, ticket.quotas)
+
+    def _release_locked(self, quotas: List[_Quota]) -> None:
+        for q in quotas:
+            q.active = max(0, q.active - 1)
+        self._dispatch_locked()
+
+    def _release(self, quotas: List[_Quota]) -> None:
+        if not quotas:
+            return
+        with self._cond:
+            self._release_locked(quotas)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queued": {lane: len(q) for lane, q in self._lanes.items()},
+                "quotas": {q.name: q.stats() for q in [*self._providers.values(), *self._models.values()]},
+            }
+
+
+def load_limits(path: Optional[str] = None) -> Dict[str, Any]:
+    path = path or os.environ.get("OMNIA_LLM_LIMITS_FILE") or DEFAULT_LIMITS_PATH
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning("[llm-limiter] cannot read %s: %s (no limits)", path, e)
+        return {}
+
+
+_scheduler: Optional[LlmScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_llm_scheduler() -> LlmScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            raw = (os.environ.get("OMNIA_LLM_QUEUE_TIMEOUT_SEC") or "").strip()
+            try:
+                timeout = float(raw) if raw else DEFAULT_QUEUE_TIMEOUT_SEC
+            except ValueError:
+                timeout = DEFAULT_QUEUE_TIMEOUT_SEC
+            _scheduler = LlmScheduler(load_limits(), queue_timeout=timeout)
+        return _scheduler
@@ -0,0 +1,119 @@
+"""
+Preload opzionale dei modelli locali all'avvio di FastAPI.
+
+Con OMNIA_PRELOAD_MODELS attivo ("1"/"true"/"all", oppure lista tipo
+"embeddings,spacy") lo startup avvia in background il caricamento di
+SentenceTransformer e spaCy, seguito da un encode/parse di warm-up.
+Finché il warm-up non termina /api/ping risponde 503 (ready=false), così il
+load balancer non instrada traffico verso worker ancora freddi.
+Senza la variabile il comportamento resta lazy (modelli caricati alla prima richiesta).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+KNOWN_MODELS = ("embeddings", "spacy")
+
+_WARMUP_TEXT = "Sono nato il 16 dicembre 1980 a Milano"
+
+_lock = threading.Lock()
+_state: Dict[str, Any] = {"status": "idle", "models": {}}
+
+
+def preload_models() -> List[str]:
+    """Modelli da precaricare secondo OMNIA_PRELOAD_MODELS (lista vuota = preload disattivo)."""
+    raw = (os.environ.get("OMNIA_PRELOAD_MODELS") or "").strip().lower()
+    if not raw or raw in ("0", "false", "no", "off"):
+        return []
+    if raw in ("1", "true", "yes", "on", "all"):
+        return list(KNOWN_MODELS)
+    return [m.strip() for m in raw.split(",") if m.strip() in KNOWN_MODELS]
+
+
+def _warmup_embeddings() -> None:
+    from backend.ai_endpoints.intent_embeddings import _get_local_model
+
+    model = _get_local_model()
+    model.encode([_WARMUP_TEXT], normalize_embeddings=True)
+
+
+def _warmup_spacy() -> None:
+    from backend import ner_spacy
+
+    nlp = ner_spacy._get_nlp()
+    if nlp is None:
+        raise RuntimeError(ner_spacy._load_error or "spaCy model not available")
+    nlp(_WARMUP_TEXT)
+
+
+_WARMUPS: Dict[str, Callable[[], None]] = {
+    "embeddings": _warmup_embeddings,
+    "spacy": _warmup_spacy,
+}
+
+# Warm-up sul pool di encoding (embedding_executor) invece che sull'executor di default:
+# load ed encode del modello restano serializzati con quelli delle richieste
+_ENCODE_POOL_WARMUPS = ("embeddings",)
+
+
+def _set_model_state(name: str, **fields: Any) -> None:
+    with _lock:
+        _state["models"].setdefault(name, {}).update(fields)
+
+
+def start_model_warmup() -> Optional[asyncio.Task]:
+    """
+    Da chiamare nello startup FastAPI: se il preload è attivo marca subito il worker
+    come non pronto e avvia il warm-up come task in background.
+    """
+    models = preload_models()
+    if not models:
+        return None
+    with _lock:
+        _state["status"] = "warming"
+        _state["models"] = {name: {"status": "pending"} for name in models}
+    print(f"[INFO] Model warm-up started: {', '.join(models)}")
+    return asyncio.get_running_loop().create_task(_run_model_warmup(models))
+
+
+async def _run_model_warmup(models: List[str]) -> None:
+    """Carica e scalda i modelli richiesti in un thread, senza bloccare l'event loop."""
+    loop = asyncio.get_running_loop()
+    for name in models:
+        _set_model_state(name, status="loading")
+        start = time.time()
+        try:
+            if name in _ENCODE_POOL_WARMUPS:
+                from backend.ai_endpoints.embedding_executor import run_encode
+                await run_encode(_WARMUPS[name], wait=True)
+            else:
+                await loop.run_in_executor(None, _WARMUPS[name])
+            _set_model_state(name, status="ready", seconds=round(time.time() - start, 2))
+            print(f"[INFO] Model warm-up: {name} ready in {time.time() - start:.2f}s")
+        except Exception as e:
+            # Un modello opzionale mancante non deve tenere il worker fuori dal bilanciamento
+            _set_model_state(name, status="failed", seconds=round(time.time() - start, 2), error=str(e))
+            logger.warning("[warmup] %s failed: %s", name, e)
+            print(f"[WARN] Model warm-up: {name} failed: {e}")
+
+    with _lock:
+        _state["status"] = "done"
+
+
+def warmup_status() -> Dict[str, Any]:
+    """ready=False solo mentre un preload è in corso."""
+    with _lock:
+        status = _state["status"]
+        return {
+            "ready": status != "warming",
+            "status": status,
+            "models": {k: dict(v) for k, v in _state["models"].items()},
+        }
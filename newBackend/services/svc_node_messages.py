@@ -0,0 +1,350 @@
+"""
+Generazione incrementale dei messaggi di un nodo (/api/nlp/generate-node-messages).
+
+Ogni voce della messageMatrix ha un hash (contratto del nodo, nodeLabel, locale,
+provider, stepType, guid, escalationIndex): i testi già generati per voci invariate
+vengono riusati e all'AI va solo il sottoinsieme cambiato. Le matrici grandi sono
+divise in sotto-batch (al massimo OMNIA_NODE_MESSAGES_BATCH_SIZE voci, le voci
+dello stesso stepType restano insieme per le escalation) eseguiti in parallelo
+(OMNIA_NODE_MESSAGES_CONCURRENCY).
+
+Cache: OMNIA_NODE_MESSAGES_CACHE (memory | redis | off, default memory),
+OMNIA_NODE_MESSAGES_CACHE_TTL_SEC; Redis da OMNIA_LLM_CACHE_REDIS_URL.
+I testi di fallback non vengono mai messi in cache.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.llm_singleflight import flight_key
+from newBackend.services.svc_ai_client import chat_json
+from newBackend.services.svc_llm_cache import DEFAULT_REDIS_URL, LlmResponseCache
+from newBackend.services.svc_llm_limiter import bind_llm_lane
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 12
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CACHE_TTL_SEC = 7 * 24 * 3600.0
+DEFAULT_CACHE_MAX_ENTRIES = 20000
+
+# Da cambiare quando cambia il prompt: invalida i testi in cache
+PROMPT_VERSION = 1
+
+# Note: 'invalid' is generated automatically from constraints, not from AI messages
+STEP_DESCRIPTIONS = {
+    "start": "Initial message to ask for the data",
+    "noMatch": "Escalation messages when user input doesn't match (progressively more polite)",
+    "noInput": "Escalation messages when user doesn't respond (progressively more polite)",
+    "confirmation": "Message to confirm the input with {{input}} placeholder",
+    "notConfirmed": "Message when user doesn't confirm",
+    "success": "Success message when data is collected"
+}
+
+# stepType con livelli di escalation: il livello reale va sempre nel prompt
+ESCALATION_STEP_TYPES = ("noMatch", "noInput")
+
+SYSTEM_MESSAGE = (
+    "You are a Dialogue Messages Generator. "
+    "Your task is to generate natural, spoken messages for a voice-based customer care system. "
+    "Return ONLY valid JSON, no markdown, no code fences, no comments."
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = int(raw)
+        return value if value > 0 else default
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = float(raw)
+        return value if value >= 0 else default
+    except ValueError:
+        return default
+
+
+def _group_by_step_type(message_matrix: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    # Raggruppa messageMatrix per stepType
+    messages_by_step_type: Dict[str, List[Dict[str, Any]]] = {}
+    for item in message_matrix:
+        step_type = item.get("stepType")
+        if step_type not in messages_by_step_type:
+            messages_by_step_type[step_type] = []
+        messages_by_step_type[step_type].append({
+            "guid": item.get("guid"),
+            "escalationIndex": item.get("escalationIndex", 0)
+        })
+    return messages_by_step_type
+
+
+def build_node_messages_prompt(
+    node_label: str,
+    contract: Dict[str, Any],
+    message_matrix: List[Dict[str, Any]],
+    locale: str,
+) -> Tuple[List[Dict[str, str]], List[str]]:
+    """Prompt con TUTTI gli stepType della matrice: (messages, guid_list)."""
+    prompt_parts = [
+        f"Generate ALL dialogue messages for the field '{node_label}'.",
+        f"",
+        f"Context:",
+        f"- Field: {node_label}",
+        f"- Type: {contract.get('entity', {}).get('kind', 'string')}",
+        f"- Locale: {locale}",
+        f"",
+        f"Generate the following messages:",
+        f""
+    ]
+
+    guid_list = []
+    for step_type, items in _group_by_step_type(message_matrix).items():
+        description = STEP_DESCRIPTIONS.get(step_type, f"Messages for {step_type}")
+        count = len(items)
+        # In modalità incrementale il gruppo può contenere solo alcuni livelli (es. il 3°):
+        # si usa l'escalationIndex dell'item, non la posizione nel gruppo
+        escalated = step_type in ESCALATION_STEP_TYPES or any(item["escalationIndex"] for item in items)
+
+        prompt_parts.append(f"{count}. {step_type.upper()} ({description}):")
+        for item in items:
+            guid = item["guid"]
+            if escalated:
+                prompt_parts.append(f"   - GUID: {guid} (escalation {item['escalationIndex'] + 1})")
+            else:
+                prompt_parts.append(f"   - GUID: {guid}")
+            guid_list.append(guid)
+        prompt_parts.append("")
+
+    prompt_parts.extend([
+        f"Return a JSON object mapping each GUID to its message text:",
+        f"{{",
+        *[f'  "{guid}": "message text {i}",' for i, guid in enumerate(guid_list[:2], 1)],
+        f"  ...",
+        f"}}",
+        f"",
+        f"Requirements:",
+        f"- Messages must be natural, spoken Italian (locale: {locale})",
+        f"- Messages must be appropriate for voice-based customer care",
+        f"- Escalation messages must be progressively more polite",
+        f"- Use {{input}} placeholder in confirmation messages",
+        f"- Keep messages concise and clear"
+    ])
+
+    messages = [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": "\n".join(prompt_parts)}
+    ]
+    return messages, guid_list
+
+
+def parse_messages_map(ai_response: Any) -> Dict[str, Any]:
+    """Risposta AI -> mappa GUID -> testo (non ancora validata)."""
+    if isinstance(ai_response, str):
+        result = json.loads(ai_response)
+    else:
+        result = ai_response
+
+    # Validate response structure
+    if not isinstance(result, dict):
+        raise ValueError("AI response is not a dictionary")
+
+    # Extract messages map
+    messages_map = result.get("messages")
+    if not isinstance(messages_map, dict):
+        # Fallback: the prompt asks for a root-level GUID map
+        messages_map = {k: v for k, v in result.items() if k != "success" and k != "error"}
+    return messages_map
+
+
+def generated_texts(messages_map: Dict[str, Any], guid_list: List[str]) -> Dict[str, str]:
+    """Solo i testi validi restituiti dall'AI per i GUID richiesti."""
+    return {
+        guid: str(text).strip()
+        for guid, text in messages_map.items()
+        if guid in guid_list and isinstance(text, (str, int, float)) and str(text).strip()
+    }
+
+
+def fallback_message(contract: Dict[str, Any], step_type: Optional[str]) -> str:
+    entity_label = contract.get("entity", {}).get("label", "value")
+    fallbacks = {
+        "start": f"Mi dica la sua {entity_label.lower()}",
+        "noMatch": "Può ripetere?",
+        "noInput": "Non ho sentito, può ripetere?",
+        "confirmation": f"Confermi: {{input}}?",
+        "notConfirmed": f"Qual è la {entity_label.lower()} corretta?",
+        "success": "Perfetto, grazie."
+    }
+    if step_type and step_type in fallbacks:
+        return fallbacks[step_type]
+    return f"Messaggio per {entity_label}"
+
+
+def complete_with_fallbacks(
+    texts: Dict[str, str],
+    contract: Dict[str, Any],
+    message_matrix: List[Dict[str, Any]],
+    guid_list: List[str],
+) -> Dict[str, str]:
+    """Tutti i GUID di guid_list: testo generato o fallback per stepType."""
+    missing_guids = [guid for guid in guid_list if guid not in texts]
+    if not missing_guids:
+        return dict(texts)
+    print(f"[generate-node-messages] Warning: Missing GUIDs in response: {missing_guids}", flush=True)
+    step_types = {item.get("guid"): item.get("stepType") for item in message_matrix}
+    completed = dict(texts)
+    for guid in missing_guids:
+        completed[guid] = fallback_message(contract, step_types.get(guid))
+    return completed
+
+
+def item_key(
+    item: Dict[str, Any],
+    node_label: str,
+    contract: Dict[str, Any],
+    locale: str,
+    provider: str,
+) -> str:
+    return flight_key(
+        "node-messages", PROMPT_VERSION, provider, locale, node_label, contract,
+        item.get("stepType"), item.get("guid"), item.get("escalationIndex", 0)
+    )
+
+
+def create_node_messages_cache() -> LlmResponseCache:
+    return LlmResponseCache(
+        mode=(os.environ.get("OMNIA_NODE_MESSAGES_CACHE") or "memory").strip().lower(),
+        ttl_sec=_env_float("OMNIA_NODE_MESSAGES_CACHE_TTL_SEC", DEFAULT_CACHE_TTL_SEC),
+        max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+        redis_url=os.environ.get("OMNIA_LLM_CACHE_REDIS_URL") or DEFAULT_REDIS_URL,
+        redis_prefix="omnia:node-messages:",
+    )
+
+
+_node_messages_cache: Optional[LlmResponseCache] = None
+
+
+def get_node_messages_cache() -> LlmResponseCache:
+    global _node_messages_cache
+    if _node_messages_cache is None:
+        _node_messages_cache = create_node_messages_cache()
+    return _node_messages_cache
+
+
+def remember_texts(
+    texts: Dict[str, str],
+    node_label: str,
+    contract: Dict[str, Any],
+    message_matrix: List[Dict[str, Any]],
+    locale: str,
+    provider: str,
+) -> None:
+    """Mette in cache i testi generati dall'AI (usato anche dalla variante streaming)."""
+    cache = get_node_messages_cache()
+    for item in message_matrix:
+        text = texts.get(item.get("guid"))
+        if text:
+            cache.put(item_key(item, node_label, contract, locale, provider), text)
+
+
+def split_batches(message_matrix: List[Dict[str, Any]], batch_size: int) -> List[List[Dict[str, Any]]]:
+    """Sotto-batch di al massimo batch_size voci; un gruppo di stepType non viene spezzato."""
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for item in message_matrix:
+        groups.setdefault(item.get("stepType"), []).append(item)
+
+    batches: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    for group in groups.values():
+        if current and len(current) + len(group) > batch_size:
+            batches.append(current)
+            current = []
+        current.extend(group)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _generate_batch(
+    batch: List[Dict[str, Any]],
+    node_label: str,
+    contract: Dict[str, Any],
+    locale: str,
+    provider: str,
+    use_cache: bool,
+) -> Dict[str, str]:
+    messages, guid_list = build_node_messages_prompt(node_label, contract, batch, locale)
+    ai_response = chat_json(messages, provider=provider, use_cache=use_cache)
+    return generated_texts(parse_messages_map(ai_response), guid_list)
+
+
+def generate_node_messages(
+    node_label: str,
+    contract: Dict[str, Any],
+    message_matrix: List[Dict[str, Any]],
+    locale: str = "it",
+    provider: str = "openai",
+    use_cache: bool = True,
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Messaggi per tutti i GUID della matrice, riusando quelli invariati.
+    Ritorna {"messages": {guid: testo}, "cache": {"reused", "generated", "fallbacks"}}.
+    Solleva l'errore dell'AI solo se tutti i sotto-batch falliscono.
+    """
+    batch_size = batch_size or _env_int("OMNIA_NODE_MESSAGES_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    concurrency = concurrency or _env_int("OMNIA_NODE_MESSAGES_CONCURRENCY", DEFAULT_CONCURRENCY)
+    cache = get_node_messages_cache()
+    guid_list = [item.get("guid") for item in message_matrix]
+
+    texts: Dict[str, str] = {}
+    changed: List[Dict[str, Any]] = []
+    for item in message_matrix:
+        cached = cache.get(item_key(item, node_label, contract, locale, provider)) if use_cache else None
+        if cached:
+            texts[item.get("guid")] = cached
+        else:
+            changed.append(item)
+    reused = len(texts)
+
+    generated: Dict[str, str] = {}
+    if changed:
+        batches = split_batches(changed, batch_size)
+
+        def run(batch: List[Dict[str, Any]]) -> Tuple[Dict[str, str], Optional[Exception]]:
+            try:
+                return _generate_batch(batch, node_label, contract, locale, provider, use_cache), None
+            except Exception as e:
+                logger.warning("[generate-node-messages] sub-batch of %d failed: %s", len(batch), e)
+                return {}, e
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batches)), thread_name_prefix="node-messages") as pool:
+            results = list(pool.map(bind_llm_lane(run), batches))
+        errors = [e for _, e in results if e is not None]
+        if len(errors) == len(results):
+            raise errors[0]
+        for batch_texts, _ in results:
+            generated.update(batch_texts)
+        remember_texts(generated, node_label, contract, changed, locale, provider)
+        texts.update(generated)
+
+    completed = complete_with_fallbacks(texts, contract, message_matrix, guid_list)
+    return {
+        "messages": completed,
+        "cache": {
+            "reused": reused,
+            "generated": len(generated),
+            "fallbacks": len(completed) - len(texts),
+        },
+    }
@@ -0,0 +1,371 @@
+"""
+Engine Planner per /api/nlp/plan-engines.
+
+Due modalità:
+- ``batch`` (default): tutti i nodi in un solo prompt, come sempre
+- ``perNode``: i nodi vengono pianificati a blocchi di OMNIA_PLAN_ENGINES_CHUNK_SIZE
+  in parallelo (al massimo OMNIA_PLAN_ENGINES_CONCURRENCY chiamate insieme) e i
+  parsersPlan vengono uniti. Un blocco che fallisce non fa fallire il piano: i suoi
+  nodi ricevono il fallback ["llm"] e sono riportati in failedNodes.
+
+In modalità perNode il piano di ogni nodo è in cache per hash del nodo
+(nodeLabel + dataStructure + provider): dopo la modifica di un nodo viene
+richiesto all'AI solo quel nodo. Cache: OMNIA_PLAN_ENGINES_CACHE (memory | redis | off,
+default memory), OMNIA_PLAN_ENGINES_CACHE_TTL_SEC; Redis da OMNIA_LLM_CACHE_REDIS_URL.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.llm_singleflight import flight_key
+from newBackend.services.svc_ai_client import chat_json
+from newBackend.services.svc_llm_cache import DEFAULT_REDIS_URL, LlmResponseCache
+from newBackend.services.svc_llm_limiter import bind_llm_lane
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CACHE_TTL_SEC = 24 * 3600.0
+DEFAULT_CACHE_MAX_ENTRIES = 5000
+
+# Da cambiare quando cambia il prompt: invalida i piani in cache
+PROMPT_VERSION = 1
+
+# ✅ Engine priority order (escalation order)
+ENGINE_PRIORITY = {
+    "regex": 1,
+    "rule_based": 2,
+    "ner": 3,
+    "embedding": 4,
+    "llm": 5
+}
+VALID_ENGINE_TYPES = ["regex", "rule_based", "ner", "llm", "embedding"]
+FALLBACK_ENGINES = ["llm"]
+
+SYSTEM_MESSAGE = (
+    "You are an Engine Planner. "
+    "Your task is to determine the minimal set of extraction engines required for each node independently. "
+    "Return ONLY valid JSON with parsersPlan array, no markdown, no code fences, no comments."
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = int(raw)
+        return value if value > 0 else default
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        value = float(raw)
+        return value if value >= 0 else default
+    except ValueError:
+        return default
+
+
+def _data_structure(node: Dict[str, Any]) -> Dict[str, Any]:
+    contract = node.get("contract", {}) or {}
+    return {
+        "entity": contract.get("entity", {}),
+        "subEntities": contract.get("subEntities", [])
+    }
+
+
+def build_plan_messages(nodes: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Prompt dell'Engine Planner per i nodi dati (nodeId, nodeLabel, dataStructure)."""
+    nodes_sections = []
+    for n in nodes:
+        node_id = n.get("nodeId", "unknown")
+        node_label = n.get("nodeLabel", "unknown")
+
+        # Build individual node section
+        node_section = f"""
+NODE {node_id}:
+- nodeId: {node_id}
+- nodeLabel: {node_label}
+- dataStructure:
+{json.dumps(_data_structure(n), indent=2, ensure_ascii=False)}
+"""
+        nodes_sections.append(node_section)
+
+    # Combine all node sections
+    nodes_section = "\n".join(nodes_sections)
+
+    prompt = f"""You are an Engine Planner.
+
+Your task is to determine the minimal set of extraction engines required
+to interpret the user's answer for EACH NODE independently.
+
+You will receive multiple nodes.
+Each node has:
+- nodeId
+- nodeLabel (the task label)
+- dataStructure (the structure of the data to extract)
+
+You MUST evaluate each node independently.
+Nodes MUST NOT influence each other.
+Do NOT compare nodes.
+Do NOT merge logic across nodes.
+Each node must receive its own engine plan.
+
+------------------------------------------------------------
+AVAILABLE ENGINES
+------------------------------------------------------------
+You can choose between 5 extraction engines:
+
+1. regex
+2. rule_based
+3. ner
+4. embedding
+5. llm
+
+------------------------------------------------------------
+ENGINE PRIORITY (FROM CHEAPEST TO MOST EXPENSIVE)
+------------------------------------------------------------
+1. regex      — always preferred when possible
+2. rule_based — for composite or multi-field structures
+3. ner        — for semantic ambiguity in natural language
+4. embedding  — for canonical values or similarity matching
+5. llm        — ALWAYS included as final fallback
+
+------------------------------------------------------------
+MANDATORY RULE (CRITICAL)
+------------------------------------------------------------
+LLM MUST ALWAYS be included as the final fallback engine
+for EVERY NODE, including boolean yes/no tasks.
+
+This is NOT optional.
+
+------------------------------------------------------------
+PRIMARY DECISION DRIVER
+------------------------------------------------------------
+The engine selection MUST be based primarily on the nodeLabel
+(the semantic meaning of the task).
+
+The dataStructure is secondary and should only be used to detect:
+- whether the node is composite (→ rule_based)
+- whether canonical values exist (→ embedding)
+
+Do NOT use the dataStructure as the main driver.
+
+------------------------------------------------------------
+ENGINE SELECTION RULES (CRITICAL)
+------------------------------------------------------------
+
+1. BOOLEAN TASKS:
+   If the nodeLabel expresses a yes/no question (e.g., contains verbs like "ha", "possiede", "esiste", "è disponibile", "è presente", "verifica se", "chiedi se", "controlla se"):
+   - You MUST ALWAYS include: ["regex", "llm"] for this node.
+   - Regex is used to capture yes/no answers and their synonyms.
+   - llm is always the final fallback.
+
+2. FREE-TEXT / DISCURSIVE TASKS:
+   If the task expects a free-text or discursive answer (e.g., labels like "motivo", "descrizione", "cosa è successo", "problema", "note", "commento", "racconto", "spiegazione"):
+   - You MUST NOT include the regex engine.
+   - Regex cannot extract free-form natural language.
+   - Use: ["llm"] only (NER is not useful for free-text without specific entities).
+
+3. COMPOSITE ENTITIES:
+   If the dataStructure (contract) shows that the node represents a composite entity with multiple subfields
+   (e.g., address, personal data, structured records):
+   - You MUST NOT include the regex engine.
+   - Use: ["rule_based", "llm"].
+
+4. CANONICAL VALUES:
+   If the node has canonical values (a closed list of possible values):
+   - If the values are simple, short, and have few or no synonyms (e.g., "rosso, verde, blu", "passaporto, carta d'identità, patente"):
+     → regex MAY be included together with llm (e.g., ["regex", "llm"]).
+   - If the values require semantic interpretation, synonyms, or many linguistic variants:
+     → DO NOT include regex.
+     → Use: ["embedding", "llm"].
+
+5. RIGID PATTERNS:
+   If the expected answer follows a strict, predictable pattern (e.g., codes, numbers, dates in fixed format, CAP, codice fiscale, email, phone):
+   - You SHOULD include regex (e.g., ["regex", "llm"]).
+
+6. LLM ALWAYS:
+   For EVERY node, llm MUST ALWAYS be included as the final fallback engine.
+   This is NOT optional.
+
+7. NODE INDEPENDENCE:
+   You MUST evaluate each node independently.
+   Nodes MUST NOT influence each other.
+   Do NOT compare nodes or merge logic across nodes.
+
+------------------------------------------------------------
+INPUT NODES
+------------------------------------------------------------
+Below are the nodes you must evaluate:
+
+{nodes_section}
+
+------------------------------------------------------------
+OUTPUT FORMAT (strict JSON)
+------------------------------------------------------------
+{{
+  "parsersPlan": [
+    {{ "nodeId": "NODE_ID_1", "engines": ["regex", "llm"] }},
+    {{ "nodeId": "NODE_ID_2", "engines": ["regex", "rule_based", "llm"] }},
+    {{ "nodeId": "NODE_ID_3", "engines": ["regex", "embedding", "llm"] }}
+  ]
+}}
+
+- Include EXACTLY one entry per node.
+- Engines must be in priority order.
+- Return ONLY the JSON object."""
+
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def sort_engines(engines: List[Any]) -> List[str]:
+    """Engine validi in ordine di priorità, con llm sempre ultimo."""
+    valid_engines = [e for e in engines if e in VALID_ENGINE_TYPES]
+    valid_engines_sorted = sorted(valid_engines, key=lambda e: ENGINE_PRIORITY.get(e, 999))
+    if "llm" in valid_engines_sorted:
+        valid_engines_sorted.remove("llm")
+        valid_engines_sorted.append("llm")
+    return valid_engines_sorted
+
+
+def parse_plan_response(ai_response: Any) -> List[Dict[str, Any]]:
+    """Risposta AI -> lista validata di {nodeId, engines}; ValueError se non utilizzabile."""
+    if isinstance(ai_response, str):
+        result = json.loads(ai_response)
+    else:
+        result = ai_response
+
+    # Validate response structure
+    if not isinstance(result, dict) or "parsersPlan" not in result:
+        raise ValueError("AI response must contain parsersPlan array")
+
+    parsers_plan = result.get("parsersPlan", [])
+    if not isinstance(parsers_plan, list):
+        raise ValueError("parsersPlan must be an array")
+
+    validated_plan = []
+    for entry in parsers_plan:
+        if not isinstance(entry, dict):
+            continue
+        node_id = entry.get("nodeId")
+        engines = entry.get("engines", [])
+        if node_id and isinstance(engines, list):
+            valid_engines = sort_engines(engines)
+            if valid_engines:
+                validated_plan.append({
+                    "nodeId": node_id,
+                    "engines": valid_engines
+                })
+    return validated_plan
+
+
+def plan_batch(nodes: List[Dict[str, Any]], provider: str, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """Tutti i nodi in una sola chiamata (modalità storica)."""
+    ai_response = chat_json(build_plan_messages(nodes), provider=provider, use_cache=use_cache)
+    validated_plan = parse_plan_response(ai_response)
+    if len(validated_plan) == 0:
+        raise ValueError("No valid engine plans found in AI response")
+    return validated_plan
+
+
+def node_plan_key(node: Dict[str, Any], provider: str) -> str:
+    """Hash del contratto del nodo: nodeId escluso, lo stesso nodo spostato resta in cache."""
+    return flight_key("plan-engines", PROMPT_VERSION, provider, node.get("nodeLabel", "unknown"), _data_structure(node))
+
+
+def create_plan_cache() -> LlmResponseCache:
+    return LlmResponseCache(
+        mode=(os.environ.get("OMNIA_PLAN_ENGINES_CACHE") or "memory").strip().lower(),
+        ttl_sec=_env_float("OMNIA_PLAN_ENGINES_CACHE_TTL_SEC", DEFAULT_CACHE_TTL_SEC),
+        max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+        redis_url=os.environ.get("OMNIA_LLM_CACHE_REDIS_URL") or DEFAULT_REDIS_URL,
+        redis_prefix="omnia:plan-engines:",
+    )
+
+
+_plan_cache: Optional[LlmResponseCache] = None
+
+
+def get_plan_cache() -> LlmResponseCache:
+    global _plan_cache
+    if _plan_cache is None:
+        _plan_cache = create_plan_cache()
+    return _plan_cache
+
+
+def _plan_chunk(chunk: List[Dict[str, Any]], provider: str, use_cache: bool) -> Tuple[Dict[str, List[str]], Optional[str]]:
+    """Pianifica un blocco di nodi: (nodeId -> engines, errore o None)."""
+    try:
+        ai_response = chat_json(build_plan_messages(chunk), provider=provider, use_cache=use_cache)
+        return {p["nodeId"]: p["engines"] for p in parse_plan_response(ai_response)}, None
+    except Exception as e:
+        logger.warning("[plan-engines] chunk %s failed: %s", [n.get("nodeId") for n in chunk], e)
+        return {}, str(e)
+
+
+def plan_per_node(
+    nodes: List[Dict[str, Any]],
+    provider: str,
+    use_cache: bool = True,
+    chunk_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Pianificazione a blocchi paralleli con cache per nodo.
+    Ritorna {"parsersPlan", "failedNodes", "cache": {"hits", "misses"}} nell'ordine dei nodi.
+    """
+    chunk_size = chunk_size or _env_int("OMNIA_PLAN_ENGINES_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    concurrency = concurrency or _env_int("OMNIA_PLAN_ENGINES_CONCURRENCY", DEFAULT_CONCURRENCY)
+    cache = get_plan_cache()
+
+    planned: Dict[int, List[str]] = {}
+    keys: Dict[int, str] = {}
+    missing: List[int] = []
+    for i, node in enumerate(nodes):
+        keys[i] = node_plan_key(node, provider)
+        cached = cache.get(keys[i]) if use_cache else None
+        engines = sort_engines(json.loads(cached)) if cached else []
+        if engines:
+            planned[i] = engines
+        else:
+            missing.append(i)
+    hits = len(planned)
+
+    failed: Dict[int, str] = {}
+    if missing:
+        chunks = [missing[k:k + chunk_size] for k in range(0, len(missing), chunk_size)]
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks)), thread_name_prefix="plan-engines") as pool:
+            results = list(pool.map(
+                bind_llm_lane(lambda idx: _plan_chunk([nodes[i] for i in idx], provider, use_cache)), chunks
+            ))
+        for idx, (by_node_id, error) in zip(chunks, results):
+            for i in idx:
+                engines = by_node_id.get(nodes[i].get("nodeId", "unknown"))
+                if engines:
+                    planned[i] = engines
+                    cache.put(keys[i], json.dumps(engines))
+                else:
+                    failed[i] = error or "Node missing from AI response"
+
+    parsers_plan = []
+    for i, node in enumerate(nodes):
+        parsers_plan.append({
+            "nodeId": node.get("nodeId", "unknown"),
+            "engines": planned.get(i, list(FALLBACK_ENGINES))
+        })
+    return {
+        "parsersPlan": parsers_plan,
+        "failedNodes": [{"nodeId": nodes[i].get("nodeId", "unknown"), "error": failed[i]} for i in sorted(failed)],
+        "cache": {"hits": hits, "misses": len(missing)},
+    }
@@ -0,0 +1,115 @@
+"""
+Helper per le risposte Server-Sent Events degli endpoint di generazione.
+
+Eventi emessi da stream_generation:
+- ``start``: subito, prima della chiamata al provider (time-to-first-byte basso)
+- ``token``: ogni frammento di testo ricevuto dal provider ({"delta": "..."})
+- ``field``: ogni coppia chiave/valore di primo livello del JSON appena completa
+  ({"key": ..., "value": ...}), utile per mostrare i risultati man mano
+- ``done``: il risultato finale, con la stessa forma dell'endpoint non streaming
+- ``error``: {"success": False, "error": "..."}; lo stream termina
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from starlette.responses import StreamingResponse
+
+from newBackend.services.svc_ai_client import astream_chat
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: Any) -> str:
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class JsonFieldStream:
+    """
+    Parser incrementale dei campi di primo livello di un oggetto JSON in arrivo a pezzi.
+    feed() ritorna le coppie (chiave, valore) completate dal frammento; il testo
+    già esaminato non viene riletto.
+    """
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._field_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self._buf += chunk
+        fields: List[Tuple[str, Any]] = []
+        buf = self._buf
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 1 and ch == "{":
+                    self._field_start = i + 1
+            elif ch in "}]":
+                if self._depth == 1:
+                    self._emit(buf, i, fields)
+                self._depth -= 1
+            elif ch == "," and self._depth == 1:
+                self._emit(buf, i, fields)
+                self._field_start = i + 1
+        self._pos = len(buf)
+        return fields
+
+    def _emit(self, buf: str, end: int, fields: List[Tuple[str, Any]]) -> None:
+        if self._field_start is None:
+            return
+        segment = buf[self._field_start:end].strip()
+        if not segment:
+            return
+        try:
+            fields.extend(json.loads("{" + segment + "}").items())
+        except ValueError:
+            pass
+
+
+async def stream_generation(
+    messages: List[Dict[str, Any]],
+    provider: str,
+    finalize: Callable[[Any], Dict[str, Any]],
+    log_tag: str,
+    use_cache: bool = True,
+) -> AsyncIterator[str]:
+    """Genera gli eventi SSE per una chiamata JSON; finalize(risposta) costruisce il payload di done."""
+    yield sse_event("start", {"provider": provider})
+    fields = JsonFieldStream()
+    parts: List[str] = []
+    try:
+        async for delta in astream_chat(messages, provider=provider, json_mode=True, use_cache=use_cache):
+            parts.append(delta)
+            yield sse_event("token", {"delta": delta})
+            for key, value in fields.feed(delta):
+                yield sse_event("field", {"key": key, "value": value})
+        yield sse_event("done", finalize("".join(parts)))
+    except Exception as e:
+        print(f"[{log_tag}][stream] Error: {str(e)}", flush=True)
+        logger.debug("stream error", exc_info=True)
+        yield sse_event("error", {"success": False, "error": str(e)})
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)